@@ -0,0 +1,37 @@
+import numpy as np
+
+from history_analytics import PERIODS, load_period_stats
+
+TIMESERIES_COLUMNS = ['count', 'unique_listings', 'mean_price', 'median_price', 'min_price', 'max_price',
+                      'p10_price', 'p25_price', 'p75_price', 'p90_price']
+
+
+def price_histogram(counts, bins=20, min_price=None, max_price=None):
+    # Гистограмма по готовым количествам цен: стоимость зависит от числа различных цен, а не строк
+    counts = np.array(counts, dtype='float64').reshape(-1, 2)
+    prices, weights = counts[:, 0], counts[:, 1]
+    mask = np.ones(len(prices), dtype=bool)
+    if min_price is not None:
+        mask &= prices >= min_price
+    if max_price is not None:
+        mask &= prices <= max_price
+    prices, weights = prices[mask], weights[mask]
+    if not len(prices):
+        return []
+
+    low = min_price if min_price is not None else prices.min()
+    high = max_price if max_price is not None else prices.max()
+    values, edges = np.histogram(prices, bins=bins, range=(low, high if high > low else low + 1), weights=weights)
+    return [
+        {"start": float(start), "end": float(end), "count": int(value)}
+        for start, end, value in zip(edges[:-1], edges[1:], values)
+    ]
+
+
+def price_timeseries(path, period='day'):
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period: {period}")
+    stats = load_period_stats(period, path)
+    columns = [column for column in TIMESERIES_COLUMNS if column in stats.columns]
+    stats = stats[['period_start'] + columns]
+    return stats.astype(object).where(stats.notna(), None).to_dict(orient='records')
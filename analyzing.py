@@ -6,13 +6,18 @@ from datetime import datetime
 import glob
 import numpy as np
 
+from change_detection import load_change_summary
+from history_analytics import load_period_stats, load_summary, update_analytics
+from storage import HISTORY_DB_PATH, migrate_csv_history, needs_migration, read_dataset
+
 def analyze_latest_data():
-    if not os.path.exists('data/real_estate_kommunarka_latest.csv'):
+    latest_files = [path for path in ('data/real_estate_kommunarka_latest.csv', 'data/real_estate_kommunarka_latest.parquet') if os.path.exists(path)]
+    if not latest_files:
         print("Файл с последними данными не найден. Сначала запустите скрапер.")
         return False
 
     print("Загружаем последние данные...")
-    df = pd.read_csv('data/real_estate_kommunarka_latest.csv')
+    df = read_dataset(latest_files[0])
 
     print(f"Анализ данных от {datetime.now().strftime('%Y-%m-%d %H:%M')}")
     print(f"Всего объявлений: {len(df)}")
@@ -20,7 +25,10 @@ def analyze_latest_data():
     print(f"Максимальная цена: {df['price'].max():,} ₽/мес")
     print(f"Средняя цена: {df['price'].mean():,.2f} ₽/мес")
     print(f"Медианная цена: {df['price'].median():,} ₽/мес")
+    if 'price_per_m2' in df.columns and df['price_per_m2'].notna().any():
+        print(f"Медианная цена за м²: {df['price_per_m2'].median():,.2f} ₽/мес")
 
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     os.makedirs('reports', exist_ok=True)
 
     with open(f'reports/stats_report_{timestamp}.txt', 'w', encoding='utf-8') as f:
@@ -32,46 +40,72 @@ def analyze_latest_data():
         f.write(f"Медианная цена: {df['price'].median():,} ₽/мес\n")
         f.write(f"Стандартное отклонение: {df['price'].std():,.2f} ₽/мес\n\n")
 
+        # Старые снимки без площади пропускаем
+        if 'price_per_m2' in df.columns and df['price_per_m2'].notna().any():
+            f.write(f"Медианная цена за м²: {df['price_per_m2'].median():,.2f} ₽/мес (площадь известна у {df['price_per_m2'].notna().sum()} объявлений)\n")
+            by_room = df.dropna(subset=['price_per_m2', 'room_type']).groupby('room_type', observed=True)
+            for room_type, group in by_room['price_per_m2']:
+                f.write(f"  {room_type}: медиана {group.median():,.2f} ₽/мес за м², объявлений {len(group)}\n")
+            f.write("\n")
+
 
     print(f"Отчет со статистикой сохранен в reports/stats_report_{timestamp}.txt")
 
     return True
 
+def format_period_stats(stats, label):
+    lines = [f"\n{label}: {start}\n"
+             f"  Количество объявлений: {count}\n"
+             f"  Средняя цена: {mean:,.2f} ₽/мес\n"
+             f"  Медианная цена: {median:,.2f} ₽/мес\n"
+             f"  Минимальная цена: {low:,} ₽/мес\n"
+             f"  Максимальная цена: {high:,} ₽/мес\n"
+             for start, count, mean, median, low, high in zip(
+                 stats['period_start'], stats['count'], stats['mean_price'],
+                 stats['median_price'], stats['min_price'], stats['max_price'])]
+    return ''.join(lines)
+
 def analyze_historical_data():
-    if not os.path.exists('data/real_estate_kommunarka_history.csv'):
+    if needs_migration():
+        print("Переносим историю из CSV в базу...")
+        migrate_csv_history()
+
+    if not os.path.exists(HISTORY_DB_PATH):
         print("Файл с историческими данными не найден.")
         return False
 
-    print("Загружаем исторические данные...")
-    df = pd.read_csv('data/real_estate_kommunarka_history.csv')
+    print("Обновляем исторические показатели...")
+    processed = update_analytics()
+    print(f"Обработано новых записей истории: {processed}")
 
-    df['scraped_at'] = pd.to_datetime(df['scraped_at'])
-    df['date'] = df['scraped_at'].dt.date
+    daily_stats = load_period_stats('day')
+    weekly_stats = load_period_stats('week')
+    monthly_stats = load_period_stats('month')
+    summary = load_summary()
+    changes = load_change_summary()
 
-    daily_counts = df.groupby('date').size().reset_index(name='count')
+    if daily_stats.empty:
+        print("В истории пока нет данных.")
+        return False
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    os.makedirs('reports', exist_ok=True)
 
     with open(f'reports/historical_report_{timestamp}.txt', 'w', encoding='utf-8') as f:
         f.write(f"Исторический анализ данных по аренде квартир возле метро Коммунарка\n")
         f.write(f"Дата анализа: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-        f.write(f"Период данных: с {df['date'].min()} по {df['date'].max()}\n")
-        f.write(f"Всего уникальных объявлений за весь период: {df['id'].nunique()}\n\n")
-
-        f.write("Статистика по дням:\n")
-        daily_stats = df.groupby('date').agg(
-            количество=('id', 'count'),
-            средняя_цена=('price', 'mean'),
-            медиана_цены=('price', 'median'),
-            мин_цена=('price', 'min'),
-            макс_цена=('price', 'max')
-        ).reset_index()
-
-        for _, row in daily_stats.iterrows():
-            f.write(f"\nДата: {row['date']}\n")
-            f.write(f"  Количество объявлений: {row['количество']}\n")
-            f.write(f"  Средняя цена: {row['средняя_цена']:,.2f} ₽/мес\n")
-            f.write(f"  Медианная цена: {row['медиана_цены']:,.2f} ₽/мес\n")
-            f.write(f"  Минимальная цена: {row['мин_цена']:,} ₽/мес\n")
-            f.write(f"  Максимальная цена: {row['макс_цена']:,} ₽/мес\n")
+        f.write(f"Период данных: с {daily_stats['period_start'].iloc[0]} по {daily_stats['period_start'].iloc[-1]}\n")
+        f.write(f"Всего уникальных объявлений за весь период: {summary['listings']}\n")
+        f.write(f"Объявлений, у которых менялась цена: {summary['listings_with_changes']}\n")
+        f.write(f"Всего изменений цен: {summary['price_changes']}\n")
+        f.write(f"Сейчас в выдаче: {changes['active']}, снято с публикации: {changes['removed']}\n\n")
+
+        f.write("Статистика по месяцам:\n")
+        f.write(format_period_stats(monthly_stats, "Месяц"))
+        f.write("\nСтатистика по неделям:\n")
+        f.write(format_period_stats(weekly_stats, "Неделя с"))
+        f.write("\nСтатистика по дням:\n")
+        f.write(format_period_stats(daily_stats, "Дата"))
 
     print(f"Исторический отчет сохранен в reports/historical_report_{timestamp}.txt")
     return True
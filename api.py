@@ -1,9 +1,21 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
+import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
+
+import aggregations
+import chunked
+import export
+from dataset_cache import DatasetCache
+from listing_store import TIMESTAMP_FORMAT
+from metrics import prometheus_text, read_latest_summary
+from page_index import PageIndexCache
+from query_engine import InvalidCursor
+from storage import HISTORY_DB_PATH, price_counts
 
 app = FastAPI(title="Real Estate Data API")
 
@@ -16,103 +28,335 @@ app.add_middleware(
 )
 
 DATA_DIR = "data"
+DATA_EXTENSIONS = (".csv", ".parquet", ".sqlite")
+
+API_IO_WORKERS = int(os.getenv("API_IO_WORKERS", "8"))
+
+dataset_cache = DatasetCache()
+page_indexes = PageIndexCache()
+io_executor = ThreadPoolExecutor(max_workers=API_IO_WORKERS, thread_name_prefix="api-io")
+inflight = {}
+
+async def run_blocking(key, func, *args):
+    # Чтение файлов и pandas выполняются в пуле потоков, чтобы не блокировать event loop.
+    # Одновременные одинаковые запросы ждут один и тот же результат
+    future = inflight.get(key)
+    if future is None:
+        future = asyncio.get_running_loop().run_in_executor(io_executor, func, *args)
+        inflight[key] = future
+        future.add_done_callback(lambda _: inflight.pop(key, None))
+    return await asyncio.shield(future)
+
+def is_data_file(filename):
+    return (os.path.basename(filename) == filename and filename.startswith("real_estate_kommunarka_")
+            and filename.endswith(DATA_EXTENSIONS) and "_raw_" not in filename)
 
 def get_latest_data_file():
-    files = [f for f in os.listdir(DATA_DIR) if f.startswith("real_estate_kommunarka_") and not f.endswith("_raw_")]
+    files = [f for f in os.listdir(DATA_DIR) if is_data_file(f) and not f.endswith(".sqlite")]
     if not files:
         raise HTTPException(status_code=404, detail="No data files found")
     return os.path.join(DATA_DIR, sorted(files)[-1])
 
+def resolve_data_path(filename):
+    # Отдаем только файлы данных: сопроводительные .meta.json, сырые снимки и чужие пути - 404
+    if filename:
+        file_path = os.path.join(DATA_DIR, filename)
+        if not is_data_file(filename) or not os.path.exists(file_path):
+            raise HTTPException(status_code=404, detail="File not found")
+        return file_path
+    return get_latest_data_file()
+
 @app.get("/")
 async def root():
     return {"message": "Real Estate Data API"}
 
-@app.get("/files")
-async def list_files():
+def snapshot_files():
+    # Снимок пишется и в CSV, и в Parquet; в списке он один, под именем CSV, если оно есть
+    names = {}
+    for filename in sorted(os.listdir(DATA_DIR)):
+        if is_data_file(filename):
+            stem, extension = os.path.splitext(filename)
+            if stem not in names or extension == ".csv":
+                names[stem] = filename
+    return list(names.values())
+
+def collect_files():
     files = []
-    for filename in os.listdir(DATA_DIR):
-        if filename.startswith("real_estate_kommunarka_") and not filename.endswith("_raw_"):
-            file_path = os.path.join(DATA_DIR, filename)
-            df = pd.read_csv(file_path)
-            files.append({
-                "filename": filename,
-                "rows": len(df),
-                "columns": df.columns.tolist()
-            })
+    for filename in snapshot_files():
+        file_path = os.path.join(DATA_DIR, filename)
+        meta = dataset_cache.summary(file_path)
+        files.append({
+            "filename": filename,
+            "rows": meta["rows"],
+            "columns": meta["columns"]
+        })
     return files
 
-@app.get("/data")
-async def get_data(
-    filename: Optional[str] = None,
-    limit: int = Query(10, ge=1, le=100),
-    offset: int = Query(0, ge=0),
-    min_price: Optional[int] = None,
-    max_price: Optional[int] = None,
-    sort_by: Optional[str] = None,
-    sort_order: Optional[str] = "asc"
-):
+@app.get("/files")
+async def list_files():
+    return await run_blocking(("files",), collect_files)
+
+def records(df):
+    # Время сбора отдаем в прежнем виде "YYYY-MM-DD HH:MM:SS", даже если файл прочитан из Parquet,
+    # а пропуски (например, площадь, которой нет в заголовке) - как null
+    timestamps = df.select_dtypes(include="datetime").columns
+    if len(timestamps):
+        df = df.assign(**{column: df[column].dt.strftime(TIMESTAMP_FORMAT) for column in timestamps})
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
 
+def query_data(filename, limit, offset, min_price, max_price, sort_by, sort_order, cursor, fields):
     try:
-        if filename:
-            file_path = os.path.join(DATA_DIR, filename)
-            if not os.path.exists(file_path):
-                raise HTTPException(status_code=404, detail="File not found")
+        file_path = resolve_data_path(filename)
+
+        large = chunked.is_large_file(file_path)
+        if large:
+            dataset = None
+            columns = chunked.read_columns(file_path)
         else:
-            file_path = get_latest_data_file()
+            dataset = dataset_cache.indexed(file_path)
+            columns = dataset.columns
 
-        df = pd.read_csv(file_path)
+        if sort_by and sort_by not in columns:
+            raise HTTPException(status_code=400, detail=f"Invalid sort column: {sort_by}")
 
-        if min_price is not None:
-            df = df[df['price'] >= min_price]
-        if max_price is not None:
-            df = df[df['price'] <= max_price]
+        field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+        if field_list:
+            unknown = [field for field in field_list if field not in columns]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Invalid fields: {', '.join(unknown)}")
 
-        if sort_by:
-            if sort_by not in df.columns:
-                raise HTTPException(status_code=400, detail=f"Invalid sort column: {sort_by}")
-            df = df.sort_values(by=sort_by, ascending=(sort_order == "asc"))
+        if large:
+            # Большие файлы не держим в памяти: страницы отдает индекс на диске, построенный один раз
+            # на версию файла. Пока он строится в фоне, страница ищется за один проход по частям
+            dataset = page_indexes.get(file_path)
 
-        total = len(df)
-        df = df.iloc[offset:offset + limit]
+        if dataset is None:
+            if cursor:
+                raise HTTPException(status_code=400, detail="Cursor pagination for this file is not ready yet, use offset or /export")
+            total, df = chunked.query_scan(
+                file_path,
+                min_price=min_price,
+                max_price=max_price,
+                sort_by=sort_by,
+                sort_order=sort_order,
+                offset=offset,
+                limit=limit,
+                fields=field_list
+            )
+            next_cursor = None
+        else:
+            try:
+                total, df, next_cursor = dataset.query(
+                    min_price=min_price,
+                    max_price=max_price,
+                    sort_by=sort_by,
+                    sort_order=sort_order,
+                    offset=offset,
+                    limit=limit,
+                    cursor=cursor,
+                    fields=field_list
+                )
+            except InvalidCursor as e:
+                raise HTTPException(status_code=400, detail=str(e))
 
         return {
             "total": total,
             "offset": offset,
             "limit": limit,
-            "data": df.to_dict(orient="records")
+            "next_cursor": next_cursor,
+            "data": records(df)
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/stats")
-async def get_stats(filename: Optional[str] = None):
+@app.get("/data")
+async def get_data(
+    filename: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+    sort_by: Optional[str] = None,
+    sort_order: Optional[str] = "asc",
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    args = (filename, limit, offset, min_price, max_price, sort_by, sort_order, cursor, fields)
+    return await run_blocking(("data",) + args, query_data, *args)
+
+def compute_stats(filename):
     try:
-        if filename:
-            file_path = os.path.join(DATA_DIR, filename)
-            if not os.path.exists(file_path):
-                raise HTTPException(status_code=404, detail="File not found")
-        else:
-            file_path = get_latest_data_file()
+        file_path = resolve_data_path(filename)
 
-        df = pd.read_csv(file_path)
+        meta = dataset_cache.metadata(file_path)
+        price_stats = meta["price_stats"] or {}
 
         stats = {
-            "total_records": len(df),
+            "total_records": meta["rows"],
             "price_stats": {
-                "min": df['price'].min(),
-                "max": df['price'].max(),
-                "mean": df['price'].mean(),
-                "median": df['price'].median()
+                "min": price_stats.get("min"),
+                "max": price_stats.get("max"),
+                "mean": price_stats.get("mean"),
+                "median": price_stats.get("median")
             },
             "last_update": datetime.fromtimestamp(os.path.getmtime(file_path)).strftime("%Y-%m-%d %H:%M:%S")
         }
 
         return stats
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/stats")
+async def get_stats(filename: Optional[str] = None):
+    return await run_blocking(("stats", filename), compute_stats, filename)
+
+def price_counts_for(file_path):
+    meta = dataset_cache.metadata(file_path)
+    if meta.get("price_counts") is None:
+        # Старые файлы метаданных без количеств цен
+        return dataset_cache.derived(
+            file_path, "price_counts", lambda: price_counts(dataset_cache.get(file_path)["price"].value_counts())
+        )
+    return meta["price_counts"]
+
+def compute_histogram(filename, bins, min_price, max_price):
+    try:
+        file_path = resolve_export_path(filename)
+        return {
+            "filename": os.path.basename(file_path),
+            "bins": aggregations.price_histogram(price_counts_for(file_path), bins, min_price, max_price)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/histogram")
+async def get_histogram(
+    filename: Optional[str] = None,
+    bins: int = Query(20, ge=1, le=200),
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None
+):
+    # Без filename гистограмма строится по всей истории
+    key = ("histogram", filename, bins, min_price, max_price)
+    return await run_blocking(key, compute_histogram, filename, bins, min_price, max_price)
+
+def compute_timeseries(period, date_from, date_to):
+    try:
+        if not os.path.exists(HISTORY_DB_PATH):
+            raise HTTPException(status_code=404, detail="History not found")
+        points = dataset_cache.derived(
+            HISTORY_DB_PATH, ("timeseries", period),
+            lambda: aggregations.price_timeseries(HISTORY_DB_PATH, period)
+        )
+        if date_from:
+            points = [point for point in points if point["period_start"] >= date_from.isoformat()]
+        if date_to:
+            points = [point for point in points if point["period_start"] <= date_to.isoformat()]
+        return {"period": period, "points": points}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/timeseries")
+async def get_timeseries(
+    period: str = Query("day", pattern="^(day|week|month)$"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None
+):
+    # Медиана и перцентили цены по периодам из заранее посчитанной аналитики истории
+    return await run_blocking(("timeseries", period, date_from, date_to), compute_timeseries, period, date_from, date_to)
+
+def resolve_export_path(filename):
+    if not filename and os.path.exists(HISTORY_DB_PATH):
+        return HISTORY_DB_PATH
+    return resolve_data_path(filename)
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+@app.get("/export")
+async def export_data(
+    request: Request,
+    filename: Optional[str] = None,
+    format: str = Query("ndjson", pattern="^(ndjson|arrow)$"),
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    cursor: Optional[int] = Query(None, ge=0),
+    compression: Optional[str] = Query(None, pattern="^(identity|gzip|zstd)$")
+):
+    file_path = await run_blocking(("export_path", filename), resolve_export_path, filename)
+
+    if format == "arrow" and export.pa is None:
+        raise HTTPException(status_code=400, detail="Arrow export requires pyarrow")
+
+    encoding = export.choose_encoding(compression, request.headers.get("accept-encoding", ""))
+    if encoding == "zstd" and export.zstandard is None:
+        raise HTTPException(status_code=400, detail="zstd compression requires zstandard")
+
+    filters = export.ExportFilters(min_price, max_price, date_from, date_to)
+    chunks = export.iter_chunks(file_path, filters, cursor)
+    stream = export.arrow_stream(chunks) if format == "arrow" else export.ndjson_stream(chunks)
+
+    headers = {"X-Export-Row-Column": export.ROW_COLUMN}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+
+    return StreamingResponse(
+        export.compress_stream(stream, encoding),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers=headers
+    )
+
+def collect_metrics():
+    # Метрики последнего запуска скрапера из его JSON-сводки и состояние кэша этого процесса API
+    summary = read_latest_summary()
+    text = prometheus_text(summary) if summary else ""
+
+    cache = dataset_cache.stats()
+    lines = [
+        "# HELP api_dataset_cache_entries Datasets held in the API cache",
+        "# TYPE api_dataset_cache_entries gauge",
+        f"api_dataset_cache_entries {cache['entries']}",
+        "# HELP api_dataset_cache_bytes Memory used by cached datasets",
+        "# TYPE api_dataset_cache_bytes gauge",
+        f"api_dataset_cache_bytes {cache['bytes']}",
+        "# HELP api_dataset_cache_requests_total Dataset cache lookups by result",
+        "# TYPE api_dataset_cache_requests_total counter",
+        f'api_dataset_cache_requests_total{{result="hit"}} {cache["hits"]}',
+        f'api_dataset_cache_requests_total{{result="miss"}} {cache["misses"]}',
+    ]
+    return text + "\n".join(lines) + "\n"
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    text = await run_blocking(("metrics",), collect_metrics)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
+
+    parser = argparse.ArgumentParser(description="Real Estate Data API")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("API_WORKERS", "1")))
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # Несколько процессов uvicorn можно запустить только по строке импорта приложения
+        uvicorn.run("api:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port) 
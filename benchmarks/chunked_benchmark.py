@@ -0,0 +1,74 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunked import query_scan, scan_metadata
+from format_benchmark import memory_mb
+from history_analytics import update_analytics
+from synthetic import write_history
+
+
+def analytics(path):
+    update_analytics(path)
+
+
+def metadata(path):
+    scan_metadata(path)
+
+
+def deep_page(path):
+    query_scan(path, sort_by='price', offset=1000, limit=100)
+
+
+STAGES = [
+    ('аналитика истории', analytics),
+    ('метаданные', metadata),
+    ('страница /data', deep_page),
+]
+
+
+def measure(stage, path, queue):
+    before = memory_mb('VmRSS')
+    started = time.perf_counter()
+    stage(path)
+    queue.put((time.perf_counter() - started, memory_mb('VmHWM') - before))
+
+
+def run(rows, workdir):
+    path = os.path.join(workdir, f'history_{rows}.sqlite')
+    started = time.perf_counter()
+    written = write_history(path, rows)
+    print(f"{rows} строк: сгенерировано {written} уникальных за {time.perf_counter() - started:.1f} с, "
+          f"файл {os.path.getsize(path) / 2**20:.0f} МБ")
+
+    # Каждый этап в отдельном процессе, чтобы пик памяти считался только для него
+    context = multiprocessing.get_context('spawn')
+    for name, stage in STAGES:
+        queue = context.Queue()
+        process = context.Process(target=measure, args=(stage, path, queue))
+        process.start()
+        elapsed, peak_mb = queue.get()
+        process.join()
+        print(f"  {name:18} {elapsed:8.1f} с  пик RSS +{peak_mb:7.1f} МБ")
+
+    os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пик памяти обработки истории по частям в зависимости от ее размера")
+    parser.add_argument('--rows', default='1000000,5000000', help="размеры истории через запятую")
+    parser.add_argument('--dir', help="каталог для временных баз (по умолчанию системный)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as workdir:
+        for rows in args.rows.split(','):
+            run(int(rows), workdir)
+
+
+if __name__ == '__main__':
+    main()
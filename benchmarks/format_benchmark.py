@@ -0,0 +1,65 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from storage import read_parquet, write_parquet
+from synthetic import make_listings
+
+
+def memory_mb(field):
+    # VmRSS - текущая память процесса, VmHWM - ее пик
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def measure(path, queue):
+    before = memory_mb('VmRSS')
+    started = time.perf_counter()
+    df = read_parquet(path) if path.endswith('.parquet') else pd.read_csv(path)
+    elapsed = time.perf_counter() - started
+    peak = memory_mb('VmHWM')
+    queue.put((elapsed, df.memory_usage(deep=True).sum() / 2**20, peak - before))
+
+
+def run(rows, workdir):
+    df = make_listings(rows)
+    csv_path = os.path.join(workdir, 'snapshot.csv')
+    parquet_path = os.path.join(workdir, 'snapshot.parquet')
+    df.to_csv(csv_path, index=False)
+    write_parquet(df, parquet_path)
+    del df
+
+    # Каждый формат читаем в отдельном процессе, чтобы пик памяти одного не влиял на другой
+    context = multiprocessing.get_context('spawn')
+    for path in (csv_path, parquet_path):
+        queue = context.Queue()
+        process = context.Process(target=measure, args=(path, queue))
+        process.start()
+        elapsed, frame_mb, peak_mb = queue.get()
+        process.join()
+
+        print(f"{os.path.basename(path):18} файл {os.path.getsize(path) / 2**20:8.1f} МБ  "
+              f"загрузка {elapsed:6.2f} с  DataFrame {frame_mb:8.1f} МБ  пик RSS +{peak_mb:8.1f} МБ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение CSV и Parquet при загрузке снимка")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        run(args.rows, workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from listing_store import ListingBatch, compact_frame, listings_frame, offer_link
+from query_engine import IndexedDataset
+from storage import read_parquet, write_parquet
+from synthetic import ROOM_TYPES
+
+
+def make_cards(rows, titles, seed=0):
+    # Карточки, как их отдает парсер: заголовок - новая строка на каждую карточку, номера объявлений
+    # того же порядка, что у настоящих (19 цифр)
+    rng = np.random.default_rng(seed)
+    rooms = rng.integers(0, len(ROOM_TYPES), size=titles)
+    areas = rng.integers(15, 80, size=titles)
+    floors = rng.integers(1, 25, size=titles)
+    title_parts = [(area, ROOM_TYPES[room], floor) for area, room, floor in zip(areas, rooms, floors)]
+    offer_ids = rng.integers(10**18, 7 * 10**18, size=rows, dtype=np.int64)
+    prices = rng.integers(25, 120, size=rows) * 1000
+    choices = rng.integers(0, titles, size=rows)
+    for offer_id, price, choice in zip(offer_ids.tolist(), prices.tolist(), choices.tolist()):
+        area, room, floor = title_parts[choice]
+        yield f"{area}\xa0м² · {room} · {floor}\xa0этаж\xa0из\xa025", price, offer_link(offer_id)
+
+
+def traced(build):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size / 2**20, elapsed
+
+
+def as_dicts(cards, per_page):
+    # Прежний результат парсера: словарь на карточку с md5-ключом и строкой времени
+    pages, page = [], []
+    scraped_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for title, price, link in cards:
+        page.append({
+            'id': hashlib.md5(link.encode()).hexdigest(),
+            'title': title,
+            'price': price,
+            'link': link,
+            'scraped_at': scraped_at,
+        })
+        if len(page) == per_page:
+            pages.append(page)
+            page = []
+            scraped_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return pages + [page] if page else pages
+
+
+def as_batches(cards, per_page):
+    batches, batch = [], ListingBatch()
+    for title, price, link in cards:
+        batch.append(title, price, link)
+        if len(batch) == per_page:
+            batches.append(batch)
+            batch = ListingBatch()
+    return batches + [batch] if len(batch) else batches
+
+
+def frame_mb(df):
+    return df.memory_usage(deep=True).sum() / 2**20
+
+
+def query_ms(dataset, rounds=200, seed=0):
+    rng = np.random.default_rng(seed)
+    offsets = rng.integers(0, len(dataset.df), size=rounds)
+    dataset.query(sort_by='price', limit=50)
+    started = time.perf_counter()
+    for offset in offsets:
+        dataset.query(sort_by='price', offset=int(offset), limit=50)
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+def run(rows, per_page, titles, workdir):
+    print(f"Объявлений: {rows:,}, на странице {per_page}, различных заголовков {titles:,}")
+
+    print("Скрапер (результаты парсера в памяти):")
+    pages, dicts_mb, dicts_s = traced(lambda: as_dicts(make_cards(rows, titles), per_page))
+    del pages
+    batches, batches_mb, batches_s = traced(lambda: as_batches(make_cards(rows, titles), per_page))
+    print(f"  {'словари':22} {dicts_mb:8.1f} МБ  {dicts_s:6.2f} с")
+    print(f"  {'ListingBatch':22} {batches_mb:8.1f} МБ  {batches_s:6.2f} с  ({dicts_mb / batches_mb:.1f}x меньше)")
+
+    print("Кэш API (снимок из Parquet):")
+    df = listings_frame(batches)
+    del batches
+    path = os.path.join(workdir, 'snapshot.parquet')
+    write_parquet(df, path)
+    del df
+
+    df = read_parquet(path)
+    started = time.perf_counter()
+    compact = compact_frame(df)
+    compact_s = time.perf_counter() - started
+    plain_ms = query_ms(IndexedDataset(df))
+    compact_ms = query_ms(IndexedDataset(compact))
+    print(f"  {'DataFrame':22} {frame_mb(df):8.1f} МБ  страница /data {plain_ms:6.2f} мс")
+    print(f"  {'компактный':22} {frame_mb(compact):8.1f} МБ  страница /data {compact_ms:6.2f} мс  "
+          f"({frame_mb(df) / frame_mb(compact):.1f}x меньше, сжатие при загрузке {compact_s:.2f} с)")
+    for column in df.columns:
+        print(f"    {column:20} {df[column].memory_usage(deep=True, index=False) / rows:6.1f} байт/строка")
+    print("    в компактном:")
+    for column in compact.columns:
+        print(f"    {column:20} {compact[column].memory_usage(deep=True, index=False) / rows:6.1f} байт/строка")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память объявлений: словари и DataFrame против компактного хранения")
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--per-page', type=int, default=40, help="объявлений на странице выдачи")
+    parser.add_argument('--titles', type=int, default=5000, help="различных заголовков")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        run(args.rows, args.per_page, args.titles, workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import aiohttp
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, workers):
+    return subprocess.Popen(
+        [sys.executable, 'api.py', '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers)],
+        cwd=ROOT_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url + '/') as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"API не запустился за {timeout} секунд")
+
+
+async def dashboard_client(session, url, deadline, latencies, errors):
+    # Повторяет то, что делает web_interface.py при каждой перерисовке
+    while time.monotonic() < deadline:
+        requests = [
+            ('/files', {}),
+            ('/data', {'limit': random.choice([10, 50, 100]), 'offset': random.randint(0, 20),
+                       'sort_by': random.choice(['price', 'title', 'scraped_at'])}),
+            ('/stats', {}),
+        ]
+        for path, params in requests:
+            started = time.perf_counter()
+            try:
+                async with session.get(url + path, params=params) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors[path] = errors.get(path, 0) + 1
+            except aiohttp.ClientError:
+                errors[path] = errors.get(path, 0) + 1
+            latencies.setdefault(path, []).append(time.perf_counter() - started)
+
+
+async def run_load(url, clients, duration):
+    latencies, errors = {}, {}
+    connector = aiohttp.TCPConnector(limit=clients)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(dashboard_client(session, url, deadline, latencies, errors) for _ in range(clients)))
+    return latencies, errors
+
+
+def report(latencies, errors, duration):
+    total = sum(len(values) for values in latencies.values())
+    print(f"Запросов: {total}, {total / duration:.0f} в секунду, ошибок: {sum(errors.values())}")
+    print(f"{'эндпоинт':10} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'max, мс':>9}")
+    everything = np.concatenate([np.array(values) for values in latencies.values()]) if latencies else np.array([0.0])
+    for path, values in sorted(latencies.items()) + [('всего', everything)]:
+        p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+        print(f"{path:10} {p50:9.1f} {p95:9.1f} {p99:9.1f} {np.max(values) * 1000:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест API: одновременные клиенты дашборда")
+    parser.add_argument('--url', help="адрес работающего API; без него API запускается локально")
+    parser.add_argument('--workers', type=int, default=1, help="процессов uvicorn при локальном запуске")
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=20)
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        server = start_server(port, args.workers)
+
+    try:
+        asyncio.run(wait_ready(url))
+        latencies, errors = asyncio.run(run_load(url, args.clients, args.duration))
+        report(latencies, errors, args.duration)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
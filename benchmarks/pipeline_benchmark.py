@@ -0,0 +1,183 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from format_benchmark import memory_mb
+from synthetic import load_fixture
+import replay
+from replay import FixtureArchive
+
+OFFER_PATTERN = re.compile(r'/offer/\d+/')
+PRICE_PATTERN = re.compile(r'>[\d\s\xa0]+ ₽/мес\.<')
+
+
+def make_page(template, page_number, rng):
+    # Каждой карточке свой номер объявления и цена, чтобы страницы не схлопывались при дедупликации
+    card = 0
+
+    def offer(_):
+        nonlocal card
+        card += 1
+        return f'/offer/{page_number * 10**6 + card}/'
+
+    page_source = OFFER_PATTERN.sub(offer, template)
+    return PRICE_PATTERN.sub(lambda _: f'>{rng.randrange(25, 120) * 1000:,} ₽/мес.<'.replace(',', '\xa0'), page_source)
+
+
+def record_pages(directory, pages, cards, seed=0):
+    from crawler import DEFAULT_QUERIES
+
+    rng = random.Random(seed)
+    template = load_fixture(cards=cards)
+    archive = FixtureArchive(directory)
+    per_query = -(-pages // len(DEFAULT_QUERIES))
+    page_number = 0
+    for query in DEFAULT_QUERIES:
+        for page in range(per_query):
+            if page_number == pages:
+                return per_query
+            archive.record(query.url(page), make_page(template, page_number, rng))
+            page_number += 1
+    return per_query
+
+
+def run_pipeline(workdir, archive_dir, max_pages, queue):
+    # Весь путь как у скрапера: загрузка (из архива) -> разбор -> снимки -> изменения -> история
+    os.chdir(workdir)
+    replay.REPLAY_DIR = archive_dir
+    os.environ['SCRAPER_HOST_RATE'] = '1000000'
+    os.environ['SCRAPER_HOST_BURST'] = '1000000'
+    os.environ['SCRAPER_MAX_PAGES'] = str(max_pages + 1)
+
+    from main import save_data, scrape_data
+    from metrics import METRICS
+
+    before = memory_mb('VmRSS')
+    METRICS.reset()
+    started = time.perf_counter()
+    df = scrape_data.fn()
+    scraped = time.perf_counter()
+    save_data.fn(df)
+    finished = time.perf_counter()
+
+    queue.put({
+        'cards': len(df),
+        'scrape_seconds': scraped - started,
+        'save_seconds': finished - scraped,
+        'total_seconds': finished - started,
+        'peak_rss_mb': memory_mb('VmHWM') - before,
+        'metrics': METRICS.summary(),
+    })
+
+
+def timing(summary, name, **labels):
+    for entry in summary['timings']:
+        if entry['name'] == name and all(entry['labels'].get(k) == v for k, v in labels.items()):
+            return entry
+    return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(result, pages):
+    summary = result['metrics']
+    page = timing(summary, 'page')
+    print(f"Страниц: {pages}, карточек: {result['cards']}")
+    print(f"Весь конвейер: {result['total_seconds']:.2f} с, {pages / result['total_seconds']:.1f} страниц/с, "
+          f"{result['cards'] / result['total_seconds']:,.0f} карточек/с")
+    print(f"  сбор {result['scrape_seconds']:.2f} с, сохранение {result['save_seconds']:.2f} с, "
+          f"пик RSS +{result['peak_rss_mb']:.1f} МБ")
+    if page:
+        q = page['quantiles']
+        print(f"  страница: p50 {q['0.5'] * 1000:.1f} мс, p95 {q['0.95'] * 1000:.1f} мс, "
+              f"p99 {q['0.99'] * 1000:.1f} мс, max {page['max'] * 1000:.1f} мс")
+    for entry in summary['timings']:
+        if entry['name'] == 'stage':
+            print(f"  {entry['labels']['stage']:18} {entry['sum'] * 1000:9.1f} мс")
+
+
+def track(path, entry):
+    # Результаты копятся в JSONL, чтобы сравнивать их между коммитами
+    previous = None
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    old = json.loads(line)
+                    if old['pages'] == entry['pages'] and old['cards_per_page'] == entry['cards_per_page']:
+                        previous = old
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    if previous:
+        for key, label in (('pages_per_second', 'страниц/с'), ('page_p95_ms', 'p95 страницы, мс'),
+                           ('peak_rss_mb', 'пик RSS, МБ')):
+            old, new = previous[key], entry[key]
+            change = (new - old) / old * 100 if old else 0.0
+            print(f"  {label:18} {old:10.1f} -> {new:10.1f} ({change:+.1f}%, было на {previous['commit']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Весь конвейер скрапера на записанных страницах без обращения к сайту")
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--cards', type=int, default=40, help="карточек на странице")
+    parser.add_argument('--archive', help="готовый архив страниц (по умолчанию генерируются синтетические)")
+    parser.add_argument('--results', help="JSONL-файл, куда дописать результат для сравнения между коммитами")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        archive_dir = args.archive
+        pages = args.pages
+        max_pages = args.pages
+        if archive_dir is None:
+            archive_dir = os.path.join(workdir, 'archive')
+            max_pages = record_pages(archive_dir, args.pages, args.cards)
+        else:
+            pages = len(FixtureArchive(archive_dir).urls())
+
+        # Отдельный процесс, чтобы пик памяти относился только к конвейеру
+        context = multiprocessing.get_context('spawn')
+        queue = context.Queue()
+        process = context.Process(target=run_pipeline, args=(workdir, archive_dir, max_pages, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+
+    report(result, pages)
+
+    if args.results:
+        page = timing(result['metrics'], 'page')
+        track(args.results, {
+            'commit': git_commit(),
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'pages': pages,
+            'cards_per_page': args.cards,
+            'cards': result['cards'],
+            'pages_per_second': pages / result['total_seconds'],
+            'page_p95_ms': page['quantiles']['0.95'] * 1000 if page else 0.0,
+            'peak_rss_mb': result['peak_rss_mb'],
+            'stages': {entry['labels']['stage']: entry['sum'] for entry in result['metrics']['timings']
+                       if entry['name'] == 'stage'},
+        })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import CHUNK_ROWS, connect, insert_history
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fixtures')
+
+ROOM_TYPES = ['квартира-студия', '1-комнатная квартира', '2-комнатная квартира']
+
+
+def load_fixture(name='offers_serp.html', cards=None):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        page_source = f.read()
+
+    if not cards:
+        return page_source
+
+    # Раздуваем выдачу до нужного числа карточек, повторяя сохраненные
+    marker = '<li class="OffersSerpItem">'
+    head, rest = page_source.split(marker, 1)
+    body, tail = rest.rsplit('</li>', 1)
+    items = [marker + item for item in (body + '</li>').split(marker)]
+    items = (items * (cards // len(items) + 1))[:cards]
+    return head + ''.join(items) + tail
+
+
+def make_listings(rows, listings=None, start='2025-01-01', days=30, seed=0):
+    # Синтетические наблюдения: listings объявлений, каждое видно в случайные моменты
+    # за days дней, цена колеблется вокруг базовой с шагом 1000 ₽
+    rng = np.random.default_rng(seed)
+    listings = listings or max(rows // 10, 1)
+
+    offer_ids = rng.integers(10**17, 10**19, size=listings, dtype=np.uint64)
+    areas = rng.integers(15, 80, size=listings)
+    floors = rng.integers(1, 25, size=listings)
+    rooms = rng.integers(0, len(ROOM_TYPES), size=listings)
+    base_prices = rng.integers(25, 120, size=listings) * 1000
+
+    titles = np.array([
+        f"{area}\xa0м² · {ROOM_TYPES[room]} · {floor}\xa0этаж\xa0из\xa025"
+        for area, room, floor in zip(areas, rooms, floors)
+    ], dtype=object)
+    links = np.array([f"https://realty.yandex.ru/offer/{offer_id}/" for offer_id in offer_ids], dtype=object)
+    ids = np.array([f"{offer_id:032x}" for offer_id in offer_ids], dtype=object)
+
+    listing = rng.integers(0, listings, size=rows)
+    seconds = np.sort(rng.integers(0, int(days * 86400), size=rows))
+    scraped_at = pd.Timestamp(start) + pd.to_timedelta(seconds, unit='s')
+    price_change = rng.integers(-5, 6, size=rows) * 1000
+
+    return pd.DataFrame({
+        'id': ids[listing],
+        'title': titles[listing],
+        'price': base_prices[listing] + price_change,
+        'link': links[listing],
+        'scraped_at': scraped_at.strftime('%Y-%m-%d %H:%M:%S'),
+    })
+
+
+def write_history(path, rows, chunk_rows=CHUNK_ROWS, start='2025-01-01', days=365, seed=0):
+    # Пишет историю по частям, чтобы генератор сам не упирался в память на десятках миллионов строк.
+    # Каждая часть покрывает свой отрезок времени, поэтому история получается хронологической
+    chunks = max((rows + chunk_rows - 1) // chunk_rows, 1)
+    span = days / chunks
+    conn = connect(path)
+    try:
+        written = 0
+        for i in range(chunks):
+            size = min(chunk_rows, rows - i * chunk_rows)
+            chunk_start = pd.Timestamp(start) + pd.Timedelta(days=span * i)
+            df = make_listings(size, start=chunk_start, days=max(span, 1 / 24), seed=seed + i)
+            written += insert_history(conn, df)
+        return written
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор синтетической истории цен")
+    parser.add_argument('path', help="файл SQLite с историей")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    written = write_history(args.path, args.rows, args.chunk_rows, days=args.days)
+    print(f"Записано {written} строк истории в {args.path}")
+
+
+if __name__ == '__main__':
+    main()
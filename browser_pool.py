@@ -0,0 +1,165 @@
+import os
+import queue
+import threading
+import time
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+
+from metrics import METRICS
+from parsing import CARD_SELECTORS, EMPTY_RESULT_SELECTORS
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+BROWSER_POOL_SIZE = int(os.getenv('SCRAPER_BROWSER_POOL_SIZE', '1'))
+# Браузер перезапускается после стольких страниц или при превышении памяти, чтобы не копить утечки
+BROWSER_MAX_PAGES = int(os.getenv('SCRAPER_BROWSER_MAX_PAGES', '50'))
+BROWSER_MAX_MEMORY_MB = float(os.getenv('SCRAPER_BROWSER_MAX_MEMORY_MB', '1024'))
+# Сколько ждать появления карточек на странице
+BROWSER_WAIT_TIMEOUT = float(os.getenv('SCRAPER_BROWSER_WAIT_TIMEOUT', '20'))
+
+LISTING_SELECTOR = ', '.join(CARD_SELECTORS + EMPTY_RESULT_SELECTORS)
+
+
+class BrowserSession:
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+
+    def healthy(self):
+        # Когда chromedriver умер, приходит не WebDriverException, а ошибка соединения urllib3
+        try:
+            return self.driver.execute_script('return 1') == 1
+        except Exception:
+            return False
+
+    def memory_mb(self):
+        # Память всего дерева процессов браузера; без psutil - только куча JavaScript текущей вкладки
+        if psutil is not None:
+            try:
+                root = psutil.Process(self.driver.service.process.pid)
+                processes = [root] + root.children(recursive=True)
+                return sum(process.memory_info().rss for process in processes) / 2**20
+            except (AttributeError, psutil.Error):
+                pass
+        try:
+            heap = self.driver.execute_script('return performance.memory ? performance.memory.usedJSHeapSize : 0')
+            return (heap or 0) / 2**20
+        except Exception:
+            return 0.0
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception:
+            pass
+
+
+class BrowserPool:
+    # Пул прогретых браузеров на весь процесс: переживает повторы задач и запуски по расписанию,
+    # браузеры запускаются только когда впервые понадобились
+    def __init__(self, factory, size=BROWSER_POOL_SIZE, max_pages=BROWSER_MAX_PAGES,
+                 max_memory_mb=BROWSER_MAX_MEMORY_MB, wait_timeout=BROWSER_WAIT_TIMEOUT,
+                 wait_selector=LISTING_SELECTOR):
+        self.factory = factory
+        self.size = size
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.wait_timeout = wait_timeout
+        self.wait_selector = wait_selector
+        self.idle = queue.Queue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def _log(self, logger, level, message):
+        if logger:
+            getattr(logger, level)(message)
+
+    def _acquire(self, logger):
+        while True:
+            with self.lock:
+                if self.idle.empty() and self.created < self.size:
+                    self.created += 1
+                    break
+            # Ждем с таймаутом: освободившееся место может появиться и без возврата браузера в пул
+            try:
+                session = self.idle.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if session.healthy():
+                return session
+            self._log(logger, 'warning', "Браузер не отвечает, запускаем новый")
+            self._discard(session)
+
+        try:
+            with METRICS.timer('browser_start'):
+                session = BrowserSession(self.factory())
+        except Exception:
+            with self.lock:
+                self.created -= 1
+            raise
+        self._log(logger, 'info', "Браузер Chrome запущен успешно")
+        return session
+
+    def _discard(self, session):
+        session.quit()
+        with self.lock:
+            self.created -= 1
+
+    def _release(self, session, logger):
+        reason = None
+        if session.pages >= self.max_pages:
+            reason = f"открыто {session.pages} страниц"
+        else:
+            memory = session.memory_mb()
+            if memory > self.max_memory_mb:
+                reason = f"занято {memory:.0f} МБ памяти"
+
+        if reason:
+            self._log(logger, 'info', f"Перезапускаем браузер: {reason}")
+            METRICS.inc('browser_recycles', reason='pages' if session.pages >= self.max_pages else 'memory')
+            self._discard(session)
+            return
+        self.idle.put(session)
+
+    def _wait_for_listings(self, driver, url, logger):
+        started = time.perf_counter()
+        try:
+            WebDriverWait(driver, self.wait_timeout).until(
+                lambda d: d.find_elements(By.CSS_SELECTOR, self.wait_selector)
+            )
+            self._log(logger, 'info', f"Выдача загрузилась через {time.perf_counter() - started:.2f} с")
+        except TimeoutException:
+            # Отдаем страницу как есть: парсер и проверка на капчу разберутся с ней дальше
+            self._log(logger, 'warning', f"За {self.wait_timeout:.0f} с на странице {url} не появилось карточек")
+
+    def fetch(self, url, logger=None):
+        session = self._acquire(logger)
+        try:
+            with METRICS.timer('fetch', source='browser'):
+                session.driver.get(url)
+                self._wait_for_listings(session.driver, url, logger)
+                session.pages += 1
+                page_source = session.driver.page_source
+        except Exception:
+            # Упавший браузер в пул не возвращаем, но место освобождаем при любой ошибке:
+            # умерший chromedriver дает ошибку соединения, и без этого пул ждал бы вечно
+            METRICS.inc('fetch_errors', source='browser')
+            self._discard(session)
+            raise
+        METRICS.inc('fetch_bytes', len(page_source.encode('utf-8')), source='browser')
+        self._release(session, logger)
+        return page_source
+
+    def close(self):
+        while True:
+            try:
+                session = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(session)
+
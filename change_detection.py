@@ -0,0 +1,228 @@
+import hashlib
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from storage import HISTORY_DB_PATH, connect
+
+# Через сколько запусков подряд без объявления в выдаче считать его снятым.
+# Одного пропуска мало: страница могла не загрузиться или объявление сдвинулось за последнюю страницу
+DELIST_AFTER_RUNS = int(os.getenv('SCRAPER_DELIST_AFTER_RUNS', '2'))
+
+EVENT_NEW = 'new'
+EVENT_CHANGED = 'changed'
+EVENT_REMOVED = 'removed'
+
+EVENT_COLUMNS = ['id', 'event', 'occurred_at', 'title', 'price', 'old_price', 'link']
+
+CHANGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS listing_index (
+    id TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    title TEXT,
+    price INTEGER,
+    link TEXT,
+    first_seen TEXT,
+    last_seen TEXT,
+    missed_runs INTEGER NOT NULL DEFAULT 0,
+    active INTEGER NOT NULL DEFAULT 1,
+    removed_at TEXT
+);
+CREATE INDEX IF NOT EXISTS listing_index_active ON listing_index (active);
+CREATE TABLE IF NOT EXISTS listing_events (
+    id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    occurred_at TEXT NOT NULL,
+    title TEXT,
+    price INTEGER,
+    old_price INTEGER,
+    link TEXT
+);
+CREATE INDEX IF NOT EXISTS listing_events_occurred_at ON listing_events (occurred_at);
+"""
+
+
+def _text(value):
+    return '' if pd.isna(value) else str(value)
+
+
+def _price(value):
+    return None if pd.isna(value) else int(value)
+
+
+def fingerprint(title, price, link):
+    # Отпечаток содержимого карточки: меняется при любом изменении заголовка, цены или ссылки
+    price = _price(price)
+    content = '\x1f'.join([_text(title), '' if price is None else str(price), _text(link)])
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+
+def fingerprints(df):
+    return pd.Series(
+        [fingerprint(title, price, link) for title, price, link in zip(df['title'], df['price'], df['link'])],
+        index=df.index,
+        dtype=object,
+    )
+
+
+def _store_seen_ids(conn, ids):
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS seen_ids (id TEXT PRIMARY KEY)')
+    conn.execute('DELETE FROM seen_ids')
+    conn.executemany('INSERT OR IGNORE INTO seen_ids (id) VALUES (?)', ((i,) for i in ids))
+
+
+def _known_listings(conn, ids):
+    _store_seen_ids(conn, ids)
+    return pd.read_sql_query(
+        'SELECT l.id, l.fingerprint, l.price, l.active FROM listing_index l JOIN seen_ids s ON s.id = l.id', conn
+    ).set_index('id')
+
+
+def _delistings(conn, run_at):
+    # Активные объявления, которых нет в текущей выдаче и которые с этим пропуском набрали порог
+    removed = pd.read_sql_query(
+        'SELECT id, title, price, link FROM listing_index '
+        'WHERE active = 1 AND missed_runs + 1 >= ? AND id NOT IN (SELECT id FROM seen_ids)',
+        conn,
+        params=[DELIST_AFTER_RUNS],
+    )
+    removed['event'] = EVENT_REMOVED
+    removed['occurred_at'] = run_at
+    removed['old_price'] = None
+    return removed[EVENT_COLUMNS]
+
+
+def _current_listings(df, run_at):
+    current = df.dropna(subset=['id']).drop_duplicates(subset=['id'], keep='last').copy()
+    current['fingerprint'] = fingerprints(current)
+    current['scraped_at'] = current['scraped_at'].astype(str) if 'scraped_at' in current else run_at
+    return current
+
+
+def detect_changes(df, path=HISTORY_DB_PATH, run_at=None, record_removals=True):
+    # Сравнивает карточки текущего запуска с индексом отпечатков и возвращает только события:
+    # новые объявления, изменившиеся и снятые с публикации. В базу здесь ничего не пишется -
+    # индекс и журнал событий обновляет commit_changes, когда изменения уже сохранены в истории.
+    # Иначе после сбоя между этими шагами повтор счел бы карточки неизменившимися и потерял бы их
+    run_at = run_at or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    current = _current_listings(df, run_at)
+
+    conn = connect(path)
+    try:
+        conn.executescript(CHANGES_SCHEMA)
+        known = _known_listings(conn, current['id'])
+        previous = current['id'].map(known['fingerprint'])
+        # Объявление, которое снова появилось после снятия, считаем новым
+        returned = current['id'].map(known['active']).eq(0)
+
+        is_new = previous.isna() | returned
+        is_changed = ~is_new & (previous != current['fingerprint'])
+
+        events = current[is_new | is_changed].copy()
+        events['event'] = EVENT_NEW
+        events.loc[is_changed[is_new | is_changed], 'event'] = EVENT_CHANGED
+        events['occurred_at'] = events['scraped_at']
+        events['old_price'] = events['id'].map(known['price']).where(events['event'] == EVENT_CHANGED)
+        events = events[EVENT_COLUMNS]
+
+        if record_removals:
+            events = pd.concat([events, _delistings(conn, run_at)], ignore_index=True)
+        return events.reset_index(drop=True)
+    finally:
+        conn.close()
+
+
+def commit_changes(df, events, path=HISTORY_DB_PATH, run_at=None, record_removals=True):
+    # Переносит результат detect_changes в индекс отпечатков и журнал событий одной транзакцией.
+    # Вызывается последним шагом: до него сбой и повтор снова увидят те же события
+    run_at = run_at or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    current = _current_listings(df, run_at)
+    removed = events[events['event'] == EVENT_REMOVED]
+
+    conn = connect(path)
+    try:
+        conn.executescript(CHANGES_SCHEMA)
+        with conn:
+            _store_seen_ids(conn, current['id'])
+
+            if record_removals:
+                # Все активные объявления, которых нет в текущей выдаче, получают еще один пропуск
+                conn.execute(
+                    'UPDATE listing_index SET missed_runs = missed_runs + 1 '
+                    'WHERE active = 1 AND id NOT IN (SELECT id FROM seen_ids)'
+                )
+                conn.executemany(
+                    'UPDATE listing_index SET active = 0, removed_at = ? WHERE id = ? AND active = 1',
+                    zip(removed['occurred_at'], removed['id']),
+                )
+
+            conn.executemany(
+                """
+                INSERT INTO listing_index (id, fingerprint, title, price, link, first_seen, last_seen)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    fingerprint = excluded.fingerprint,
+                    title = excluded.title,
+                    price = excluded.price,
+                    link = excluded.link,
+                    first_seen = CASE WHEN active = 0 THEN excluded.first_seen ELSE first_seen END,
+                    last_seen = excluded.last_seen,
+                    missed_runs = 0,
+                    active = 1,
+                    removed_at = NULL
+                """,
+                (
+                    (row.id, row.fingerprint, None if pd.isna(row.title) else row.title, _price(row.price),
+                     None if pd.isna(row.link) else row.link, row.scraped_at, row.scraped_at)
+                    for row in current.itertuples(index=False)
+                ),
+            )
+
+            conn.executemany(
+                'INSERT INTO listing_events (id, event, occurred_at, title, price, old_price, link) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    (row.id, row.event, row.occurred_at, None if pd.isna(row.title) else row.title,
+                     _price(row.price), _price(row.old_price), None if pd.isna(row.link) else row.link)
+                    for row in events.itertuples(index=False)
+                ),
+            )
+    finally:
+        conn.close()
+
+
+def load_events(event=None, since=None, path=HISTORY_DB_PATH):
+    conn = connect(path)
+    try:
+        conn.executescript(CHANGES_SCHEMA)
+        clauses, params = [], []
+        if event:
+            clauses.append('event = ?')
+            params.append(event)
+        if since:
+            clauses.append('occurred_at >= ?')
+            params.append(since)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        return pd.read_sql_query(f'SELECT * FROM listing_events{where} ORDER BY occurred_at', conn, params=params)
+    finally:
+        conn.close()
+
+
+def load_change_summary(path=HISTORY_DB_PATH):
+    conn = connect(path)
+    try:
+        conn.executescript(CHANGES_SCHEMA)
+        active, removed = conn.execute(
+            'SELECT COALESCE(SUM(active = 1), 0), COALESCE(SUM(active = 0), 0) FROM listing_index'
+        ).fetchone()
+        events = dict(conn.execute('SELECT event, COUNT(*) FROM listing_events GROUP BY event').fetchall())
+        return {
+            'active': active,
+            'removed': removed,
+            'new_events': events.get(EVENT_NEW, 0),
+            'changed_events': events.get(EVENT_CHANGED, 0),
+            'removed_events': events.get(EVENT_REMOVED, 0),
+        }
+    finally:
+        conn.close()
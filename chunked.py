@@ -0,0 +1,142 @@
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from export import ROW_COLUMN, ExportFilters, iter_chunks
+from storage import CHUNK_ROWS, PRICE_QUANTILES, history_summary, plain_number, price_counts
+
+# Файлы больше этого размера API не загружает целиком, а обрабатывает по частям
+LARGE_FILE_MB = float(os.getenv('API_LARGE_FILE_MB', '256'))
+
+
+def is_large_file(path):
+    size = 0
+    for candidate in (path, path + '-wal'):
+        if os.path.exists(candidate):
+            size += os.path.getsize(candidate)
+    return size > LARGE_FILE_MB * 2**20
+
+
+class PriceAccumulator:
+    # Цены целые и различных значений немного, поэтому вместо самих цен храним
+    # количество каждого значения: этого хватает для точных медианы и квантилей
+    def __init__(self):
+        self.counts = pd.Series(dtype='float64')
+
+    def update(self, prices):
+        counts = pd.to_numeric(prices, errors='coerce').dropna().value_counts()
+        self.add_counts(counts)
+
+    def add_counts(self, counts):
+        self.counts = self.counts.add(counts.astype('float64'), fill_value=0).sort_index()
+
+    def quantile(self, q):
+        values = self.counts.index.to_numpy(dtype='float64')
+        cumulative = np.cumsum(self.counts.to_numpy())
+        # Та же линейная интерполяция, что в pandas.Series.quantile
+        position = q * (cumulative[-1] - 1)
+        lower = values[np.searchsorted(cumulative, np.floor(position), 'right')]
+        upper = values[np.searchsorted(cumulative, np.ceil(position), 'right')]
+        return lower + (upper - lower) * (position - np.floor(position))
+
+    def summary(self):
+        if self.counts.empty:
+            return None, None
+
+        self.counts = self.counts.sort_index()
+        values = self.counts.index.to_numpy(dtype='float64')
+        weights = self.counts.to_numpy()
+        count = weights.sum()
+        mean = (values * weights).sum() / count
+        std = np.sqrt(((values - mean) ** 2 * weights).sum() / (count - 1)) if count > 1 else np.nan
+
+        price_stats = {
+            "count": int(count),
+            "min": plain_number(values[0]),
+            "max": plain_number(values[-1]),
+            "mean": plain_number(mean),
+            "median": plain_number(self.quantile(0.5)),
+            "std": plain_number(std),
+        }
+        price_quantiles = {f"{q:g}": plain_number(self.quantile(q)) for q in PRICE_QUANTILES}
+        return price_stats, price_quantiles
+
+
+def iter_frames(path, filters=None, chunk_size=CHUNK_ROWS):
+    return iter_chunks(path, filters, chunk_size=chunk_size)
+
+
+def scan_metadata(path, chunk_size=CHUNK_ROWS):
+    rows = 0
+    columns, schema = None, None
+    prices = PriceAccumulator()
+
+    for chunk in iter_frames(path, chunk_size=chunk_size):
+        chunk = chunk.drop(columns=ROW_COLUMN)
+        if columns is None:
+            columns = chunk.columns.tolist()
+            schema = {column: str(dtype) for column, dtype in chunk.dtypes.items()}
+        rows += len(chunk)
+        if 'price' in chunk.columns:
+            prices.update(chunk['price'])
+
+    price_stats, price_quantiles = prices.summary()
+    return {
+        "rows": rows,
+        "columns": columns or [],
+        "schema": schema or {},
+        "price_stats": price_stats,
+        "price_quantiles": price_quantiles,
+        "price_counts": price_counts(prices.counts),
+    }
+
+
+def history_metadata(path):
+    # Метаданные истории SQLite: строки и схема без чтения строк, цены группирует сама SQLite,
+    # в Python попадает только по строке на каждую различную цену
+    meta = history_summary(path)
+    conn = sqlite3.connect(path)
+    try:
+        counts = pd.read_sql_query('SELECT price, COUNT(*) AS count FROM history GROUP BY price', conn)
+    finally:
+        conn.close()
+    prices = PriceAccumulator()
+    prices.add_counts(counts.set_index('price')['count'])
+    price_stats, price_quantiles = prices.summary()
+    return dict(meta, price_stats=price_stats, price_quantiles=price_quantiles, price_counts=price_counts(prices.counts))
+
+
+def read_columns(path):
+    for chunk in iter_frames(path, chunk_size=1):
+        return [column for column in chunk.columns if column != ROW_COLUMN]
+    return []
+
+
+def query_scan(path, min_price=None, max_price=None, sort_by=None, sort_order='asc',
+               offset=0, limit=10, fields=None, chunk_size=CHUNK_ROWS):
+    # Однопроходный поиск страницы по большому файлу: в памяти держим только текущую
+    # часть и лучшие offset + limit строк. Порядок строк совпадает с query_engine
+    need = offset + limit
+    ascending = sort_order != 'desc'
+    kept = None
+    total = 0
+
+    for chunk in iter_frames(path, ExportFilters(min_price, max_price), chunk_size):
+        total += len(chunk)
+        if sort_by:
+            combined = chunk if kept is None else pd.concat([kept, chunk])
+            kept = combined.sort_values(
+                [sort_by, ROW_COLUMN], ascending=[ascending, ascending], na_position='last', kind='stable'
+            ).head(need)
+        elif kept is None or len(kept) < need:
+            kept = (chunk if kept is None else pd.concat([kept, chunk])).head(need)
+
+    if kept is None:
+        return total, pd.DataFrame(columns=fields or [])
+
+    page = kept.iloc[offset:need].drop(columns=ROW_COLUMN)
+    if fields:
+        page = page[fields]
+    return total, page
@@ -0,0 +1,299 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import urlencode, urlsplit
+
+import aiohttp
+
+from fetching import SHARED_FETCHER, needs_js, open_fetcher
+from listing_store import ListingBatch
+from metrics import METRICS
+from replay import record_page
+
+SEARCH_BASE_URL = os.getenv('SCRAPER_BASE_URL', 'https://realty.yandex.ru/moskva_i_moskovskaya_oblast/snyat/kvartira')
+QUERIES_FILE = os.getenv('SCRAPER_QUERIES_FILE')
+CRAWL_WORKERS = int(os.getenv('SCRAPER_WORKERS', '4'))
+HOST_RATE = float(os.getenv('SCRAPER_HOST_RATE', '0.5'))
+HOST_BURST = int(os.getenv('SCRAPER_HOST_BURST', '2'))
+MAX_PAGES = int(os.getenv('SCRAPER_MAX_PAGES', '25'))
+HTTP_RETRIES = int(os.getenv('SCRAPER_HTTP_RETRIES', '3'))
+RETRY_BACKOFF = float(os.getenv('SCRAPER_RETRY_BACKOFF', '2'))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+@dataclass(frozen=True)
+class SearchQuery:
+    station: str
+    rooms: str
+    price_min: Optional[int] = None
+    price_max: Optional[int] = None
+
+    @property
+    def label(self):
+        label = f"{self.rooms}/{self.station}"
+        if self.price_min is not None or self.price_max is not None:
+            label += f" [{self.price_min or ''}-{self.price_max or ''}]"
+        return label
+
+    def url(self, page=0, base_url=None):
+        url = f"{base_url or SEARCH_BASE_URL}/{self.rooms}/metro-{self.station}/"
+        params = {}
+        if self.price_min is not None:
+            params['priceMin'] = self.price_min
+        if self.price_max is not None:
+            params['priceMax'] = self.price_max
+        if page:
+            params['page'] = page
+        return f"{url}?{urlencode(params)}" if params else url
+
+
+DEFAULT_QUERIES = [
+    SearchQuery(station='kommunarka', rooms='odnokomnatnaya'),
+    SearchQuery(station='kommunarka', rooms='studiya'),
+]
+
+
+def load_queries(path=None):
+    path = path or QUERIES_FILE
+    if not path:
+        return list(DEFAULT_QUERIES)
+
+    with open(path, encoding='utf-8') as f:
+        return [SearchQuery(**query) for query in json.load(f)]
+
+
+class TokenBucket:
+    # Жетон резервируется под блокировкой потока, а ждать его можно и в asyncio, и в обычном потоке,
+    # поэтому одно ведро годится и для Crawler, и для задач Prefect в пуле потоков
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def wait(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+
+class HostRateLimiter:
+    def __init__(self, rate=HOST_RATE, capacity=HOST_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.capacity)
+            return self.buckets[host]
+
+    async def acquire(self, url):
+        await self.bucket(url).acquire()
+
+    def wait(self, url):
+        self.bucket(url).wait()
+
+
+# Общий для всех задач процесса ограничитель, чтобы параллельные задачи вместе не превышали лимит
+HOST_LIMITER = HostRateLimiter()
+
+
+def http_status(error):
+    # Код ответа, если сайт ответил ошибкой; None - страницу не удалось получить по сети
+    return error.status if isinstance(error, aiohttp.ClientResponseError) else None
+
+
+def retry_delay(error, attempt):
+    # Пауза перед повтором после 429 и 5xx: Retry-After сервера, иначе экспоненциальный рост
+    retry_after = (error.headers or {}).get('Retry-After', '')
+    if retry_after.isdigit():
+        return float(retry_after)
+    return RETRY_BACKOFF * 2 ** attempt
+
+
+def http_failure(error, attempt):
+    # Что делать после ошибки HTTP-запроса: ('retry', пауза), ('missing', '') - страницы нет,
+    # выдача закончилась, ('failed', None) - сайт ответил ошибкой, и браузер тут не поможет,
+    # ('network', None) - сеть подвела, страницу можно открыть в браузере
+    status = http_status(error)
+    if status is None:
+        return 'network', None
+    if status == 404:
+        return 'missing', ''
+    if status in RETRY_STATUSES and attempt < HTTP_RETRIES:
+        METRICS.inc('fetch_retries', source='http', status=status)
+        return 'retry', retry_delay(error, attempt)
+    return 'failed', None
+
+
+def fetch_page(url, fallback=None, use_http=True, rate_limiter=HOST_LIMITER, logger=None):
+    page_source = _load_page(url, fallback, use_http, rate_limiter, logger)
+    record_page(url, page_source)
+    return page_source
+
+
+def _load_page(url, fallback, use_http, rate_limiter, logger):
+    # Синхронная загрузка одной страницы с тем же порядком, что в Crawler: HTTP, а при необходимости браузер
+    def log(level, message):
+        if logger:
+            getattr(logger, level)(message)
+
+    rate_limiter.wait(url)
+    attempt = 0
+    while use_http:
+        # Общий на процесс загрузчик: задачи разных страниц используют одни и те же соединения
+        try:
+            page_source = SHARED_FETCHER.fetch(url)
+        except Exception as e:
+            action, result = http_failure(e, attempt)
+            if action == 'retry':
+                log('warning', f"Сайт ответил {http_status(e)} на {url}, повтор через {result:.0f} с")
+                time.sleep(result)
+                rate_limiter.wait(url)
+                attempt += 1
+                continue
+            log('warning', f"Не удалось скачать страницу {url} без браузера: {type(e).__name__}: {e}")
+            if action != 'network':
+                return result
+        else:
+            if not needs_js(page_source):
+                return page_source
+            log('warning', f"Страница {url} требует JavaScript")
+        break
+
+    if fallback is None:
+        return None
+    log('info', f"Открываем страницу в браузере: {url}")
+    return fallback(url)
+
+
+class Crawler:
+    # parse(page_source) -> ListingBatch с объявлениями страницы
+    # fallback(url) -> html, блокирующая загрузка через браузер для страниц, которым нужен JavaScript
+    def __init__(self, parse, fallback=None, use_http=True, workers=CRAWL_WORKERS,
+                 max_pages=MAX_PAGES, rate_limiter=None, base_url=None, logger=None, fallback_concurrency=1):
+        self.parse = parse
+        self.fallback = fallback
+        self.use_http = use_http
+        self.workers = workers
+        self.max_pages = max_pages
+        self.rate_limiter = rate_limiter or HOST_LIMITER
+        self.base_url = base_url
+        self.logger = logger
+        self.fallback_slots = asyncio.Semaphore(fallback_concurrency)
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(message)
+
+    async def _fetch(self, fetcher, url):
+        page_source = await self._load(fetcher, url)
+        record_page(url, page_source)
+        return page_source
+
+    async def _load(self, fetcher, url):
+        await self.rate_limiter.acquire(url)
+
+        attempt = 0
+        while self.use_http:
+            try:
+                page_source = await fetcher.fetch(url)
+            except Exception as e:
+                action, result = http_failure(e, attempt)
+                if action == 'retry':
+                    self._log('warning', f"Сайт ответил {http_status(e)} на {url}, повтор через {result:.0f} с")
+                    await asyncio.sleep(result)
+                    await self.rate_limiter.acquire(url)
+                    attempt += 1
+                    continue
+                self._log('warning', f"Не удалось скачать страницу {url} без браузера: {type(e).__name__}: {e}")
+                if action != 'network':
+                    return result
+            else:
+                if not needs_js(page_source):
+                    return page_source
+                self._log('warning', f"Страница {url} требует JavaScript")
+            break
+
+        if self.fallback is None:
+            return None
+
+        # Одновременно через браузер грузится не больше страниц, чем браузеров в пуле
+        async with self.fallback_slots:
+            self._log('info', f"Открываем страницу в браузере: {url}")
+            return await asyncio.to_thread(self.fallback, url)
+
+    async def _worker(self, fetcher, queue, seen_links, results):
+        while True:
+            query, page, query_links = await queue.get()
+            try:
+                url = query.url(page, base_url=self.base_url)
+                with METRICS.timer('page'):
+                    page_source = await self._fetch(fetcher, url)
+                    items = self.parse(page_source) if page_source else ListingBatch()
+
+                links = items.dedupe_keys()
+                new_items = [i for i, link in enumerate(links) if link not in query_links]
+                query_links.update(links[i] for i in new_items)
+                self._log('info', f"{query.label}, страница {page + 1}: новых объявлений {len(new_items)}")
+
+                unseen = []
+                for i in new_items:
+                    if links[i] not in seen_links:
+                        seen_links.add(links[i])
+                        unseen.append(i)
+                if unseen:
+                    results.append(items.take(unseen))
+
+                if new_items and page + 1 < self.max_pages:
+                    queue.put_nowait((query, page + 1, query_links))
+            except Exception as e:
+                self._log('error', f"Ошибка при обходе {query.label}, страница {page + 1}: {type(e).__name__}: {e}")
+            finally:
+                queue.task_done()
+
+    async def crawl(self, queries):
+        queue = asyncio.Queue()
+        for query in queries:
+            queue.put_nowait((query, 0, set()))
+
+        seen_links = set()
+        results = []
+
+        async with open_fetcher(concurrency=self.workers) as fetcher:
+            workers = [
+                asyncio.create_task(self._worker(fetcher, queue, seen_links, results))
+                for _ in range(self.workers)
+            ]
+            await queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        return results
+
+
+def crawl(queries, parse, **kwargs):
+    return asyncio.run(Crawler(parse, **kwargs).crawl(queries))
@@ -0,0 +1,218 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from chunked import history_metadata, is_large_file, scan_metadata
+from listing_store import compact_frame, expand_frame
+from query_engine import IndexedDataset
+from storage import history_summary, read_dataset, read_sidecar, sidecar_path, snapshot_metadata
+
+CACHE_MAX_MB = float(os.getenv('API_CACHE_MAX_MB', '512'))
+# Сколько файлов помнить в метаданных и производных результатах, если сами данные не загружены
+CACHE_MAX_FILES = int(os.getenv('API_CACHE_MAX_FILES', '64'))
+
+
+def file_signature(path):
+    # Для CSV учитываем соседний Parquet, для SQLite - журнал WAL: изменения могут лежать там
+    candidates = [path, path + '-wal']
+    if path.endswith('.csv'):
+        candidates.append(path[:-len('.csv')] + '.parquet')
+
+    signature = []
+    for candidate in candidates:
+        try:
+            stat = os.stat(candidate)
+        except FileNotFoundError:
+            continue
+        signature.append((candidate, stat.st_mtime_ns, stat.st_size))
+    if not signature:
+        raise FileNotFoundError(path)
+    return tuple(signature)
+
+
+def load_compact(path):
+    # В кэше API объявления хранятся компактно: номер объявления вместо ссылки и ключа, строки категориями
+    return compact_frame(read_dataset(path))
+
+
+class DatasetCache:
+    # Метаданные, производные результаты и индексы файла удаляются вместе с его данными,
+    # а для незагруженных файлов (история, большие файлы) живут, пока файл среди max_files последних.
+    # Память индексов входит в размер записи и в общий лимит max_bytes
+    def __init__(self, max_bytes=int(CACHE_MAX_MB * 2**20), loader=load_compact, max_files=CACHE_MAX_FILES):
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.loader = loader
+        self.entries = OrderedDict()
+        self.side_paths = OrderedDict()
+        self.metadata_entries = {}
+        self.derived_entries = {}
+        self.indexed_entries = {}
+        self.pending = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        signature = file_signature(path)
+
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+
+            # Если тот же файл уже читается в другом потоке, ждем его результат, а не читаем повторно
+            pending = self.pending.get(path)
+            if pending is not None and pending[0] == signature:
+                self.hits += 1
+                future = pending[1]
+                owner = False
+            else:
+                self.misses += 1
+                future = Future()
+                self.pending[path] = (signature, future)
+                owner = True
+
+        if not owner:
+            return future.result()
+
+        try:
+            df = self.loader(path)
+        except BaseException as e:
+            with self.lock:
+                self._finish_pending(path, future)
+            future.set_exception(e)
+            raise
+        size = int(df.memory_usage(deep=True).sum())
+
+        with self.lock:
+            self._finish_pending(path, future)
+            self._discard(path)
+            self.entries[path] = (signature, df, size)
+            self.total_bytes += size
+            self._evict()
+
+        future.set_result(df)
+        return df
+
+    def _evict(self):
+        # Последний загруженный набор оставляем даже если он один больше лимита
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            self._discard(next(iter(self.entries)))
+
+    def indexed(self, path):
+        # Отсортированные индексы строятся один раз на версию файла и живут, пока он в кэше
+        df = self.get(path)
+        with self.lock:
+            indexed = self.indexed_entries.get(path)
+            if indexed is None or indexed[0] is not df:
+                indexed = (df, IndexedDataset(df, on_index=lambda nbytes: self._grow(path, df, nbytes)))
+                if path in self.entries:
+                    self.indexed_entries[path] = indexed
+            return indexed[1]
+
+    def _grow(self, path, df, nbytes):
+        # Индекс построен лениво, уже после загрузки: добавляем его память к записи файла
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[1] is not df:
+                return
+            self.entries[path] = (entry[0], df, entry[2] + nbytes)
+            self.total_bytes += nbytes
+            self._evict()
+
+    def metadata(self, path):
+        # Метаданные берем из сопроводительного файла снимка, а считаем по данным только если его нет
+        try:
+            sidecar_mtime = os.stat(sidecar_path(path)).st_mtime_ns
+        except FileNotFoundError:
+            sidecar_mtime = None
+        signature = (file_signature(path), sidecar_mtime)
+
+        with self.lock:
+            entry = self.metadata_entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self._touch(path)
+                return entry[1]
+
+        if path.endswith('.sqlite'):
+            # Историю не загружаем в pandas: все, что нужно, считает сама SQLite
+            meta = history_metadata(path)
+        else:
+            meta = read_sidecar(path)
+        if meta is None:
+            # Большой файл целиком в кэш не загружаем, а считаем метаданные за один проход по частям
+            meta = scan_metadata(path) if is_large_file(path) else snapshot_metadata(expand_frame(self.get(path)))
+
+        with self.lock:
+            self.metadata_entries[path] = (signature, meta)
+            self._touch(path)
+        return meta
+
+    def summary(self, path):
+        # Для списка файлов нужны только число строк и столбцы: у истории SQLite они есть без чтения строк
+        if path.endswith('.sqlite'):
+            return history_summary(path)
+        return self.metadata(path)
+
+    def derived(self, path, name, compute):
+        # Небольшие производные результаты (агрегаты, ряды) пересчитываются только при изменении файла
+        signature = file_signature(path)
+        with self.lock:
+            entry = self.derived_entries.get(path, {}).get(name)
+            if entry is not None and entry[0] == signature:
+                self._touch(path)
+                return entry[1]
+
+        value = compute()
+        with self.lock:
+            self.derived_entries.setdefault(path, {})[name] = (signature, value)
+            self._touch(path)
+        return value
+
+    def _touch(self, path):
+        self.side_paths[path] = None
+        self.side_paths.move_to_end(path)
+        while len(self.side_paths) > self.max_files:
+            oldest = next(iter(self.side_paths))
+            self._forget(oldest)
+
+    def _forget(self, path):
+        self.side_paths.pop(path, None)
+        self.metadata_entries.pop(path, None)
+        self.derived_entries.pop(path, None)
+
+    def _finish_pending(self, path, future):
+        pending = self.pending.get(path)
+        if pending is not None and pending[1] is future:
+            del self.pending[path]
+
+    def _discard(self, path):
+        self._forget(path)
+        self.indexed_entries.pop(path, None)
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.side_paths.clear()
+            self.metadata_entries.clear()
+            self.derived_entries.clear()
+            self.indexed_entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
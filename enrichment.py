@@ -0,0 +1,163 @@
+import asyncio
+import html
+import os
+import re
+from datetime import datetime
+
+import pandas as pd
+
+from crawler import HOST_LIMITER
+from fetching import HttpFetcher
+from http_cache import CachingFetcher, HttpCache
+from metrics import METRICS
+import replay
+from storage import AREA_PATTERN, DATA_DIR, FLOOR_PATTERN, HISTORY_DB_PATH, ROOM_TYPE_PATTERN, connect, listing_fields
+
+# Загружать ли страницы новых объявлений ради площади, этажа и года постройки
+ENRICH_DETAILS = os.getenv('SCRAPER_ENRICH_DETAILS', '0') == '1'
+DETAIL_CACHE_DIR = os.getenv('SCRAPER_DETAIL_CACHE_DIR', os.path.join(DATA_DIR, 'detail_cache'))
+
+DETAIL_COLUMNS = ['room_type', 'area', 'living_area', 'kitchen_area', 'floor', 'floors_total', 'built_year']
+
+DETAILS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS listing_details (
+    id TEXT PRIMARY KEY,
+    link TEXT,
+    room_type TEXT,
+    area REAL,
+    living_area REAL,
+    kitchen_area REAL,
+    floor INTEGER,
+    floors_total INTEGER,
+    built_year INTEGER,
+    fetched_at TEXT
+);
+"""
+
+TAG_PATTERN = re.compile(r'<[^>]+>')
+SCRIPT_PATTERN = re.compile(r'<(script|style)\b.*?</\1>', re.S | re.I)
+NUMBER = r'(\d+(?:[.,]\d+)?)'
+DETAIL_PATTERNS = {
+    'area': re.compile(r'Общая(?:\s+площадь)?\D{0,20}?' + NUMBER + r'\s*м', re.I),
+    'living_area': re.compile(r'Жилая(?:\s+площадь)?\D{0,20}?' + NUMBER + r'\s*м', re.I),
+    'kitchen_area': re.compile(r'(?:Площадь\s+)?кухн[яи]\D{0,20}?' + NUMBER + r'\s*м', re.I),
+    'built_year': re.compile(r'(?:Год\s+постройки|построен\w*\s+в)\D{0,20}?((?:19|20)\d{2})', re.I),
+}
+
+
+def page_text(page_source):
+    text = TAG_PATTERN.sub(' ', SCRIPT_PATTERN.sub(' ', page_source))
+    return re.sub(r'\s+', ' ', html.unescape(text))
+
+
+def _number(value):
+    return float(value.replace(',', '.'))
+
+
+def detail_fields(page_source):
+    # Поля со страницы объявления. Разметка страницы меняется чаще выдачи, поэтому ищем по тексту
+    text = page_text(page_source)
+    fields = dict.fromkeys(DETAIL_COLUMNS)
+    for name, pattern in DETAIL_PATTERNS.items():
+        match = pattern.search(text)
+        if match:
+            fields[name] = int(match.group(1)) if name == 'built_year' else _number(match.group(1))
+
+    if fields['area'] is None:
+        match = re.search(AREA_PATTERN, text)
+        if match:
+            fields['area'] = _number(match.group(1))
+    match = re.search(FLOOR_PATTERN, text)
+    if match:
+        fields['floor'] = int(match.group(1) or match.group(2))
+        fields['floors_total'] = int(match.group(3))
+    match = re.search(ROOM_TYPE_PATTERN, text)
+    if match:
+        fields['room_type'] = match.group(1).replace('квартира-', '')
+    return fields
+
+
+def _select_known(conn, ids):
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS detail_ids (id TEXT PRIMARY KEY)')
+    conn.execute('DELETE FROM detail_ids')
+    conn.executemany('INSERT OR IGNORE INTO detail_ids (id) VALUES (?)', ((i,) for i in ids))
+    return pd.read_sql_query(
+        f"SELECT d.id, {', '.join('d.' + column for column in DETAIL_COLUMNS)} "
+        'FROM listing_details d JOIN detail_ids s ON s.id = d.id',
+        conn,
+    ).set_index('id')
+
+
+def load_details(ids, path=HISTORY_DB_PATH):
+    conn = connect(path)
+    try:
+        conn.executescript(DETAILS_SCHEMA)
+        return _select_known(conn, ids)
+    finally:
+        conn.close()
+
+
+async def _fetch_details(urls, cache):
+    # При воспроизведении страницы уже на диске, кэш и ограничение частоты не нужны
+    if replay.REPLAY_DIR:
+        fetcher = replay.ReplayFetcher(replay.open_archive(replay.REPLAY_DIR))
+    else:
+        fetcher = CachingFetcher(HttpFetcher(), cache, rate_limiter=HOST_LIMITER)
+    async with fetcher:
+        return await fetcher.fetch_many(urls)
+
+
+def enrich_listings(df, path=HISTORY_DB_PATH, cache=None, logger=None):
+    # Страница загружается один раз на объявление: кто уже есть в listing_details, пропускается,
+    # а повторные обращения к той же ссылке отдает кэш на диске
+    links = df.dropna(subset=['id', 'link']).drop_duplicates(subset=['id']).set_index('id')['link']
+    conn = connect(path)
+    try:
+        conn.executescript(DETAILS_SCHEMA)
+        missing = links[~links.index.isin(_select_known(conn, links.index).index)]
+        if missing.empty:
+            return 0
+
+        if logger:
+            logger.info(f"Загружаем страницы {len(missing)} новых объявлений")
+        cache = cache or HttpCache(DETAIL_CACHE_DIR)
+        pages = asyncio.run(_fetch_details(list(dict.fromkeys(missing)), cache))
+
+        fetched_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rows = []
+        for listing_id, link in missing.items():
+            page_source = pages[link]
+            if isinstance(page_source, Exception):
+                # Не сохраняем: объявление попробуем снова при следующем запуске
+                METRICS.inc('detail_errors')
+                if logger:
+                    logger.warning(f"Не удалось загрузить страницу объявления {link}: "
+                                   f"{type(page_source).__name__}: {page_source}")
+                continue
+            fields = detail_fields(page_source)
+            rows.append((listing_id, link, *(fields[column] for column in DETAIL_COLUMNS), fetched_at))
+
+        with conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO listing_details (id, link, {', '.join(DETAIL_COLUMNS)}, fetched_at) "
+                f"VALUES ({', '.join('?' * (len(DETAIL_COLUMNS) + 3))})",
+                rows,
+            )
+    finally:
+        conn.close()
+
+    METRICS.inc('details_fetched', len(rows))
+    removed = cache.evict()
+    if logger and removed:
+        logger.info(f"Из кэша страниц удалено {removed} давно не запрашивавшихся записей")
+    return len(rows)
+
+
+def with_details(df, path=HISTORY_DB_PATH):
+    # Поля со страниц объявлений, если они уже загружены, остальное - из заголовка
+    details = load_details(df['id'].dropna().unique(), path)
+    if not details.empty:
+        df = df.copy()
+        for column in ('room_type', 'area', 'floor', 'floors_total'):
+            df[column] = df['id'].map(details[column])
+    return listing_fields(df)
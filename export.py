@@ -0,0 +1,213 @@
+import io
+import os
+import sqlite3
+import zlib
+from datetime import timedelta
+
+import pandas as pd
+
+from listing_store import TIMESTAMP_FORMAT
+from storage import HISTORY_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '50000'))
+
+# Номер строки в источнике: rowid для SQLite, порядковый номер для файлов.
+# Чтобы продолжить оборванную выгрузку, передайте последний полученный _row в cursor
+ROW_COLUMN = '_row'
+
+if pa is not None:
+    EXPORT_SCHEMA = pa.schema([
+        ('id', pa.string()),
+        ('title', pa.string()),
+        ('price', pa.int64()),
+        ('link', pa.string()),
+        ('scraped_at', pa.string()),
+        (ROW_COLUMN, pa.int64()),
+    ])
+
+
+class ExportFilters:
+    def __init__(self, min_price=None, max_price=None, date_from=None, date_to=None):
+        self.min_price = min_price
+        self.max_price = max_price
+        self.date_from = date_from
+        # date_to включает весь день, поэтому сравниваем со следующей датой
+        self.date_before = date_to + timedelta(days=1) if date_to else None
+
+    def sql(self):
+        clauses, params = [], []
+        if self.min_price is not None:
+            clauses.append('price >= ?')
+            params.append(self.min_price)
+        if self.max_price is not None:
+            clauses.append('price <= ?')
+            params.append(self.max_price)
+        if self.date_from:
+            clauses.append('scraped_at >= ?')
+            params.append(self.date_from.isoformat())
+        if self.date_before:
+            clauses.append('scraped_at < ?')
+            params.append(self.date_before.isoformat())
+        return clauses, params
+
+    def apply(self, chunk):
+        mask = pd.Series(True, index=chunk.index)
+        if self.min_price is not None:
+            mask &= chunk['price'] >= self.min_price
+        if self.max_price is not None:
+            mask &= chunk['price'] <= self.max_price
+
+        if self.date_from or self.date_before:
+            scraped_at = chunk['scraped_at']
+            convert = pd.Timestamp if pd.api.types.is_datetime64_any_dtype(scraped_at) else (lambda d: d.isoformat())
+            if self.date_from:
+                mask &= scraped_at >= convert(self.date_from)
+            if self.date_before:
+                mask &= scraped_at < convert(self.date_before)
+
+        return chunk[mask]
+
+
+def _sqlite_chunks(path, filters, cursor, chunk_size):
+    clauses, params = filters.sql()
+    where = ''.join(f' AND {clause}' for clause in clauses)
+    query = (f"SELECT {', '.join(HISTORY_COLUMNS)}, rowid AS {ROW_COLUMN} FROM history "
+             f"WHERE rowid > ?{where} ORDER BY rowid LIMIT ?")
+
+    conn = sqlite3.connect(path)
+    try:
+        last_row = cursor if cursor is not None else 0
+        while True:
+            chunk = pd.read_sql_query(query, conn, params=[last_row, *params, chunk_size])
+            if chunk.empty:
+                return
+            last_row = int(chunk[ROW_COLUMN].iloc[-1])
+            yield chunk
+    finally:
+        conn.close()
+
+
+def _parquet_chunks(path, filters, cursor, chunk_size):
+    parquet_file = pq.ParquetFile(path)
+    start = cursor + 1 if cursor is not None else 0
+
+    # Группы строк целиком до курсора не читаем
+    row_groups, offset, first_row = [], 0, None
+    for i in range(parquet_file.num_row_groups):
+        rows = parquet_file.metadata.row_group(i).num_rows
+        if offset + rows > start:
+            row_groups.append(i)
+            first_row = offset if first_row is None else first_row
+        offset += rows
+    if not row_groups:
+        return
+
+    position = first_row
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, row_groups=row_groups):
+        chunk = batch.to_pandas()
+        # Время сбора в том же виде, что в CSV и SQLite
+        if 'scraped_at' in chunk.columns and pd.api.types.is_datetime64_any_dtype(chunk['scraped_at']):
+            chunk['scraped_at'] = chunk['scraped_at'].dt.strftime(TIMESTAMP_FORMAT)
+        chunk[ROW_COLUMN] = range(position, position + len(chunk))
+        position += len(chunk)
+        chunk = filters.apply(chunk[chunk[ROW_COLUMN] >= start])
+        if not chunk.empty:
+            yield chunk
+
+
+def _csv_chunks(path, filters, cursor, chunk_size):
+    start = cursor + 1 if cursor is not None else 0
+    skip = (lambda i: 0 < i <= start) if start else None
+
+    position = start
+    for chunk in pd.read_csv(path, chunksize=chunk_size, skiprows=skip):
+        chunk[ROW_COLUMN] = range(position, position + len(chunk))
+        position += len(chunk)
+        chunk = filters.apply(chunk)
+        if not chunk.empty:
+            yield chunk
+
+
+def iter_chunks(path, filters=None, cursor=None, chunk_size=EXPORT_CHUNK_ROWS):
+    filters = filters or ExportFilters()
+    if path.endswith('.sqlite'):
+        return _sqlite_chunks(path, filters, cursor, chunk_size)
+    if path.endswith('.parquet'):
+        return _parquet_chunks(path, filters, cursor, chunk_size)
+    return _csv_chunks(path, filters, cursor, chunk_size)
+
+
+def ndjson_stream(chunks):
+    for chunk in chunks:
+        lines = chunk.to_json(orient='records', lines=True, force_ascii=False, date_format='iso')
+        yield (lines if lines.endswith('\n') else lines + '\n').encode()
+
+
+def arrow_stream(chunks, schema=None):
+    sink = io.BytesIO()
+    writer = None
+
+    for chunk in chunks:
+        if writer is None:
+            if schema is None and set(chunk.columns) == set(EXPORT_SCHEMA.names):
+                schema = EXPORT_SCHEMA
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            schema = table.schema
+            writer = pa.ipc.new_stream(sink, schema)
+        else:
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+
+        writer.write_table(table)
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+
+    if writer is None:
+        writer = pa.ipc.new_stream(sink, schema or EXPORT_SCHEMA)
+    writer.close()
+    yield sink.getvalue()
+
+
+def choose_encoding(requested=None, accept_encoding=''):
+    if requested:
+        return requested
+    accepted = {part.split(';')[0].strip() for part in accept_encoding.split(',')}
+    if 'zstd' in accepted and zstandard is not None:
+        return 'zstd'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return 'identity'
+
+
+def compress_stream(stream, encoding):
+    if encoding == 'identity':
+        yield from stream
+        return
+
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for block in stream:
+            data = compressor.compress(block)
+            if data:
+                yield data
+        yield compressor.flush()
+        return
+
+    compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    for block in stream:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
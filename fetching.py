@@ -0,0 +1,161 @@
+import asyncio
+import atexit
+import os
+import threading
+
+import aiohttp
+
+import replay
+from metrics import METRICS
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36'
+
+HTTP_CONCURRENCY = int(os.getenv('SCRAPER_HTTP_CONCURRENCY', '8'))
+HTTP_TIMEOUT = float(os.getenv('SCRAPER_HTTP_TIMEOUT', '30'))
+HTTP_KEEPALIVE = float(os.getenv('SCRAPER_HTTP_KEEPALIVE', '60'))
+
+DEFAULT_HEADERS = {
+    'User-Agent': USER_AGENT,
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8',
+}
+
+# Признаки того, что сервер отдал заглушку вместо выдачи и без браузера не обойтись
+JS_REQUIRED_MARKERS = ('showcaptcha', 'smartcaptcha', 'checkcaptcha', '<noscript>включите javascript')
+LISTING_MARKERS = ('OffersSerpItem', 'CardComponent', 'OfferCard', 'offer-card')
+# Признаки настоящей выдачи без объявлений: пустой запрос или страница после последней.
+# Такая страница - ноль результатов, браузер ее не исправит
+EMPTY_RESULT_MARKERS = ('offersserpnotfound', 'serpnotfound', 'offersserp__list', 'ничего не найдено')
+
+
+def needs_js(page_source):
+    if not page_source or not page_source.strip():
+        return True
+    lowered = page_source.lower()
+    if any(marker in lowered for marker in JS_REQUIRED_MARKERS):
+        return True
+    if any(marker in page_source for marker in LISTING_MARKERS):
+        return False
+    return not any(marker in lowered for marker in EMPTY_RESULT_MARKERS)
+
+
+class HttpFetcher:
+    def __init__(self, concurrency=HTTP_CONCURRENCY, timeout=HTTP_TIMEOUT, headers=None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.headers = dict(DEFAULT_HEADERS, **(headers or {}))
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=self.concurrency,
+            keepalive_timeout=HTTP_KEEPALIVE,
+            ttl_dns_cache=300,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        self.session = None
+
+    async def fetch_response(self, url, headers=None):
+        # Код ответа, текст и заголовки. 304 на условный запрос ошибкой не считается, текста у него нет
+        try:
+            with METRICS.timer('fetch', source='http'):
+                async with self.session.get(url, headers=headers) as response:
+                    if response.status != 304:
+                        response.raise_for_status()
+                    body = await response.read()
+                    page_source = await response.text() if response.status != 304 else None
+                    status, response_headers = response.status, dict(response.headers)
+        except Exception:
+            METRICS.inc('fetch_errors', source='http')
+            raise
+        METRICS.inc('fetch_bytes', len(body), source='http')
+        return status, page_source, response_headers
+
+    async def fetch(self, url):
+        status, page_source, _ = await self.fetch_response(url)
+        return page_source
+
+    async def fetch_many(self, urls):
+        results = await asyncio.gather(*(self.fetch(url) for url in urls), return_exceptions=True)
+        return dict(zip(urls, results))
+
+
+def open_fetcher(**kwargs):
+    # В режиме воспроизведения страницы берутся из архива, а не с сайта
+    if replay.REPLAY_DIR:
+        return replay.ReplayFetcher(replay.open_archive(replay.REPLAY_DIR))
+    return HttpFetcher(**kwargs)
+
+
+async def _fetch_pages(urls, **kwargs):
+    async with open_fetcher(**kwargs) as fetcher:
+        return await fetcher.fetch_many(urls)
+
+
+def fetch_pages(urls, **kwargs):
+    # Возвращает {url: html} либо {url: исключение}, если страницу скачать не удалось
+    return asyncio.run(_fetch_pages(list(urls), **kwargs))
+
+
+class SharedFetcher:
+    # Один загрузчик с пулом keep-alive соединений на весь процесс. Его event loop работает
+    # в отдельном потоке, а синхронные задачи (scrape_page в пуле потоков Prefect) отдают ему
+    # запросы, поэтому соединения с сайтом переиспользуются между страницами и задачами
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.loop = None
+        self.thread = None
+        self.fetcher = None
+        self.replay_dir = None
+        self.lock = threading.Lock()
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def _open(self):
+        with self.lock:
+            # Режим воспроизведения могут включить уже после первого запроса (например, в бенчмарке)
+            if self.fetcher is not None and self.replay_dir != replay.REPLAY_DIR:
+                self._close_fetcher()
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name='shared-fetcher', daemon=True)
+                self.thread.start()
+            if self.fetcher is None:
+                fetcher = open_fetcher(**self.kwargs)
+                self._call(fetcher.__aenter__())
+                self.fetcher, self.replay_dir = fetcher, replay.REPLAY_DIR
+            return self.fetcher
+
+    def _close_fetcher(self):
+        fetcher, self.fetcher = self.fetcher, None
+        self._call(fetcher.__aexit__(None, None, None))
+
+    def fetch(self, url):
+        fetcher = self._open()
+        return self._call(fetcher.fetch(url))
+
+    def close(self):
+        with self.lock:
+            if self.loop is None:
+                return
+            if self.fetcher is not None:
+                self._close_fetcher()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.loop = None
+            self.thread = None
+
+
+SHARED_FETCHER = SharedFetcher()
+atexit.register(SHARED_FETCHER.close)
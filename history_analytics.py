@@ -0,0 +1,328 @@
+import pandas as pd
+
+from chunked import PriceAccumulator
+from storage import CHUNK_ROWS, HISTORY_DB_PATH, connect
+
+PERIODS = ['day', 'week', 'month']
+
+ANALYTICS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS period_stats (
+    period TEXT NOT NULL,
+    period_start TEXT NOT NULL,
+    count INTEGER,
+    unique_listings INTEGER,
+    mean_price REAL,
+    median_price REAL,
+    min_price INTEGER,
+    max_price INTEGER,
+    p10_price REAL,
+    p25_price REAL,
+    p75_price REAL,
+    p90_price REAL,
+    PRIMARY KEY (period, period_start)
+);
+CREATE TABLE IF NOT EXISTS listing_lifetimes (
+    id TEXT PRIMARY KEY,
+    first_seen TEXT,
+    last_seen TEXT,
+    first_price INTEGER,
+    last_price INTEGER,
+    price_changes INTEGER
+);
+CREATE TABLE IF NOT EXISTS price_changes (
+    id TEXT NOT NULL,
+    changed_at TEXT NOT NULL,
+    old_price INTEGER,
+    new_price INTEGER,
+    PRIMARY KEY (id, changed_at, new_price)
+);
+CREATE TABLE IF NOT EXISTS analytics_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Начало периода в SQL, в том же виде 'YYYY-MM-DD', что и в period_stats; неделя начинается с понедельника
+PERIOD_KEYS = {
+    'day': 'substr(scraped_at, 1, 10)',
+    'week': "date(scraped_at, '-' || ((CAST(strftime('%w', scraped_at) AS INTEGER) + 6) % 7) || ' days')",
+    'month': "substr(scraped_at, 1, 7) || '-01'",
+}
+
+# Перцентили цены за период в дополнение к медиане
+PERIOD_QUANTILES = {'p10_price': 0.1, 'p25_price': 0.25, 'p75_price': 0.75, 'p90_price': 0.9}
+
+
+def _ensure_quantile_columns(conn):
+    # В базах, созданных до появления перцентилей, добавляем столбцы и пересчитываем все периоды
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(period_stats)')}
+    missing = [column for column in PERIOD_QUANTILES if column not in existing]
+    if not missing:
+        return
+    with conn:
+        for column in missing:
+            conn.execute(f'ALTER TABLE period_stats ADD COLUMN {column} REAL')
+        first = conn.execute('SELECT MIN(scraped_at) FROM history').fetchone()[0]
+        if first is not None:
+            _set_state(conn, 'pending_since', first)
+
+
+def _get_state(conn, key, default=None):
+    row = conn.execute('SELECT value FROM analytics_state WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+
+def _set_state(conn, key, value):
+    conn.execute('INSERT OR REPLACE INTO analytics_state (key, value) VALUES (?, ?)', (key, str(value)))
+
+
+def _previous_listings(conn, ids):
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS batch_ids (id TEXT PRIMARY KEY)')
+    conn.execute('DELETE FROM batch_ids')
+    conn.executemany('INSERT OR IGNORE INTO batch_ids (id) VALUES (?)', ((i,) for i in ids))
+    return pd.read_sql_query(
+        'SELECT l.id, l.last_price FROM listing_lifetimes l JOIN batch_ids b ON b.id = l.id', conn
+    ).set_index('id')['last_price']
+
+
+def _update_listings(conn, new):
+    new = new.sort_values(['id', 'scraped_at', 'row'], kind='stable')
+
+    # Цена до изменения: предыдущее наблюдение в пачке, а для первого - последняя известная цена
+    previous_price = new.groupby('id', sort=False)['price'].shift()
+    first_in_batch = previous_price.isna()
+    previous_price[first_in_batch] = new.loc[first_in_batch, 'id'].map(_previous_listings(conn, new['id'].unique()))
+
+    changed = previous_price.notna() & (previous_price != new['price'])
+    changes = pd.DataFrame({
+        'id': new.loc[changed, 'id'],
+        'changed_at': new.loc[changed, 'scraped_at'].dt.strftime(TIME_FORMAT),
+        'old_price': previous_price[changed].astype('int64'),
+        'new_price': new.loc[changed, 'price'],
+    })
+    conn.executemany(
+        'INSERT OR IGNORE INTO price_changes (id, changed_at, old_price, new_price) VALUES (?, ?, ?, ?)',
+        changes.itertuples(index=False, name=None),
+    )
+
+    new['changed'] = changed
+    lifetimes = new.groupby('id', sort=False).agg(
+        first_seen=('scraped_at', 'min'),
+        last_seen=('scraped_at', 'max'),
+        first_price=('price', 'first'),
+        last_price=('price', 'last'),
+        price_changes=('changed', 'sum'),
+    ).reset_index()
+    lifetimes['first_seen'] = lifetimes['first_seen'].dt.strftime(TIME_FORMAT)
+    lifetimes['last_seen'] = lifetimes['last_seen'].dt.strftime(TIME_FORMAT)
+    lifetimes['price_changes'] = lifetimes['price_changes'].astype('int64')
+
+    conn.executemany(
+        """
+        INSERT INTO listing_lifetimes (id, first_seen, last_seen, first_price, last_price, price_changes)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            first_price = CASE WHEN excluded.first_seen < first_seen THEN excluded.first_price ELSE first_price END,
+            last_price = CASE WHEN excluded.last_seen >= last_seen THEN excluded.last_price ELSE last_price END,
+            first_seen = MIN(first_seen, excluded.first_seen),
+            last_seen = MAX(last_seen, excluded.last_seen),
+            price_changes = price_changes + excluded.price_changes
+        """,
+        lifetimes.itertuples(index=False, name=None),
+    )
+    return len(changes)
+
+
+def _sync_last_seen(conn):
+    # В историю попадают только новые и изменившиеся цены, поэтому у объявления с неизменной ценой
+    # last_seen по ней застыл бы на первом появлении. Последнее появление берем из индекса отпечатков,
+    # который обновляется по всей выдаче каждого запуска; переносим только записи новее прошлой сверки
+    has_index = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'listing_index'"
+    ).fetchone()
+    if not has_index:
+        return
+    synced = _get_state(conn, 'last_seen_synced', '')
+    conn.execute(
+        """
+        UPDATE listing_lifetimes
+        SET last_seen = (SELECT i.last_seen FROM listing_index i WHERE i.id = listing_lifetimes.id)
+        WHERE id IN (SELECT id FROM listing_index WHERE last_seen > ?)
+          AND last_seen < (SELECT i.last_seen FROM listing_index i WHERE i.id = listing_lifetimes.id)
+        """,
+        (synced,),
+    )
+    latest = conn.execute('SELECT MAX(last_seen) FROM listing_index').fetchone()[0]
+    if latest is not None:
+        _set_state(conn, 'last_seen_synced', latest)
+
+
+def _price_counts(conn, period, start, end):
+    # Количество наблюдений каждой цены по периодам считает SQLite: в Python приходит
+    # по строке на пару (период, цена), сколько бы строк истории ни было в периоде
+    return pd.read_sql_query(
+        f'SELECT {PERIOD_KEYS[period]} AS period_start, price, COUNT(*) AS count FROM history '
+        'WHERE scraped_at >= ? AND scraped_at < ? GROUP BY period_start, price',
+        conn,
+        params=[start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT)],
+    )
+
+
+def _unique_listings(conn, period, start, end):
+    return pd.read_sql_query(
+        f'SELECT {PERIOD_KEYS[period]} AS period_start, COUNT(DISTINCT id) AS unique_listings FROM history '
+        'WHERE scraped_at >= ? AND scraped_at < ? GROUP BY period_start',
+        conn,
+        params=[start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT)],
+    ).set_index('period_start')['unique_listings']
+
+
+def _aggregate(counts, unique_listings):
+    # Медиана и перцентили по количествам цен точные, как у pandas по самим строкам
+    stats = {}
+    for start, group in counts.groupby('period_start', sort=True):
+        prices = PriceAccumulator()
+        prices.add_counts(group.set_index('price')['count'])
+        values = prices.counts.index.to_numpy(dtype='float64')
+        weights = prices.counts.to_numpy()
+        stats[start] = {
+            'count': int(weights.sum()),
+            'unique_listings': int(unique_listings[start]),
+            'mean_price': float((values * weights).sum() / weights.sum()),
+            'median_price': float(prices.quantile(0.5)),
+            'min_price': int(values[0]),
+            'max_price': int(values[-1]),
+            **{column: float(prices.quantile(q)) for column, q in PERIOD_QUANTILES.items()},
+        }
+    return pd.DataFrame.from_dict(stats, orient='index')
+
+
+def _period_stats(conn, period, start, end):
+    return _aggregate(_price_counts(conn, period, start, end), _unique_listings(conn, period, start, end))
+
+
+def _write_period_stats(conn, period, stats):
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO period_stats
+            (period, period_start, count, unique_listings, mean_price, median_price, min_price, max_price,
+             p10_price, p25_price, p75_price, p90_price)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        ((period, index, *values) for index, *values in stats.itertuples(name=None)),
+    )
+
+
+def _update_periods(conn, since):
+    # Пересчитываем только периоды, затронутые новыми данными, начиная с самой ранней
+    # затронутой недели или месяца. Историю обходим окнами по месяцу и по неделе, а строки
+    # группирует SQLite: память зависит от числа различных цен, а не от строк в периоде
+    since = pd.Timestamp(since).normalize()
+    week = since - pd.Timedelta(days=since.weekday())
+    start = min(week, since.replace(day=1))
+
+    last_scraped = conn.execute('SELECT MAX(scraped_at) FROM history').fetchone()[0]
+    if last_scraped is None:
+        return
+    end = pd.Timestamp(last_scraped)
+
+    month = start.replace(day=1)
+    while month <= end:
+        next_month = month + pd.offsets.MonthBegin()
+        stats = _period_stats(conn, 'day', max(month, start), next_month)
+        if not stats.empty:
+            _write_period_stats(conn, 'day', stats)
+            # Месяц, начавшийся раньше start, прочитан не полностью - его не трогаем
+            if month >= start:
+                _write_period_stats(conn, 'month', _period_stats(conn, 'month', month, next_month))
+        month = next_month
+
+    while week <= end:
+        stats = _period_stats(conn, 'week', week, week + pd.Timedelta(days=7))
+        if not stats.empty:
+            _write_period_stats(conn, 'week', stats)
+        week += pd.Timedelta(days=7)
+
+
+def update_analytics(path=HISTORY_DB_PATH, chunk_rows=CHUNK_ROWS):
+    # Обрабатывает только строки истории, добавленные после прошлого запуска, пачками по chunk_rows
+    conn = connect(path)
+    try:
+        conn.executescript(ANALYTICS_SCHEMA)
+        _ensure_quantile_columns(conn)
+        last_row = int(_get_state(conn, 'last_row', 0))
+        processed = 0
+
+        while True:
+            new = pd.read_sql_query(
+                'SELECT rowid AS row, id, price, scraped_at FROM history WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                conn,
+                params=[last_row, chunk_rows],
+            )
+            if new.empty:
+                break
+
+            new['scraped_at'] = pd.to_datetime(new['scraped_at'])
+            # Самую раннюю затронутую дату храним в базе, чтобы пересчет периодов
+            # не потерялся, если обработка прервется между пачками
+            since = new['scraped_at'].min().strftime(TIME_FORMAT)
+            pending = _get_state(conn, 'pending_since')
+            last_row = int(new['row'].max())
+            with conn:
+                _update_listings(conn, new)
+                _set_state(conn, 'last_row', last_row)
+                _set_state(conn, 'pending_since', min(since, pending) if pending else since)
+            processed += len(new)
+
+        with conn:
+            _sync_last_seen(conn)
+
+        pending = _get_state(conn, 'pending_since')
+        if pending:
+            with conn:
+                _update_periods(conn, pending)
+                conn.execute("DELETE FROM analytics_state WHERE key = 'pending_since'")
+        return processed
+    finally:
+        conn.close()
+
+
+def load_period_stats(period='day', path=HISTORY_DB_PATH):
+    conn = connect(path)
+    try:
+        conn.executescript(ANALYTICS_SCHEMA)
+        return pd.read_sql_query(
+            'SELECT * FROM period_stats WHERE period = ? ORDER BY period_start', conn, params=[period]
+        )
+    finally:
+        conn.close()
+
+
+def load_summary(path=HISTORY_DB_PATH):
+    conn = connect(path)
+    try:
+        conn.executescript(ANALYTICS_SCHEMA)
+        listings, first_seen, last_seen, changed = conn.execute(
+            'SELECT COUNT(*), MIN(first_seen), MAX(last_seen), SUM(price_changes > 0) FROM listing_lifetimes'
+        ).fetchone()
+        changes = conn.execute('SELECT COUNT(*) FROM price_changes').fetchone()[0]
+        return {
+            'listings': listings,
+            'first_seen': first_seen,
+            'last_seen': last_seen,
+            'listings_with_changes': changed or 0,
+            'price_changes': changes,
+        }
+    finally:
+        conn.close()
+
+
+def load_listing_lifetimes(path=HISTORY_DB_PATH):
+    conn = connect(path)
+    try:
+        conn.executescript(ANALYTICS_SCHEMA)
+        return pd.read_sql_query('SELECT * FROM listing_lifetimes', conn)
+    finally:
+        conn.close()
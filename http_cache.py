@@ -0,0 +1,144 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import time
+
+from metrics import METRICS
+from replay import record_page
+
+# Свежая запись отдается без обращения к сайту; устаревшая перепроверяется условным запросом
+HTTP_CACHE_TTL = float(os.getenv('SCRAPER_HTTP_CACHE_TTL', str(7 * 24 * 3600)))
+# Записи, которые не загружались и не перепроверялись дольше этого срока, удаляются с диска
+HTTP_CACHE_MAX_AGE = float(os.getenv('SCRAPER_HTTP_CACHE_MAX_AGE', str(30 * 24 * 3600)))
+
+CACHE_RESULT_FRESH = 'fresh'
+CACHE_RESULT_REVALIDATED = 'revalidated'
+CACHE_RESULT_MISS = 'miss'
+
+
+class HttpCache:
+    # Кэш ответов на диске: тело в gzip и рядом JSON с адресом, ETag, Last-Modified и временем проверки
+    def __init__(self, directory, ttl=HTTP_CACHE_TTL, max_age=HTTP_CACHE_MAX_AGE):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_age = max_age
+
+    def _path(self, url, suffix):
+        return os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + suffix)
+
+    def _write_meta(self, url, meta):
+        path = self._path(url, '.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def lookup(self, url):
+        try:
+            with open(self._path(url, '.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Разные адреса с одинаковым хэшем не путаем
+        return meta if meta.get('url') == url else None
+
+    def body(self, url):
+        try:
+            with gzip.open(self._path(url, '.html.gz'), 'rb') as f:
+                return f.read().decode('utf-8')
+        except OSError:
+            return None
+
+    def is_fresh(self, meta, now=None):
+        return (now or time.time()) - meta['checked_at'] < self.ttl
+
+    def validators(self, meta):
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def store(self, url, page_source, headers):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(url, '.html.gz')
+        with gzip.open(path + '.tmp', 'wb') as f:
+            f.write(page_source.encode('utf-8'))
+        os.replace(path + '.tmp', path)
+        self._write_meta(url, {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'checked_at': time.time(),
+        })
+
+    def touch(self, url, meta):
+        # Сервер ответил 304: содержимое не изменилось, продлеваем срок свежести
+        self._write_meta(url, dict(meta, checked_at=time.time()))
+
+    def evict(self, now=None):
+        now = now or time.time()
+        if not os.path.isdir(self.directory):
+            return 0
+        removed = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            # Файл метаданных переписывается при каждой загрузке и перепроверке, его время и есть время проверки
+            meta_path = os.path.join(self.directory, name)
+            try:
+                checked_at = os.path.getmtime(meta_path)
+            except FileNotFoundError:
+                continue
+            if now - checked_at < self.max_age:
+                continue
+            for path in (meta_path, meta_path[:-len('.json')] + '.html.gz'):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            removed += 1
+        return removed
+
+
+class CachingFetcher:
+    # Обертка над HttpFetcher: свежие страницы берутся с диска,
+    # устаревшие перепроверяются по ETag/Last-Modified, и только новые качаются целиком
+    def __init__(self, fetcher, cache, rate_limiter=None):
+        self.fetcher = fetcher
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+
+    async def __aenter__(self):
+        await self.fetcher.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.fetcher.__aexit__(exc_type, exc, tb)
+
+    async def fetch(self, url):
+        meta = self.cache.lookup(url)
+        cached = self.cache.body(url) if meta is not None else None
+        if cached is not None and self.cache.is_fresh(meta):
+            METRICS.inc('http_cache', result=CACHE_RESULT_FRESH)
+            return cached
+
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(url)
+        headers = self.cache.validators(meta) if cached is not None else None
+        status, page_source, response_headers = await self.fetcher.fetch_response(url, headers=headers)
+        if status == 304 and cached is not None:
+            self.cache.touch(url, meta)
+            METRICS.inc('http_cache', result=CACHE_RESULT_REVALIDATED)
+            return cached
+
+        self.cache.store(url, page_source, response_headers)
+        record_page(url, page_source)
+        METRICS.inc('http_cache', result=CACHE_RESULT_MISS)
+        return page_source
+
+    async def fetch_many(self, urls):
+        results = await asyncio.gather(*(self.fetch(url) for url in urls), return_exceptions=True)
+        return dict(zip(urls, results))
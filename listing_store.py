@@ -0,0 +1,186 @@
+import hashlib
+import re
+import sys
+import time
+from array import array
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+BASE_URL = 'https://realty.yandex.ru'
+
+OFFER_ID_PATTERN = re.compile(r'/offer/(\d+)')
+OFFER_LINK_PREFIX = f'{BASE_URL}/offer/'
+
+NO_OFFER_ID = -1
+NO_PRICE = -1
+MAX_OFFER_ID = 2**63 - 1
+
+LISTING_COLUMNS = ['id', 'title', 'price', 'link', 'scraped_at']
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def offer_id(link):
+    match = OFFER_ID_PATTERN.search(link or '')
+    if match is None:
+        return None
+    number = int(match.group(1))
+    return number if number <= MAX_OFFER_ID else None
+
+
+def offer_link(number):
+    return f'{BASE_URL}/offer/{number}/'
+
+
+def listing_key(link):
+    # Ключ объявления в истории, индексе изменений и снимках - по-прежнему md5 ссылки,
+    # иначе накопленная история не совпала бы с новыми запусками
+    return hashlib.md5(link.encode()).hexdigest()
+
+
+class ListingBatch:
+    # Объявления одной страницы в колонках на array: номер объявления и цена по 8 байт, заголовок -
+    # номер в таблице интернированных строк, время сбора - одно на всю страницу.
+    # Ссылка хранится отдельно, только если ее нельзя восстановить по номеру объявления
+    __slots__ = ('scraped_at', 'offer_ids', 'prices', 'title_codes', 'titles', 'links')
+
+    def __init__(self, scraped_at=None):
+        self.scraped_at = int(time.time()) if scraped_at is None else int(scraped_at)
+        self.offer_ids = array('q')
+        self.prices = array('q')
+        self.title_codes = array('i')
+        self.titles = {}
+        self.links = {}
+
+    def __len__(self):
+        return len(self.prices)
+
+    def append(self, title, price, link):
+        number = offer_id(link)
+        if number is None or link != offer_link(number):
+            self.links[len(self.prices)] = link
+        code = self.titles.get(title)
+        if code is None:
+            code = self.titles[sys.intern(title)] = len(self.titles)
+        self.offer_ids.append(NO_OFFER_ID if number is None else number)
+        self.prices.append(NO_PRICE if price is None else price)
+        self.title_codes.append(code)
+
+    def title_list(self):
+        return list(self.titles)
+
+    def link(self, i):
+        # Сохраненная ссылка отдается как есть, даже пустая: восстанавливаем только по настоящему номеру
+        if i in self.links:
+            return self.links[i]
+        number = self.offer_ids[i]
+        return offer_link(number) if number >= 0 else ''
+
+    def link_list(self):
+        return [self.link(i) for i in range(len(self))]
+
+    def dedupe_keys(self):
+        # Повторы ищутся по ссылке, а у карточек без ссылки - по заголовку и цене,
+        # иначе все они совпали бы по пустой ссылке и от разных объявлений осталось бы одно
+        titles = self.title_list()
+        return [
+            link or (titles[self.title_codes[i]], self.prices[i])
+            for i, link in enumerate(self.link_list())
+        ]
+
+    def take(self, positions):
+        titles = self.title_list()
+        batch = ListingBatch(self.scraped_at)
+        for i in positions:
+            price = self.prices[i]
+            batch.append(titles[self.title_codes[i]], None if price == NO_PRICE else price, self.link(i))
+        return batch
+
+
+def listings_frame(batches):
+    # Таблица с прежними столбцами для сохранения: заголовки категориями,
+    # время сбора форматируется один раз на страницу, а не на каждое объявление
+    titles = {}
+    title_codes, prices, links, scraped_at = [], [], [], []
+    for batch in batches:
+        if not len(batch):
+            continue
+        remap = np.array([titles.setdefault(title, len(titles)) for title in batch.titles], dtype=np.int32)
+        title_codes.append(remap[np.frombuffer(batch.title_codes, dtype=np.int32)])
+        prices.append(np.frombuffer(batch.prices, dtype=np.int64))
+        links.extend(batch.link_list())
+        stamp = datetime.fromtimestamp(batch.scraped_at).strftime(TIMESTAMP_FORMAT)
+        scraped_at.append(np.full(len(batch), stamp, dtype=object))
+
+    if not links:
+        return pd.DataFrame(columns=LISTING_COLUMNS)
+
+    price = np.concatenate(prices)
+    missing = price == NO_PRICE
+    return pd.DataFrame({
+        'id': [listing_key(link) for link in links],
+        'title': pd.Categorical.from_codes(np.concatenate(title_codes), categories=list(titles)),
+        'price': np.where(missing, np.nan, price) if missing.any() else price,
+        'link': links,
+        'scraped_at': np.concatenate(scraped_at),
+    })
+
+
+def drop_duplicate_listings(df):
+    # То же правило, что ListingBatch.dedupe_keys, для готовой таблицы
+    links = df['link'].astype(object)
+    keys = links.where(links.fillna('') != '', df['title'].astype(str) + '\x00' + df['price'].astype(str))
+    return df[~keys.duplicated()]
+
+
+def compact_frame(df):
+    # Представление для кэша API: ссылку заменяет целый номер объявления, md5-ключ не хранится,
+    # если он совпадает с md5 ссылки, а повторяющиеся строки хранятся категориями.
+    # Если хотя бы одна ссылка не восстанавливается по номеру, ссылки и ключи остаются как есть
+    df = df.copy(deep=False)
+    for column in df.columns:
+        values = df[column]
+        if (pd.api.types.is_string_dtype(values) or values.dtype == object) and values.nunique() <= len(values) // 2:
+            df[column] = values.astype('category')
+
+    if not len(df) or 'link' not in df.columns or not pd.api.types.is_string_dtype(df['link']):
+        return df
+    # Ссылка восстанавливается однозначно, если это BASE_URL/offer/<номер>/ без ведущих нулей
+    links = df['link']
+    numbers = links.str.slice(len(OFFER_LINK_PREFIX), -1)
+    canonical = (links.str.startswith(OFFER_LINK_PREFIX) & links.str.endswith('/') & numbers.str.isdigit()
+                 & ~numbers.str.startswith('0') & (numbers.str.len() <= 19))
+    if not canonical.all():
+        return df
+    try:
+        numbers = numbers.astype('int64')
+    except (OverflowError, ValueError):
+        return df
+
+    keys = None
+    if df.columns[0] == 'id':
+        keys = np.array([listing_key(link) for link in links.tolist()], dtype=object)
+    position = df.columns.get_loc('link')
+    df = df.drop(columns='link')
+    df.insert(position, 'offer_id', numbers.to_numpy())
+    if keys is not None and (df['id'].astype(object).to_numpy() == keys).all():
+        df = df.drop(columns='id')
+    return df
+
+
+def expand_frame(df):
+    # Обратно к столбцам файла: ссылка и md5-ключ восстанавливаются только для отдаваемых строк
+    if 'offer_id' not in df.columns:
+        return df
+    links = [offer_link(number) for number in df['offer_id']]
+    position = df.columns.get_loc('offer_id')
+    df = df.drop(columns='offer_id')
+    df.insert(position, 'link', links)
+    if 'id' not in df.columns:
+        df.insert(0, 'id', [listing_key(link) for link in links])
+    return df
+
+
+def frame_columns(df):
+    return expand_frame(df.iloc[:0]).columns
@@ -1,143 +1,186 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from prefect import task, flow, get_run_logger
+from prefect.artifacts import create_markdown_artifact
+from prefect.exceptions import MissingContextError
+from prefect.futures import as_completed
+from prefect.task_runners import ThreadPoolTaskRunner
 import pandas as pd
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
-from bs4 import BeautifulSoup
+import atexit
+import json
+import logging
 import time
-import random
 import traceback
 import os
-import hashlib
+
+from browser_pool import BrowserPool
+from change_detection import EVENT_CHANGED, EVENT_NEW, EVENT_REMOVED, commit_changes, detect_changes
+from crawler import CRAWL_WORKERS, MAX_PAGES, crawl, fetch_page, load_queries
+from enrichment import ENRICH_DETAILS, enrich_listings, with_details
+from fetching import USER_AGENT
+from history_analytics import update_analytics
+from listing_store import LISTING_COLUMNS, ListingBatch, drop_duplicate_listings, listings_frame
+from metrics import METRICS
+from parsing import ListingParser
+import replay
+from storage import HISTORY_DB_PATH, append_history, migrate_csv_history, needs_migration, write_snapshot
 
 os.makedirs('data', exist_ok=True)
 
 
 CHROME_DRIVER_PATH = r'C:\Users\Анастасия\Downloads\chromedriver-win64\chromedriver-win64\chromedriver.exe'
 
-@task(retries=2, retry_delay_seconds=30)
-def scrape_data():
-    logger = get_run_logger()
-    logger.info("Начинаем сбор данных с сайта.")
+FETCH_MODE = os.getenv('SCRAPER_FETCH_MODE', 'http')
+
+# mapped - отдельная задача Prefect на каждую страницу, crawl - весь обход одной задачей
+FLOW_MODE = os.getenv('SCRAPER_FLOW_MODE', 'mapped')
+
+# Скачанная страница переиспользуется повторами в пределах этого окна времени
+PAGE_CACHE_SECONDS = int(os.getenv('SCRAPER_PAGE_CACHE_SECONDS', '1800'))
+
+PARSER = ListingParser(os.getenv('SCRAPER_PARSER'))
 
+def build_driver():
     options = Options()
     options.add_argument('--headless')
     options.add_argument('--disable-blink-features=AutomationControlled')  
-    options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36')
+    options.add_argument(f'--user-agent={USER_AGENT}')
     options.add_argument('--disable-extensions')
     options.add_argument('--disable-gpu')
     options.add_argument('--no-sandbox')
     options.add_argument('--disable-dev-shm-usage')
 
+    service = Service(executable_path=CHROME_DRIVER_PATH)
+    return webdriver.Chrome(service=service, options=options)
+
+# Пул создается один раз на процесс, поэтому прогретые браузеры переживают повторы задачи и потока
+BROWSER_POOL = BrowserPool(build_driver)
+atexit.register(BROWSER_POOL.close)
+
+def run_logger():
+    # Вне запуска Prefect (например, в бенчмарке) задачи вызываются через .fn и пишут в обычный логгер
+    try:
+        return get_run_logger()
+    except MissingContextError:
+        return logging.getLogger('real_estate_scraper')
+
+def browser_fallback(logger):
+    # При воспроизведении из архива браузер не нужен: чего нет в архиве, того нет и в выдаче
+    if replay.REPLAY_DIR:
+        return None
+    return lambda url: BROWSER_POOL.fetch(url, logger)
+
+def parse_page(page_source, logger):
+    return PARSER.parse(page_source, logger)
+
+@task(retries=2, retry_delay_seconds=30)
+def scrape_data(queries=None, fetch_mode=None):
+    logger = run_logger()
+    logger.info("Начинаем сбор данных с сайта.")
+
+    queries = list(queries or load_queries())
+    fetch_mode = fetch_mode or FETCH_MODE
+
     try:
-        service = Service(executable_path=CHROME_DRIVER_PATH)
-        driver = webdriver.Chrome(service=service, options=options)
-        logger.info("Браузер Chrome запущен успешно")
-
-        url_one_room = 'https://realty.yandex.ru/moskva_i_moskovskaya_oblast/snyat/kvartira/odnokomnatnaya/metro-kommunarka/'
-        url_studio = 'https://realty.yandex.ru/moskva_i_moskovskaya_oblast/snyat/kvartira/studiya/metro-kommunarka/'
-        properties = []
-
-        for url in [url_one_room, url_studio]:
-            logger.info(f"Открываем страницу: {url}")
-            driver.get(url)
-
-            wait_time = 5 + random.uniform(1, 3)
-            logger.info(f"Ждем {wait_time:.2f} секунд для загрузки страницы")
-            time.sleep(wait_time)
-
-            page_source = driver.page_source
-
-            soup = BeautifulSoup(page_source, 'html.parser')
-
-            items = soup.select('.OffersSerpItem')
-            logger.info(f"Найдено {len(items)} объявлений на странице")
-
-            if not items:
-                logger.warning("Селектор .OffersSerpItem не сработал, пробуем альтернативные")
-
-                alternative_selectors = [
-                    '.CardComponent', 
-                    '.Card', 
-                    '.OfferCard', 
-                    '[data-test="offer-card"]',
-                    '[class*="offer-card"]',
-                    '[class*="OfferCard"]'
-                ]
-
-                for selector in alternative_selectors:
-                    alt_items = soup.select(selector)
-                    if alt_items:
-                        items = alt_items
-                        logger.info(f"Используем другой селектор: {selector}, найдено {len(items)} объявлений")
-                        break
-
-            if not items:
-                logger.warning("Не удалось найти объявления на странице")
-                continue
-
-            for idx, item in enumerate(items):
-                try:
-                    title_elem = item.select_one('.OffersSerpItemTitle__text') or \
-                                item.select_one('[class*="title"]') or \
-                                item.select_one('h3') or \
-                                item.select_one('h2')
-
-                    price_elem = item.select_one('.OffersSerpItemPrice__price') or \
-                                item.select_one('[class*="price"]') or \
-                                item.select_one('[data-test="price"]')
-
-                    link_elem = item.select_one('.OffersSerpItem__link') or \
-                               item.select_one('a') or \
-                               item.select_one('[href]')
-
-                    if title_elem and price_elem and link_elem:
-                        title = title_elem.text.strip()
-
-                        price_text = price_elem.text.replace('₽/мес.', '').replace('\xa0', '').replace(' ', '').strip()
-                        price_text = ''.join(c for c in price_text if c.isdigit())
-
-                        try:
-                            price = int(price_text) if price_text else None
-                        except ValueError:
-                            price = None
-                            logger.warning(f"Не получилось преобразовать цену из текста: '{price_elem.text}'")
-
-                        href = link_elem.get('href', '')
-                        link = 'https://realty.yandex.ru' + href if href.startswith('/') else href
-
-                        ad_id = hashlib.md5(link.encode()).hexdigest()
-
-                        properties.append({
-                            'id': ad_id,
-                            'title': title, 
-                            'price': price, 
-                            'link': link,
-                            'scraped_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        })
-
-                except Exception as e:
-                    logger.error(f"Ошибка при обработке объявления {idx+1}: {str(e)}")
-
-        driver.quit()
-        logger.info(f"Сбор данных завершен. Собрано {len(properties)} объявлений.")
-
-        if not properties:
+        logger.info(f"Обходим {len(queries)} поисковых запросов")
+        batches = crawl(
+            queries,
+            parse=lambda page_source: parse_page(page_source, logger),
+            fallback=browser_fallback(logger),
+            fallback_concurrency=BROWSER_POOL.size,
+            use_http=(fetch_mode == 'http'),
+            logger=logger,
+        )
+
+        logger.info(f"Сбор данных завершен. Собрано {sum(len(batch) for batch in batches)} объявлений.")
+
+        if not batches:
             logger.warning("Не удалось собрать данные о недвижимости")
-            return pd.DataFrame(columns=['id', 'title', 'price', 'link', 'scraped_at'])
+            return pd.DataFrame(columns=LISTING_COLUMNS)
 
-        df = pd.DataFrame(properties)
-        return df
+        return listings_frame(batches)
 
     except Exception as e:
         logger.error(f"Произошла ошибка при сборе данных: {str(e)}")
         logger.error(traceback.format_exc())
-        return pd.DataFrame(columns=['id', 'title', 'price', 'link', 'scraped_at'])
+        return pd.DataFrame(columns=LISTING_COLUMNS)
+
+def page_cache_key(context, parameters):
+    # Ключ - адрес страницы и номер окна времени: повтор задачи или потока в том же окне
+    # берет уже скачанные страницы из кэша и заново качает только упавшие.
+    # Режим загрузки входит в ключ: страница, скачанная без браузера, не подменяет загрузку через браузер.
+    # Суффикс - формат результата, чтобы не подхватить закэшированные списки словарей прежних версий
+    fetch_mode = parameters.get('fetch_mode') or FETCH_MODE
+    return f"{parameters['url']}@{int(time.time() // PAGE_CACHE_SECONDS)}:{fetch_mode}:batch"
+
+@task(retries=2, retry_delay_seconds=30, cache_key_fn=page_cache_key,
+      cache_expiration=timedelta(seconds=PAGE_CACHE_SECONDS))
+def scrape_page(url, fetch_mode=None):
+    logger = run_logger()
+    fetch_mode = fetch_mode or FETCH_MODE
+    with METRICS.timer('page'):
+        page_source = fetch_page(
+            url,
+            fallback=browser_fallback(logger),
+            use_http=(fetch_mode == 'http'),
+            logger=logger,
+        )
+        if page_source is None:
+            if replay.REPLAY_DIR:
+                return ListingBatch()
+            raise RuntimeError(f"Не удалось загрузить страницу {url}")
+        return parse_page(page_source, logger)
+
+def scrape_mapped(queries=None, fetch_mode=None):
+    # У каждого запроса своя цепочка страниц: следующая страница запроса отправляется, как только готова
+    # его предыдущая, поэтому медленная или повторяемая страница одного запроса не задерживает остальные.
+    # Запрос выбывает, когда страница не принесла новых объявлений
+    logger = get_run_logger()
+    queries = list(queries or load_queries())
+    query_links = [set() for _ in queries]
+    running = {
+        scrape_page.submit(query.url(0), fetch_mode=fetch_mode): (number, 0)
+        for number, query in enumerate(queries)
+    }
+    pages = []
+
+    while running:
+        future = next(as_completed(list(running)))
+        number, page = running.pop(future)
+        query = queries[number]
+        try:
+            items = future.result()
+        except Exception as e:
+            logger.error(f"Ошибка при обходе {query.label}, страница {page + 1}: {type(e).__name__}: {e}")
+            items = ListingBatch()
+
+        links = items.dedupe_keys()
+        new_items = [i for i, link in enumerate(links) if link not in query_links[number]]
+        logger.info(f"{query.label}, страница {page + 1}: новых объявлений {len(new_items)}")
+        if not new_items:
+            continue
+        query_links[number].update(links[i] for i in new_items)
+        pages.append((number, page, items.take(new_items)))
+        if page + 1 < MAX_PAGES:
+            running[scrape_page.submit(query.url(page + 1), fetch_mode=fetch_mode)] = (number, page + 1)
+
+    # Страницы готовы в произвольном порядке, а повторы между запросами отбрасываются по первому
+    # появлению: сортируем по запросу и странице, чтобы результат не зависел от скорости загрузки
+    pages.sort(key=lambda entry: entry[:2])
+    return merge_pages([batch for _, _, batch in pages])
+
+@task
+def merge_pages(pages):
+    logger = run_logger()
+    df = drop_duplicate_listings(listings_frame(pages))
+    logger.info(f"Сбор данных завершен. Собрано {len(df)} объявлений с {len(pages)} страниц.")
+    return df.reset_index(drop=True)
 
 @task
 def save_data(df):
-    logger = get_run_logger()
+    logger = run_logger()
     logger.info("Сохраняем собранные данные.")
 
     if df.empty:
@@ -149,54 +192,105 @@ def save_data(df):
         df['price'] = None
 
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    raw_file_path = f"data/real_estate_kommunarka_raw_{timestamp}.csv"
-
-    df.to_csv(raw_file_path, index=False)
+    with METRICS.timer('stage', stage='raw_snapshot'):
+        raw_file_path = write_snapshot(df, f"data/real_estate_kommunarka_raw_{timestamp}")[0]
     logger.info(f"Все собранные данные сохранены в '{raw_file_path}'")
 
+    if needs_migration():
+        migrated = migrate_csv_history()
+        logger.info(f"История из CSV перенесена в '{HISTORY_DB_PATH}': {migrated} записей")
+
+    # Сравниваем карточки с индексом отпечатков: дальше в историю идут только новые и изменившиеся.
+    # Сам индекс обновляется только после записи истории, чтобы повтор задачи не потерял изменения
+    run_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with METRICS.timer('stage', stage='change_detection'):
+        events = detect_changes(df, run_at=run_at)
+    for event, count in events['event'].value_counts().items():
+        METRICS.inc('listing_events', int(count), event=event)
+    new_count = (events['event'] == EVENT_NEW).sum()
+    changed_count = (events['event'] == EVENT_CHANGED).sum()
+    removed_count = (events['event'] == EVENT_REMOVED).sum()
+    logger.info(f"Новых объявлений: {new_count}, изменившихся: {changed_count}, "
+                f"без изменений: {len(df) - new_count - changed_count}, снято с публикации: {removed_count}")
+
     filtered_df = df.dropna(subset=['price']).copy()
+    METRICS.inc('cards_dropped', len(df) - len(filtered_df), reason='missing_price')
     logger.info(f"После удаления записей без цены осталось {len(filtered_df)} объявлений")
 
     if filtered_df.empty:
         logger.warning("После фильтрации не осталось объявлений с ценой")
+        commit_changes(df, events, run_at=run_at)
         return raw_file_path
 
     filtered_df['price'] = filtered_df['price'].astype(int)
 
     filtered_df = filtered_df.sort_values(by='price').reset_index(drop=True)
 
-    filtered_file_path = f"data/real_estate_kommunarka_{timestamp}.csv"
-    filtered_df.to_csv(filtered_file_path, index=False)
+    # Площадь, тип квартиры и этаж - из заголовка; со страниц объявлений, если они загружались
+    if ENRICH_DETAILS:
+        with METRICS.timer('stage', stage='enrichment'):
+            fetched = enrich_listings(filtered_df, logger=logger)
+        logger.info(f"Загружены подробности {fetched} новых объявлений")
+    with METRICS.timer('stage', stage='listing_fields'):
+        filtered_df = with_details(filtered_df)
+    logger.info(f"Площадь известна у {filtered_df['area'].notna().sum()} из {len(filtered_df)} объявлений")
+
+    with METRICS.timer('stage', stage='snapshot'):
+        filtered_file_path = write_snapshot(filtered_df, f"data/real_estate_kommunarka_{timestamp}")[0]
     logger.info(f"Данные с ценами сохранены в '{filtered_file_path}'")
 
-    if os.path.exists("data/real_estate_kommunarka_history.csv"):
-        history_df = pd.read_csv("data/real_estate_kommunarka_history.csv")
-        combined_df = pd.concat([history_df, filtered_df], ignore_index=True)
-        combined_df = combined_df.drop_duplicates(subset=['id', 'price'])
-    else:
-        combined_df = filtered_df
+    changed_ids = events.loc[events['event'] != EVENT_REMOVED, 'id']
+    with METRICS.timer('stage', stage='history'):
+        inserted, history_total = append_history(filtered_df[filtered_df['id'].isin(changed_ids)])
+    METRICS.inc('history_inserted', inserted)
+    logger.info(f"В историю добавлено {inserted} новых цен. Всего записей в истории: {history_total}")
+
+    with METRICS.timer('stage', stage='change_index'):
+        commit_changes(df, events, run_at=run_at)
 
-    combined_df.to_csv("data/real_estate_kommunarka_history.csv", index=False)
-    logger.info(f"Данные добавлены в историю. Всего объявлений в истории: {len(combined_df)}")
+    # Аналитика обновляется только по добавленным строкам, по ней API отдает ряды медиан и перцентилей
+    with METRICS.timer('stage', stage='analytics'):
+        processed = update_analytics()
+    logger.info(f"Аналитика истории обновлена по {processed} новым записям")
 
-    filtered_df.to_csv("data/real_estate_kommunarka_latest.csv", index=False)
+    with METRICS.timer('stage', stage='latest_snapshot'):
+        write_snapshot(filtered_df, "data/real_estate_kommunarka_latest")
     logger.info("Обновлен файл с последними данными.")
 
     return filtered_file_path
 
-@flow(retries=2, retry_delay_seconds=60)
-def real_estate_scraper():
+def publish_run_summary(logger):
+    # Сводка запуска пишется в JSON рядом с данными (ее отдает /metrics в api.py) и в артефакт Prefect
+    try:
+        summary_path, summary = METRICS.write_summary()
+        create_markdown_artifact(
+            key='scraper-run-summary',
+            markdown=f"```json\n{json.dumps(summary, ensure_ascii=False, indent=2)}\n```",
+            description="Метрики последнего запуска скрапера",
+        )
+        logger.info(f"Метрики запуска сохранены в '{summary_path}'")
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить метрики запуска: {type(e).__name__}: {e}")
+
+@flow(retries=2, retry_delay_seconds=60, task_runner=ThreadPoolTaskRunner(max_workers=CRAWL_WORKERS))
+def real_estate_scraper(queries=None, fetch_mode=None):
     logger = get_run_logger()
     logger.info("Запуск скрапера недвижимости.")
 
+    METRICS.reset()
     try:
-        data = scrape_data()
+        with METRICS.timer('stage', stage='scrape'):
+            if FLOW_MODE == 'crawl':
+                data = scrape_data(queries, fetch_mode)
+            else:
+                data = scrape_mapped(queries, fetch_mode)
 
         if data.empty:
             logger.warning("Не получено данных, завершаем работу")
             return None
 
-        filepath = save_data(data)
+        with METRICS.timer('stage', stage='save'):
+            filepath = save_data(data)
         logger.info("Скрапер завершил работу успешно.")
         return filepath
 
@@ -204,6 +298,8 @@ def real_estate_scraper():
         logger.error(f"Произошла ошибка в скрапере: {type(e).__name__}: {e}")
         logger.error(traceback.format_exc())
         raise
+    finally:
+        publish_run_summary(logger)
 
 if __name__ == '__main__':
     real_estate_scraper()
@@ -0,0 +1,182 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from storage import DATA_DIR
+
+METRICS_DIR = os.path.join(DATA_DIR, 'metrics')
+LATEST_SUMMARY_PATH = os.path.join(METRICS_DIR, 'run_summary_latest.json')
+
+# Для перцентилей храним последние замеры каждого показателя, не больше этого числа
+SAMPLE_LIMIT = 10000
+QUANTILES = [0.5, 0.95, 0.99]
+
+
+class RunMetrics:
+    # Счетчики и замеры времени одного запуска скрапера. Пишутся из разных потоков,
+    # поэтому все изменения идут под блокировкой
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = datetime.now()
+            self.counters = {}
+            self.timings = {}
+            self.samples = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            count, total, longest = self.timings.get(key, (0, 0.0, 0.0))
+            self.timings[key] = (count + 1, total + seconds, max(longest, seconds))
+            if key not in self.samples:
+                self.samples[key] = deque(maxlen=SAMPLE_LIMIT)
+            self.samples[key].append(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def summary(self):
+        with self.lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            timings = [
+                {'name': name, 'labels': dict(labels), 'count': count, 'sum': total, 'max': longest,
+                 'quantiles': quantiles(self.samples[name, labels])}
+                for (name, labels), (count, total, longest) in sorted(self.timings.items())
+            ]
+
+        cards = sum(counter['value'] for counter in counters if counter['name'] == 'cards_parsed')
+        parse_seconds = sum(timing['sum'] for timing in timings if timing['name'] == 'parse')
+        return {
+            'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'finished_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'counters': counters,
+            'timings': timings,
+            'selector_hit_rates': selector_hit_rates(counters),
+            'parse_seconds_per_card': parse_seconds / cards if cards else None,
+        }
+
+    def write_summary(self, directory=METRICS_DIR):
+        summary = self.summary()
+        os.makedirs(directory, exist_ok=True)
+        timestamp = self.started_at.strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(directory, f'run_summary_{timestamp}.json')
+        for target in (path, os.path.join(directory, 'run_summary_latest.json')):
+            with open(target + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            os.replace(target + '.tmp', target)
+        return path, summary
+
+
+def quantiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    # Метод ближайшего ранга: наименьшее значение, не меньше которого доля q замеров
+    return {f'{q:g}': ordered[max(math.ceil(q * len(ordered)) - 1, 0)] for q in QUANTILES}
+
+
+def selector_hit_rates(counters):
+    # Доля срабатываний каждого селектора: рост доли запасных селекторов означает, что поменялась разметка
+    totals, hits = {}, {}
+    for counter in counters:
+        if counter['name'] not in ('card_selector_hits', 'field_selector_hits'):
+            continue
+        group = counter['labels'].get('field', 'card')
+        totals[group] = totals.get(group, 0) + counter['value']
+        hits.setdefault(group, {})[counter['labels']['selector']] = counter['value']
+    return {
+        group: {selector: value / totals[group] for selector, value in selectors.items()}
+        for group, selectors in hits.items()
+    }
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def prometheus_text(summary, prefix='scraper_'):
+    # Текстовый формат Prometheus для сводки последнего запуска
+    lines = []
+    declared = set()
+
+    def declare(name, kind, help_text):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+    for counter in summary.get('counters', []):
+        name = f"{prefix}{counter['name']}_total"
+        declare(name, 'counter', f"{counter['name']} during the last scraper run")
+        lines.append(f"{name}{_label_text(counter['labels'])} {counter['value']}")
+
+    timings = {}
+    for timing in summary.get('timings', []):
+        timings.setdefault(timing['name'], []).append(timing)
+
+    # Строки одного семейства метрик должны идти подряд, поэтому максимумы выводим отдельным блоком
+    for timing_name, group in timings.items():
+        name = f"{prefix}{timing_name}_seconds"
+        declare(name, 'summary', f"{timing_name} duration during the last scraper run")
+        for timing in group:
+            for q, value in timing.get('quantiles', {}).items():
+                lines.append(f"{name}{_label_text(dict(timing['labels'], quantile=q))} {value:.6f}")
+            labels = _label_text(timing['labels'])
+            lines.append(f"{name}_count{labels} {timing['count']}")
+            lines.append(f"{name}_sum{labels} {timing['sum']:.6f}")
+        declare(f"{name}_max", 'gauge', f"longest {timing_name} during the last scraper run")
+        for timing in group:
+            lines.append(f"{name}_max{_label_text(timing['labels'])} {timing['max']:.6f}")
+
+    for group, selectors in summary.get('selector_hit_rates', {}).items():
+        name = f'{prefix}selector_hit_ratio'
+        declare(name, 'gauge', 'share of matches per selector during the last scraper run')
+        for selector, ratio in selectors.items():
+            lines.append(f"{name}{_label_text({'field': group, 'selector': selector})} {ratio:.6f}")
+
+    if summary.get('parse_seconds_per_card') is not None:
+        name = f'{prefix}parse_seconds_per_card'
+        declare(name, 'gauge', 'average parse time per card during the last scraper run')
+        lines.append(f"{name} {summary['parse_seconds_per_card']:.9f}")
+
+    if 'finished_at' in summary:
+        name = f'{prefix}last_run_timestamp_seconds'
+        declare(name, 'gauge', 'time the last scraper run finished')
+        finished = datetime.strptime(summary['finished_at'], '%Y-%m-%d %H:%M:%S').timestamp()
+        lines.append(f'{name} {finished:.0f}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def read_latest_summary(path=LATEST_SUMMARY_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+METRICS = RunMetrics()
@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from export import ROW_COLUMN, iter_chunks
+from query_engine import decode_cursor, encode_cursor
+from storage import CHUNK_ROWS
+
+# Индексы страниц для больших файлов: копия строк в SQLite с индексом по каждому столбцу.
+# Строится один раз на версию файла, по частям, поэтому память не зависит от размера файла
+PAGE_INDEX_DIR = os.getenv('API_PAGE_INDEX_DIR', os.path.join('data', '.page_index'))
+
+logger = logging.getLogger('real_estate_api')
+
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def source_signature(path):
+    # История SQLite только пополняется: пока это тот же файл (тот же inode), индекс достаточно
+    # дописать новыми строками. Снимки CSV/Parquet после записи не меняются - сверяем размер и время
+    stat = os.stat(path)
+    if path.endswith('.sqlite'):
+        return {'inode': stat.st_ino}
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def _values(chunk):
+    chunk = chunk.astype(object)
+    return chunk.where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+class PageIndex:
+    def __init__(self, path, source_path):
+        self.path = path
+        self.source_path = source_path
+        self.lock = threading.Lock()
+        conn = self._connect()
+        try:
+            state = dict(conn.execute('SELECT key, value FROM state'))
+        finally:
+            conn.close()
+        self.signature = json.loads(state['signature'])
+        self.columns = json.loads(state['columns'])
+        self.rows = int(state['rows'])
+        self.last_row = int(state['last_row'])
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    @classmethod
+    def build(cls, source_path, path, chunk_size=CHUNK_ROWS):
+        # Собираем во временном файле и подменяем целиком: недостроенный индекс никто не увидит
+        building = path + '.building'
+        for leftover in (building, building + '-wal', building + '-shm'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        signature = source_signature(source_path)
+
+        conn = sqlite3.connect(building)
+        try:
+            conn.execute('PRAGMA journal_mode = OFF')
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute('CREATE TABLE state (key TEXT PRIMARY KEY, value TEXT)')
+            conn.execute('CREATE TABLE price_counts (price PRIMARY KEY, count INTEGER NOT NULL)')
+            columns = cls._append(conn, source_path, None, None, chunk_size)
+            for number, column in enumerate(columns):
+                conn.execute(f'CREATE INDEX rows_{number} ON rows ({_quote(column)})')
+            conn.execute('ANALYZE')
+            conn.execute("INSERT OR REPLACE INTO state VALUES ('signature', ?)", (json.dumps(signature),))
+            conn.commit()
+            conn.execute('PRAGMA journal_mode = WAL')
+        finally:
+            conn.close()
+        os.replace(building, path)
+        return cls(path, source_path)
+
+    @staticmethod
+    def _append(conn, source_path, columns, last_row, chunk_size):
+        # Дописывает строки источника после last_row и количества цен; возвращает столбцы
+        rows = 0
+        for chunk in iter_chunks(source_path, cursor=last_row, chunk_size=chunk_size):
+            if columns is None:
+                columns = [column for column in chunk.columns if column != ROW_COLUMN]
+                conn.execute(f"CREATE TABLE rows ({ROW_COLUMN} INTEGER PRIMARY KEY, "
+                             f"{', '.join(_quote(column) for column in columns)})")
+            chunk = chunk[[ROW_COLUMN] + columns]
+            conn.executemany(
+                f"INSERT INTO rows VALUES ({', '.join('?' * len(chunk.columns))})", _values(chunk)
+            )
+            if 'price' in columns:
+                counts = pd.to_numeric(chunk['price'], errors='coerce').dropna().value_counts()
+                conn.executemany(
+                    'INSERT INTO price_counts (price, count) VALUES (?, ?) '
+                    'ON CONFLICT (price) DO UPDATE SET count = count + excluded.count',
+                    zip(counts.index.tolist(), counts.tolist()),
+                )
+            rows += len(chunk)
+            last_row = int(chunk[ROW_COLUMN].iloc[-1])
+
+        if not rows and columns is not None and last_row is not None:
+            return columns
+        total = rows + int(dict(conn.execute('SELECT key, value FROM state')).get('rows', 0))
+        conn.executemany('INSERT OR REPLACE INTO state VALUES (?, ?)', [
+            ('columns', json.dumps(columns or [])),
+            ('rows', str(total)),
+            ('last_row', str(last_row if last_row is not None else -1)),
+        ])
+        if columns is None:
+            conn.execute(f'CREATE TABLE rows ({ROW_COLUMN} INTEGER PRIMARY KEY)')
+        return columns or []
+
+    def refresh(self, chunk_size=CHUNK_ROWS):
+        # Дописываем в индекс строки, добавленные в историю после прошлого обновления
+        with self.lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    self._append(conn, self.source_path, self.columns, self.last_row, chunk_size)
+                state = dict(conn.execute('SELECT key, value FROM state'))
+            finally:
+                conn.close()
+            self.rows = int(state['rows'])
+            self.last_row = int(state['last_row'])
+
+    def _filter(self, min_price, max_price):
+        clauses, params = [], []
+        if min_price is not None:
+            clauses.append('price >= ?')
+            params.append(min_price)
+        if max_price is not None:
+            clauses.append('price <= ?')
+            params.append(max_price)
+        return clauses, params
+
+    def _total(self, conn, min_price, max_price):
+        if min_price is None and max_price is None:
+            return self.rows
+        clauses, params = self._filter(min_price, max_price)
+        return conn.execute(
+            f"SELECT COALESCE(SUM(count), 0) FROM price_counts WHERE {' AND '.join(clauses)}", params
+        ).fetchone()[0]
+
+    def _plan(self, sort_by, clauses, rows_needed, total):
+        # С фильтром по цене SQLite выбрала бы индекс цены и сортировала бы весь диапазон, а на узком
+        # или пустом диапазоне - наоборот, могла бы пройти весь индекс сортировки. Решаем сами по числу
+        # строк в диапазоне: если он широкий, идем в порядке выдачи (по индексу столбца или по номерам
+        # строк) и отбрасываем лишние цены - нужные встретятся примерно через rows_needed * rows / total строк
+        if not clauses or sort_by == 'price':
+            return None
+        if rows_needed * self.rows < total * total:
+            return sort_by or ROW_COLUMN
+        return 'price'
+
+    def _select(self, conn, columns, clauses, params, order, limit, offset, indexed_by=None):
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        names = ', '.join(_quote(column) for column in columns)
+        if indexed_by == ROW_COLUMN:
+            hint = ' NOT INDEXED'
+        elif indexed_by:
+            hint = f' INDEXED BY rows_{self.columns.index(indexed_by)}'
+        else:
+            hint = ''
+        return conn.execute(
+            f'SELECT {names} FROM rows{hint}{where} ORDER BY {order} LIMIT ? OFFSET ?', [*params, limit, offset]
+        ).fetchall()
+
+    def query(self, min_price=None, max_price=None, sort_by=None, sort_order='asc',
+              offset=0, limit=10, cursor=None, fields=None):
+        # Тот же порядок, что у query_engine: по возрастанию значения, при равных - по номеру строки,
+        # для desc - ровно обратный; пустые значения в конце в порядке строк. Курсор ищется по индексу,
+        # поэтому страница стоит O(log n + limit), а смещение - еще O(offset) по индексу
+        cursor = cursor or None
+        value, position = decode_cursor(cursor) if cursor else (None, None)
+        fields = list(fields or self.columns)
+        selected = fields + [column for column in (sort_by, ROW_COLUMN) if column and column not in fields]
+        clauses, params = self._filter(min_price, max_price)
+        need = limit + 1
+
+        conn = self._connect()
+        try:
+            total = self._total(conn, min_price, max_price)
+            if not total:
+                rows, sorted_rows = [], []
+            elif not sort_by:
+                after = clauses + ([f'{ROW_COLUMN} > ?'] if position is not None else [])
+                rows = self._select(conn, selected, after, params + ([position] if position is not None else []),
+                                    ROW_COLUMN, need, offset, indexed_by=self._plan(None, clauses, offset + need, total))
+                sorted_rows = []
+            else:
+                column = _quote(sort_by)
+                direction = 'DESC' if sort_order == 'desc' else 'ASC'
+                nulls = clauses + [f'{column} IS NULL']
+                sorted_rows = []
+                if cursor is None or value is not None:
+                    keyset = clauses + [f'{column} IS NOT NULL']
+                    keyset_params = list(params)
+                    if cursor is not None:
+                        keyset.append(f"({column}, {ROW_COLUMN}) {'<' if direction == 'DESC' else '>'} (?, ?)")
+                        keyset_params += [value, position]
+                    sorted_rows = self._select(conn, selected, keyset, keyset_params,
+                                               f'{column} {direction}, {ROW_COLUMN} {direction}', need, offset,
+                                               indexed_by=self._plan(sort_by, clauses, offset + need, total))
+                    null_offset = 0
+                    if not sorted_rows and offset:
+                        # Смещение ушло за непустые значения: пропускаем остаток среди пустых
+                        where = ' AND '.join(keyset)
+                        skipped = conn.execute(f'SELECT COUNT(*) FROM rows WHERE {where}', keyset_params).fetchone()[0]
+                        null_offset = offset - skipped
+                    rows = sorted_rows
+                    if len(rows) < need:
+                        rows = rows + self._select(conn, selected, nulls, params, ROW_COLUMN,
+                                                   need - len(rows), null_offset, indexed_by=sort_by)
+                else:
+                    rows = self._select(conn, selected, nulls + [f'{ROW_COLUMN} > ?'], params + [position],
+                                        ROW_COLUMN, need, offset, indexed_by=sort_by)
+        finally:
+            conn.close()
+
+        page = pd.DataFrame.from_records(rows[:limit], columns=selected)
+        next_cursor = None
+        if len(rows) > limit:
+            last = page.iloc[-1]
+            if sort_by and limit <= len(sorted_rows):
+                next_cursor = encode_cursor(last[sort_by], last[ROW_COLUMN])
+            else:
+                next_cursor = encode_cursor(position=last[ROW_COLUMN])
+        return total, page[fields], next_cursor
+
+
+class PageIndexCache:
+    # Индексы на диске, по одному на файл; в памяти - открытые индексы текущих версий файлов.
+    # Построение идет в фоне, пока оно не закончено, get возвращает None
+    def __init__(self, directory=PAGE_INDEX_DIR, chunk_size=CHUNK_ROWS):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.entries = {}
+        self.building = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='page-index')
+
+    def index_path(self, source_path):
+        return os.path.join(self.directory, os.path.basename(source_path) + '.index.sqlite')
+
+    def _current(self, source_path, signature):
+        index = self.entries.get(source_path)
+        if index is None and os.path.exists(self.index_path(source_path)):
+            # Индекс, построенный прошлым процессом API
+            try:
+                index = PageIndex(self.index_path(source_path), source_path)
+            except (sqlite3.Error, KeyError, ValueError):
+                return None
+        if index is None or index.signature != signature:
+            return None
+        self.entries[source_path] = index
+        return index
+
+    def get(self, source_path, wait=False):
+        signature = source_signature(source_path)
+        with self.lock:
+            index = self._current(source_path, signature)
+            if index is None:
+                future = self.building.get(source_path)
+                if future is None or future.signature != signature:
+                    future = self.executor.submit(self._build, source_path, signature)
+                    future.signature = signature
+                    self.building[source_path] = future
+        if index is None:
+            if not wait:
+                return None
+            return future.result()
+
+        if source_path.endswith('.sqlite'):
+            # Новые строки истории дописываем сразу: их немного, один запуск скрапера
+            index.refresh(self.chunk_size)
+        return index
+
+    def _build(self, source_path, signature):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            logger.info(f"Строим индекс страниц для {source_path}")
+            index = PageIndex.build(source_path, self.index_path(source_path), self.chunk_size)
+            with self.lock:
+                if index.signature == signature:
+                    self.entries[source_path] = index
+            return index
+        except Exception:
+            logger.exception(f"Не удалось построить индекс страниц для {source_path}")
+            raise
+        finally:
+            with self.lock:
+                future = self.building.get(source_path)
+                if future is not None and future.signature == signature:
+                    del self.building[source_path]
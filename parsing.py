@@ -0,0 +1,193 @@
+import os
+import time
+
+import soupsieve
+from bs4 import BeautifulSoup
+
+from listing_store import BASE_URL, ListingBatch
+from metrics import METRICS
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    import lxml  # noqa: F401
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+CARD_SELECTORS = [
+    '.OffersSerpItem',
+    '.CardComponent',
+    '.Card',
+    '.OfferCard',
+    '[data-test="offer-card"]',
+    '[class*="offer-card"]',
+    '[class*="OfferCard"]'
+]
+
+# Блок "ничего не найдено" в выдаче: браузеру незачем ждать карточек, если появился он
+EMPTY_RESULT_SELECTORS = ['.OffersSerpNotFound', '[class*="SerpNotFound"]']
+
+FIELD_SELECTORS = {
+    'title': ['.OffersSerpItemTitle__text', '[class*="title"]', 'h3', 'h2'],
+    'price': ['.OffersSerpItemPrice__price', '[class*="price"]', '[data-test="price"]'],
+    'link': ['.OffersSerpItem__link', 'a', '[href]'],
+}
+
+
+class SoupBackend:
+    def __init__(self, features):
+        self.name = f"bs4-{features}"
+        self.features = features
+        self.compiled = {}
+
+    def _compile(self, selector):
+        if selector not in self.compiled:
+            self.compiled[selector] = soupsieve.compile(selector)
+        return self.compiled[selector]
+
+    def document(self, page_source):
+        return BeautifulSoup(page_source, self.features)
+
+    def select(self, node, selector):
+        return self._compile(selector).select(node)
+
+    def select_one(self, node, selector):
+        return self._compile(selector).select_one(node)
+
+    def text(self, node):
+        return node.text
+
+    def attr(self, node, name):
+        return node.get(name, '')
+
+
+class SelectolaxBackend:
+    name = 'selectolax'
+
+    def document(self, page_source):
+        return LexborHTMLParser(page_source)
+
+    def select(self, node, selector):
+        return node.css(selector)
+
+    def select_one(self, node, selector):
+        return node.css_first(selector)
+
+    def text(self, node):
+        return node.text(deep=True)
+
+    def attr(self, node, name):
+        return node.attributes.get(name) or ''
+
+
+def available_backends():
+    backends = ['html.parser']
+    if HAS_LXML:
+        backends.append('lxml')
+    if LexborHTMLParser is not None:
+        backends.append('selectolax')
+    return backends
+
+
+def get_backend(name=None):
+    name = name or os.getenv('SCRAPER_PARSER') or available_backends()[-1]
+    if name == 'selectolax':
+        if LexborHTMLParser is None:
+            raise ValueError("Парсер selectolax не установлен")
+        return SelectolaxBackend()
+    if name == 'lxml' and not HAS_LXML:
+        raise ValueError("Парсер lxml не установлен")
+    if name not in ('html.parser', 'lxml'):
+        raise ValueError(f"Неизвестный парсер: {name}")
+    return SoupBackend(name)
+
+
+def parse_price(text):
+    price_text = text.replace('₽/мес.', '').replace('\xa0', '').replace(' ', '').strip()
+    price_text = ''.join(c for c in price_text if c.isdigit())
+    return int(price_text) if price_text else None
+
+
+class ListingParser:
+    # Селекторы карточек и полей всегда пробуются в порядке приоритета: запасной селектор
+    # (например, просто "a") не должен обгонять основной из-за одной карточки без нужного класса.
+    # Скомпилированные селекторы переиспользуются между карточками и страницами
+    def __init__(self, backend=None):
+        self.backend = backend if hasattr(backend, 'document') else get_backend(backend)
+
+    def _find_cards(self, document, logger=None):
+        for selector in CARD_SELECTORS:
+            items = self.backend.select(document, selector)
+            if items:
+                METRICS.inc('card_selector_hits', selector=selector)
+                if logger and selector != CARD_SELECTORS[0]:
+                    logger.info(f"Используем другой селектор: {selector}, найдено {len(items)} объявлений")
+                return selector, items
+
+        return None, []
+
+    def _field(self, field, item, hits):
+        for selector in FIELD_SELECTORS[field]:
+            node = self.backend.select_one(item, selector)
+            if node is not None:
+                hits[field, selector] = hits.get((field, selector), 0) + 1
+                return node
+        return None
+
+    def parse(self, page_source, logger=None):
+        started = time.perf_counter()
+        properties = self._parse(page_source, logger)
+        METRICS.observe('parse', time.perf_counter() - started, backend=self.backend.name)
+        METRICS.inc('cards_parsed', len(properties))
+        return properties
+
+    def _parse(self, page_source, logger=None):
+        document = self.backend.document(page_source)
+        _, items = self._find_cards(document, logger)
+
+        if logger:
+            logger.info(f"Найдено {len(items)} объявлений на странице")
+        if not items:
+            if logger:
+                logger.warning("Не удалось найти объявления на странице")
+            return ListingBatch()
+
+        # Срабатывания селекторов полей копим по странице и передаем в метрики одним разом
+        hits = {}
+        properties = ListingBatch()
+        for idx, item in enumerate(items):
+            try:
+                title_elem = self._field('title', item, hits)
+                price_elem = self._field('price', item, hits)
+                link_elem = self._field('link', item, hits)
+
+                if title_elem is None or price_elem is None or link_elem is None:
+                    METRICS.inc('cards_dropped', reason='missing_field')
+                    continue
+
+                price_text = self.backend.text(price_elem)
+                try:
+                    price = parse_price(price_text)
+                except ValueError:
+                    price = None
+                    METRICS.inc('price_parse_errors')
+                    if logger:
+                        logger.warning(f"Не получилось преобразовать цену из текста: '{price_text}'")
+
+                href = self.backend.attr(link_elem, 'href')
+                link = BASE_URL + href if href.startswith('/') else href
+
+                properties.append(self.backend.text(title_elem).strip(), price, link)
+
+            except Exception as e:
+                METRICS.inc('cards_dropped', reason='error')
+                if logger:
+                    logger.error(f"Ошибка при обработке объявления {idx+1}: {str(e)}")
+
+        for (field, selector), count in hits.items():
+            METRICS.inc('field_selector_hits', count, field=field, selector=selector)
+        return properties
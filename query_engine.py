@@ -0,0 +1,155 @@
+import base64
+import json
+import sys
+import threading
+
+import numpy as np
+
+from listing_store import expand_frame, frame_columns
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class ColumnIndex:
+    # positions - номера строк с непустым значением в порядке возрастания значения
+    # (при равных значениях - в порядке строк), values - сами значения в том же порядке,
+    # nulls - номера строк с пустым значением, они всегда идут в конце выдачи
+    def __init__(self, series):
+        valid = series.notna().to_numpy()
+        values = series.to_numpy(dtype=object) if series.dtype.kind not in 'iufM' else series.to_numpy()
+        valid_positions = np.flatnonzero(valid)
+        valid_values = values[valid]
+
+        order = np.argsort(valid_values, kind='stable')
+        self.positions = valid_positions[order]
+        self.values = valid_values[order]
+        self.nulls = np.flatnonzero(~valid)
+        self.nbytes = self.positions.nbytes + self.values.nbytes + self.nulls.nbytes
+        if self.values.dtype == object:
+            # Строки считаем по одному разу: у категорий значения ссылаются на одни и те же объекты
+            self.nbytes += sum(map(sys.getsizeof, {id(value): value for value in self.values}.values()))
+
+    def range(self, low=None, high=None):
+        start = np.searchsorted(self.values, low, 'left') if low is not None else 0
+        stop = np.searchsorted(self.values, high, 'right') if high is not None else len(self.values)
+        return start, max(start, stop)
+
+
+def encode_cursor(value=None, position=None):
+    payload = {'p': int(position)}
+    if isinstance(value, np.datetime64):
+        payload['v'] = str(value)
+    elif isinstance(value, np.generic):
+        payload['v'] = value.item()
+    elif value is not None:
+        payload['v'] = value
+    return base64.urlsafe_b64encode(json.dumps(payload, ensure_ascii=False).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return payload.get('v'), int(payload['p'])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+class IndexedDataset:
+    # on_index(nbytes) вызывается после построения каждого индекса, чтобы кэш учитывал их память
+    def __init__(self, df, on_index=None):
+        self.df = df.reset_index(drop=True)
+        self.columns = frame_columns(self.df)
+        self.indexes = {}
+        self.on_index = on_index
+        self.lock = threading.Lock()
+
+    def index(self, column):
+        with self.lock:
+            if column not in self.indexes:
+                # Ссылка и ключ в компактной таблице не хранятся, для сортировки по ним восстанавливаем столбец
+                series = self.df[column] if column in self.df.columns else expand_frame(self.df)[column]
+                self.indexes[column] = ColumnIndex(series)
+                if self.on_index is not None:
+                    self.on_index(self.indexes[column].nbytes)
+            return self.indexes[column]
+
+    @property
+    def nbytes(self):
+        return sum(index.nbytes for index in self.indexes.values())
+
+    def _candidates(self, min_price, max_price, sort_by):
+        # Возвращает (positions, keys, nulls): отсортированную по возрастанию часть выдачи,
+        # значения столбца сортировки для нее (None без сортировки) и хвост из пустых значений
+        price_filtered = min_price is not None or max_price is not None
+        if price_filtered:
+            price_index = self.index('price')
+            start, stop = price_index.range(min_price, max_price)
+
+        if not sort_by:
+            if price_filtered:
+                return np.sort(price_index.positions[start:stop]), None, np.empty(0, dtype=np.intp)
+            return np.arange(len(self.df)), None, np.empty(0, dtype=np.intp)
+
+        sort_index = self.index(sort_by)
+        if not price_filtered:
+            return sort_index.positions, sort_index.values, sort_index.nulls
+        if sort_by == 'price':
+            return price_index.positions[start:stop], price_index.values[start:stop], np.empty(0, dtype=np.intp)
+
+        in_range = np.zeros(len(self.df), dtype=bool)
+        in_range[price_index.positions[start:stop]] = True
+        keep = in_range[sort_index.positions]
+        return sort_index.positions[keep], sort_index.values[keep], sort_index.nulls[in_range[sort_index.nulls]]
+
+    def _cursor_start(self, cursor, positions, keys, nulls, descending):
+        value, position = decode_cursor(cursor)
+        sorted_count = len(positions)
+
+        if keys is None:
+            return int(np.searchsorted(positions, position, 'right'))
+        if value is None:
+            return sorted_count + int(np.searchsorted(nulls, position, 'right'))
+
+        if keys.dtype.kind == 'M':
+            value = np.datetime64(value)
+        start = np.searchsorted(keys, value, 'left')
+        stop = np.searchsorted(keys, value, 'right')
+        ties = positions[start:stop]
+        if descending:
+            return sorted_count - int(start + np.searchsorted(ties, position, 'left'))
+        return int(start + np.searchsorted(ties, position, 'right'))
+
+    def query(self, min_price=None, max_price=None, sort_by=None, sort_order='asc',
+              offset=0, limit=10, cursor=None, fields=None):
+        positions, keys, nulls = self._candidates(min_price, max_price, sort_by)
+        descending = keys is not None and sort_order == 'desc'
+        sorted_count = len(positions)
+        total = sorted_count + len(nulls)
+
+        start = self._cursor_start(cursor, positions, keys, nulls, descending) if cursor else 0
+        start = min(start + offset, total)
+        stop = min(start + limit, total)
+
+        sorted_stop = min(stop, sorted_count)
+        if descending:
+            page = positions[sorted_count - sorted_stop:sorted_count - start][::-1] if start < sorted_count else positions[:0]
+        else:
+            page = positions[start:sorted_stop]
+        if stop > sorted_count:
+            page = np.concatenate([page, nulls[max(start - sorted_count, 0):stop - sorted_count]])
+
+        next_cursor = None
+        if stop < total:
+            last = stop - 1
+            if keys is not None and last < sorted_count:
+                key_index = sorted_count - 1 - last if descending else last
+                next_cursor = encode_cursor(keys[key_index], positions[key_index])
+            else:
+                next_cursor = encode_cursor(position=page[-1])
+
+        rows = expand_frame(self.df.iloc[page])
+        if fields:
+            rows = rows[fields]
+        return total, rows, next_cursor
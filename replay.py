@@ -0,0 +1,105 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+
+from metrics import METRICS
+
+# Куда записывать скачанные страницы и откуда их воспроизводить вместо обращения к сайту
+RECORD_DIR = os.getenv('SCRAPER_RECORD_DIR')
+REPLAY_DIR = os.getenv('SCRAPER_REPLAY_DIR')
+
+INDEX_FILE = 'index.jsonl'
+
+
+class PageNotRecorded(LookupError):
+    pass
+
+
+class FixtureArchive:
+    # Каталог со страницами в gzip и индексом url -> файл. Индекс только дописывается,
+    # поэтому запись из нескольких потоков и повторная запись той же страницы безопасны
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.pages = {}
+        index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.pages[entry['url']] = entry['file']
+
+    def record(self, url, page_source):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest() + '.html.gz'
+        data = page_source.encode('utf-8')
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with gzip.open(os.path.join(self.directory, name), 'wb') as f:
+                f.write(data)
+            entry = {
+                'url': url,
+                'file': name,
+                'bytes': len(data),
+                'recorded_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            with open(os.path.join(self.directory, INDEX_FILE), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self.pages[url] = name
+
+    def get(self, url):
+        name = self.pages.get(url)
+        if name is None:
+            raise PageNotRecorded(url)
+        with gzip.open(os.path.join(self.directory, name), 'rb') as f:
+            return f.read().decode('utf-8')
+
+    def urls(self):
+        return list(self.pages)
+
+
+class ReplayFetcher:
+    # Тот же интерфейс, что у HttpFetcher, но страницы берутся из архива.
+    # latency позволяет имитировать время ответа сайта
+    def __init__(self, archive, latency=0.0):
+        self.archive = archive
+        self.latency = latency
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+    async def fetch(self, url):
+        with METRICS.timer('fetch', source='replay'):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            page_source = self.archive.get(url)
+        METRICS.inc('fetch_bytes', len(page_source.encode('utf-8')), source='replay')
+        return page_source
+
+    async def fetch_many(self, urls):
+        results = await asyncio.gather(*(self.fetch(url) for url in urls), return_exceptions=True)
+        return dict(zip(urls, results))
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def open_archive(directory):
+    # Один объект архива на каталог в процессе, чтобы индекс не перечитывался на каждую страницу
+    with _archives_lock:
+        if directory not in _archives:
+            _archives[directory] = FixtureArchive(directory)
+        return _archives[directory]
+
+
+def record_page(url, page_source):
+    if RECORD_DIR and page_source:
+        open_archive(RECORD_DIR).record(url, page_source)
@@ -0,0 +1,342 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+DATA_DIR = 'data'
+HISTORY_CSV_PATH = os.path.join(DATA_DIR, 'real_estate_kommunarka_history.csv')
+HISTORY_DB_PATH = os.path.join(DATA_DIR, 'real_estate_kommunarka_history.sqlite')
+
+HISTORY_COLUMNS = ['id', 'title', 'price', 'link', 'scraped_at']
+
+# Сколько строк истории читать за раз там, где она обрабатывается по частям
+CHUNK_ROWS = int(os.getenv('SCRAPER_CHUNK_ROWS', '100000'))
+
+# csv, parquet или both
+SNAPSHOT_FORMAT = os.getenv('SCRAPER_SNAPSHOT_FORMAT', 'both')
+
+ROOM_TYPE_PATTERN = r'(квартира-студия|студия|\d+-комнатная|комната|свободная планировка)'
+# Заголовок карточки вида "27 м² · квартира-студия · 2 этаж из 15"
+AREA_PATTERN = r'(\d+(?:[.,]\d+)?)\s*(?:м²|м2|кв\.\s*м)'
+FLOOR_PATTERN = r'(?:(\d+)\s*этаж|этаж\s*(\d+))\s*из\s*(\d+)'
+
+# Поля объявления, которые выделяются из заголовка или берутся со страницы объявления
+LISTING_FIELDS = ['room_type', 'area', 'floor', 'floors_total', 'price_per_m2']
+
+PRICE_QUANTILES = [i / 20 for i in range(21)]
+
+if pa is not None:
+    SNAPSHOT_SCHEMA = pa.schema([
+        ('id', pa.string()),
+        ('title', pa.dictionary(pa.int32(), pa.string())),
+        ('price', pa.int64()),
+        ('link', pa.string()),
+        ('scraped_at', pa.timestamp('s')),
+        ('room_type', pa.dictionary(pa.int8(), pa.string())),
+        ('area', pa.float64()),
+        ('floor', pa.int16()),
+        ('floors_total', pa.int16()),
+        ('price_per_m2', pa.float64()),
+    ])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id TEXT NOT NULL,
+    title TEXT,
+    price INTEGER NOT NULL,
+    link TEXT,
+    scraped_at TEXT,
+    UNIQUE (id, price)
+);
+CREATE INDEX IF NOT EXISTS history_scraped_at ON history (scraped_at);
+"""
+
+
+def connect(path=HISTORY_DB_PATH):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _rows(df):
+    df = df[HISTORY_COLUMNS].dropna(subset=['id', 'price'])
+    return zip(
+        df['id'].astype(str),
+        df['title'].astype(object).where(df['title'].notna(), None),
+        df['price'].astype('int64').tolist(),
+        df['link'].astype(object).where(df['link'].notna(), None),
+        df['scraped_at'].astype(str),
+    )
+
+
+def insert_history(conn, df):
+    # Уникальный индекс (id, price) сам отбрасывает уже известные наблюдения цен,
+    # поэтому стоимость вставки зависит только от размера новой пачки
+    before = conn.total_changes
+    with conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO history (id, title, price, link, scraped_at) VALUES (?, ?, ?, ?, ?)',
+            _rows(df),
+        )
+    return conn.total_changes - before
+
+
+def history_size(conn):
+    # Таблица только пополняется, поэтому последний rowid равен числу записей
+    return conn.execute('SELECT COALESCE(MAX(rowid), 0) FROM history').fetchone()[0]
+
+
+def append_history(df, path=HISTORY_DB_PATH):
+    conn = connect(path)
+    try:
+        inserted = insert_history(conn, df)
+        return inserted, history_size(conn)
+    finally:
+        conn.close()
+
+
+def migrate_csv_history(csv_path=HISTORY_CSV_PATH, db_path=HISTORY_DB_PATH, chunksize=CHUNK_ROWS):
+    # Новая база собирается во временном файле и появляется под своим именем только целиком,
+    # а CSV переименовывается последним шагом: прерванный перенос просто повторится при следующем запуске.
+    # В уже существующую базу строки дописываются на месте - повтор безопасен благодаря уникальному индексу
+    target = db_path if os.path.exists(db_path) else db_path + '.migrating'
+    if target != db_path:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(target + suffix):
+                os.remove(target + suffix)
+
+    conn = connect(target)
+    try:
+        inserted = 0
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+            inserted += insert_history(conn, chunk)
+        # Переносим журнал WAL в основной файл, чтобы переименовывать только его
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        conn.close()
+
+    if target != db_path:
+        os.replace(target, db_path)
+    # Переименовываем старый файл, чтобы его не читали как актуальную историю
+    os.replace(csv_path, csv_path + '.migrated')
+    return inserted
+
+
+def needs_migration(csv_path=HISTORY_CSV_PATH, db_path=HISTORY_DB_PATH):
+    # После успешного переноса CSV переименован, поэтому его наличие значит, что перенос не закончен
+    return os.path.exists(csv_path)
+
+
+def history_summary(path=HISTORY_DB_PATH):
+    # Число строк и столбцы истории без чтения самих строк
+    conn = sqlite3.connect(path)
+    try:
+        schema = {row[1]: row[2] for row in conn.execute('PRAGMA table_info(history)')}
+        return {"rows": history_size(conn), "columns": list(schema), "schema": schema}
+    finally:
+        conn.close()
+
+
+def load_history(path=HISTORY_DB_PATH):
+    conn = sqlite3.connect(path)
+    try:
+        return pd.read_sql_query(f"SELECT {', '.join(HISTORY_COLUMNS)} FROM history ORDER BY rowid", conn)
+    finally:
+        conn.close()
+
+
+def snapshot_formats():
+    if SNAPSHOT_FORMAT == 'both':
+        formats = ['csv', 'parquet']
+    else:
+        formats = [SNAPSHOT_FORMAT]
+
+    if pa is None and 'parquet' in formats:
+        formats = ['csv']
+    return formats
+
+
+def room_types(titles):
+    return titles.str.extract(ROOM_TYPE_PATTERN, expand=False).str.replace('квартира-', '', regex=False)
+
+
+def title_fields(titles):
+    titles = titles.astype(str)
+    floors = titles.str.extract(FLOOR_PATTERN)
+    area = titles.str.extract(AREA_PATTERN, expand=False).str.replace(',', '.', regex=False)
+    return pd.DataFrame({
+        'room_type': room_types(titles),
+        'area': pd.to_numeric(area, errors='coerce').astype('float64'),
+        'floor': pd.to_numeric(floors[0].fillna(floors[1]), errors='coerce').astype('Int16'),
+        'floors_total': pd.to_numeric(floors[2], errors='coerce').astype('Int16'),
+    }, index=titles.index)
+
+
+def listing_fields(df):
+    # Уже заполненные поля (например, со страницы объявления) главнее, заголовок только дополняет пропуски
+    df = df.copy()
+    fields = title_fields(df['title'])
+    for column, values in fields.items():
+        if column in df.columns:
+            values = df[column].astype(values.dtype).fillna(values)
+        df[column] = values
+    area = df['area'].where(df['area'] > 0)
+    df['price_per_m2'] = (pd.to_numeric(df['price'], errors='coerce') / area).round(2)
+    return df
+
+
+def to_snapshot_table(df):
+    df = listing_fields(df[HISTORY_COLUMNS + [column for column in LISTING_FIELDS if column in df.columns]])
+    df['scraped_at'] = pd.to_datetime(df['scraped_at'])
+    return pa.Table.from_pandas(df[SNAPSHOT_SCHEMA.names], schema=SNAPSHOT_SCHEMA, preserve_index=False)
+
+
+def write_parquet(df, path):
+    pq.write_table(to_snapshot_table(df), path, compression='zstd')
+
+
+def plain_number(value):
+    if pd.isna(value):
+        return None
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def snapshot_metadata(df):
+    prices = pd.to_numeric(df['price'], errors='coerce').dropna() if 'price' in df.columns else pd.Series(dtype=float)
+
+    price_stats = None
+    price_quantiles = None
+    if not prices.empty:
+        price_stats = {
+            "count": int(prices.count()),
+            "min": plain_number(prices.min()),
+            "max": plain_number(prices.max()),
+            "mean": plain_number(prices.mean()),
+            "median": plain_number(prices.median()),
+            "std": plain_number(prices.std()),
+        }
+        price_quantiles = {f"{q:g}": plain_number(v) for q, v in prices.quantile(PRICE_QUANTILES).items()}
+
+    return {
+        "rows": len(df),
+        "columns": df.columns.tolist(),
+        "schema": {column: str(dtype) for column, dtype in df.dtypes.items()},
+        "price_stats": price_stats,
+        "price_quantiles": price_quantiles,
+        "price_counts": price_counts(prices.value_counts()),
+    }
+
+
+def price_counts(counts):
+    # Число объявлений по каждой цене, [[цена, количество], ...] по возрастанию цены.
+    # Различных цен немного, поэтому по ним дешево строить гистограммы с любыми интервалами
+    return [[plain_number(price), int(count)] for price, count in counts.sort_index().items()]
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sidecar_path(path):
+    return os.path.splitext(path)[0] + '.meta.json'
+
+
+def write_sidecar(df, paths):
+    meta = snapshot_metadata(df)
+    meta["files"] = {
+        os.path.basename(path): {"size": os.path.getsize(path), "sha256": file_hash(path)}
+        for path in paths
+    }
+
+    meta_path = sidecar_path(paths[0])
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, meta_path)
+    return meta_path
+
+
+def read_sidecar(path):
+    # Возвращает метаданные снимка или None, если файла нет или он описывает другую версию данных
+    try:
+        with open(sidecar_path(path), encoding='utf-8') as f:
+            meta = json.load(f)
+        entry = meta["files"].get(os.path.basename(path))
+        if entry is None or entry["size"] != os.path.getsize(path):
+            return None
+        return meta
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_snapshot(df, base_path):
+    # base_path без расширения; возвращает пути в порядке SNAPSHOT_FORMAT
+    paths = []
+    for fmt in snapshot_formats():
+        path = f"{base_path}.{fmt}"
+        if fmt == 'parquet':
+            write_parquet(df, path)
+        else:
+            df.to_csv(path, index=False)
+        paths.append(path)
+
+    write_sidecar(df, paths)
+    return paths
+
+
+def read_parquet(path):
+    df = pd.read_parquet(path)
+    # Словари Arrow приходят категориями в порядке появления, а сортировать нужно по алфавиту
+    for column in ('title', 'room_type'):
+        if column in df.columns:
+            df[column] = df[column].cat.reorder_categories(sorted(df[column].cat.categories))
+    return df
+
+
+def read_dataset(path):
+    if path.endswith('.sqlite'):
+        return load_history(path)
+    if path.endswith('.parquet'):
+        return read_parquet(path)
+
+    # Если рядом с CSV лежит такой же снимок в Parquet, читаем его: типы уже заданы схемой
+    parquet_path = path[:-len('.csv')] + '.parquet'
+    if pq is not None and path.endswith('.csv') and os.path.exists(parquet_path) \
+            and os.path.getmtime(parquet_path) >= os.path.getmtime(path):
+        return read_parquet(parquet_path)
+    return pd.read_csv(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Хранилище истории цен")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    migrate = subparsers.add_parser('migrate', help="перенести историю из CSV в SQLite")
+    migrate.add_argument('--csv', default=HISTORY_CSV_PATH)
+    migrate.add_argument('--db', default=HISTORY_DB_PATH)
+
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        inserted = migrate_csv_history(args.csv, args.db)
+        print(f"Перенесено {inserted} записей из {args.csv} в {args.db}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from listing_store import listing_key
+
+FIXTURES_DIR = os.path.join(ROOT_DIR, 'fixtures')
+
+ROOM_TYPES = ['квартира-студия', '1-комнатная квартира', '2-комнатная квартира']
+
+
+def synthetic_listings(rows, listings=None, start='2025-01-01', days=30, seed=0):
+    # Наблюдения в формате снимка: listings объявлений, каждое видно в случайные моменты за days дней,
+    # цена колеблется вокруг базовой с шагом 1000 ₽
+    rng = np.random.default_rng(seed)
+    listings = listings or max(rows // 10, 1)
+
+    offer_ids = rng.integers(10**17, 10**18, size=listings, dtype=np.int64)
+    areas = rng.integers(15, 80, size=listings)
+    floors = rng.integers(1, 25, size=listings)
+    rooms = rng.integers(0, len(ROOM_TYPES), size=listings)
+    base_prices = rng.integers(25, 120, size=listings) * 1000
+
+    titles = np.array([
+        f"{area}\xa0м² · {ROOM_TYPES[room]} · {floor}\xa0этаж\xa0из\xa025"
+        for area, room, floor in zip(areas, rooms, floors)
+    ], dtype=object)
+    links = np.array([f"https://realty.yandex.ru/offer/{offer_id}/" for offer_id in offer_ids], dtype=object)
+    ids = np.array([listing_key(link) for link in links], dtype=object)
+
+    listing = rng.integers(0, listings, size=rows)
+    seconds = np.sort(rng.integers(0, int(days * 86400), size=rows))
+    scraped_at = pd.Timestamp(start) + pd.to_timedelta(seconds, unit='s')
+    price_change = rng.integers(-5, 6, size=rows) * 1000
+
+    return pd.DataFrame({
+        'id': ids[listing],
+        'title': titles[listing],
+        'price': base_prices[listing] + price_change,
+        'link': links[listing],
+        'scraped_at': scraped_at.strftime('%Y-%m-%d %H:%M:%S'),
+    })
+
+
+@pytest.fixture
+def make_listings():
+    return synthetic_listings
+
+
+def serp_page(cards=None):
+    # Сохраненная выдача; с cards - раздутая до нужного числа карточек повтором сохраненных
+    with open(os.path.join(FIXTURES_DIR, 'offers_serp.html'), encoding='utf-8') as f:
+        page_source = f.read()
+    if not cards:
+        return page_source
+
+    marker = '<li class="OffersSerpItem">'
+    head, rest = page_source.split(marker, 1)
+    body, tail = rest.rsplit('</li>', 1)
+    items = [marker + item for item in (body + '</li>').split(marker)]
+    items = (items * (cards // len(items) + 1))[:cards]
+    return head + ''.join(items) + tail
+
+
+@pytest.fixture
+def make_serp_page():
+    return serp_page
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import chunked
+from dataset_cache import DatasetCache
+from page_index import PageIndexCache
+
+SNAPSHOT = 'real_estate_kommunarka_20250101_100000.csv'
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch, make_listings):
+    make_listings(120, listings=15).to_csv(tmp_path / SNAPSHOT, index=False)
+    (tmp_path / 'real_estate_kommunarka_20250101_100000.meta.json').write_text('{}')
+    make_listings(10).to_csv(tmp_path / 'real_estate_kommunarka_raw_20250101_100000.csv', index=False)
+    monkeypatch.setattr(api, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(api, 'dataset_cache', DatasetCache())
+    monkeypatch.setattr(api, 'page_indexes', PageIndexCache(str(tmp_path / '.page_index'), chunk_size=16))
+    return TestClient(api.app)
+
+
+@pytest.mark.parametrize('endpoint', ['/data', '/stats'])
+@pytest.mark.parametrize('filename', [
+    'real_estate_kommunarka_20250101_100000.meta.json',
+    'real_estate_kommunarka_raw_20250101_100000.csv',
+    f'../{SNAPSHOT}',
+    'missing.csv',
+])
+def test_only_data_files_are_served(client, endpoint, filename):
+    assert client.get(endpoint, params={'filename': filename}).status_code == 404
+
+
+def all_pages(client, **params):
+    rows, cursor = [], None
+    while True:
+        body = client.get('/data', params=dict(params, filename=SNAPSHOT, limit=7, cursor=cursor)).json()
+        rows += body['data']
+        cursor = body['next_cursor']
+        if cursor is None:
+            return body['total'], rows
+
+
+@pytest.mark.parametrize('params', [
+    {'sort_by': 'price'},
+    {'sort_by': 'title', 'sort_order': 'desc', 'min_price': 50000},
+    {},
+])
+def test_large_file_pages_from_index_match_in_memory_pages(client, monkeypatch, tmp_path, params):
+    expected = all_pages(client, **params)
+
+    monkeypatch.setattr(chunked, 'LARGE_FILE_MB', 0)
+    # Пока индекс строится, страницу по смещению отдает проход по файлу, а курсоров нет
+    scanned = client.get('/data', params=dict(params, filename=SNAPSHOT, limit=7, offset=14)).json()
+    assert scanned['data'] == expected[1][14:21]
+
+    api.page_indexes.get(str(tmp_path / SNAPSHOT), wait=True)
+    assert all_pages(client, **params) == expected
+
+
+def slow_call(release, calls):
+    def compute(value):
+        calls.append(value)
+        release.wait(5)
+        if value == 'error':
+            raise ValueError(value)
+        return value
+    return compute
+
+
+def test_run_blocking_coalesces_identical_requests():
+    release, calls = threading.Event(), []
+    compute = slow_call(release, calls)
+
+    async def scenario():
+        same = [asyncio.create_task(api.run_blocking(('k', 1), compute, 'a')) for _ in range(5)]
+        other = asyncio.create_task(api.run_blocking(('k', 2), compute, 'b'))
+        await asyncio.sleep(0.05)
+        assert set(api.inflight) == {('k', 1), ('k', 2)}
+        release.set()
+        results = await asyncio.gather(*same, other)
+        # Завершенный запрос не остается в inflight: следующий считается заново
+        assert api.inflight == {}
+        return results + [await api.run_blocking(('k', 1), compute, 'c')]
+
+    assert asyncio.run(scenario()) == ['a'] * 5 + ['b', 'c']
+    assert sorted(calls) == ['a', 'b', 'c']
+
+
+def test_run_blocking_shares_errors_and_survives_cancelled_waiters():
+    release, calls = threading.Event(), []
+    compute = slow_call(release, calls)
+
+    async def scenario():
+        waiters = [asyncio.create_task(api.run_blocking('key', compute, 'error')) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        # Отключившийся клиент не отменяет общий расчет для остальных
+        waiters[0].cancel()
+        release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert api.inflight == {}
+        return results
+
+    cancelled, *errors = asyncio.run(scenario())
+    assert isinstance(cancelled, asyncio.CancelledError)
+    assert [type(e) for e in errors] == [ValueError, ValueError]
+    assert calls == ['error']
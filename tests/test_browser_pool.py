@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from browser_pool import BrowserPool, BrowserSession
+
+
+class DeadDriver:
+    # Как драйвер, у которого умер chromedriver: selenium отдает ошибку соединения, а не WebDriverException
+    def __init__(self):
+        self.quit_calls = 0
+
+    def get(self, url):
+        raise ConnectionError("chromedriver is gone")
+
+    def execute_script(self, script):
+        raise ConnectionError("chromedriver is gone")
+
+    def quit(self):
+        self.quit_calls += 1
+        raise ConnectionError("chromedriver is gone")
+
+
+class LiveDriver:
+    page_source = '<div class="OffersSerp__list"></div>'
+
+    def get(self, url):
+        self.url = url
+
+    def find_elements(self, by, selector):
+        return [object()]
+
+    def execute_script(self, script):
+        return 1 if script == 'return 1' else 0
+
+    def quit(self):
+        pass
+
+
+def fetch_with_timeout(pool, url, timeout=5):
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(page=pool.fetch(url)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "пул не вернул место упавшего браузера"
+    return result['page']
+
+
+def test_dead_driver_frees_its_slot():
+    drivers = [DeadDriver(), LiveDriver()]
+    pool = BrowserPool(lambda: drivers.pop(0), size=1, max_memory_mb=10**6)
+
+    with pytest.raises(ConnectionError):
+        pool.fetch('https://example.com/1')
+    assert pool.created == 0
+
+    assert fetch_with_timeout(pool, 'https://example.com/2') == LiveDriver.page_source
+    assert pool.created == 1
+
+
+def test_dead_idle_session_is_replaced():
+    drivers = [LiveDriver()]
+    pool = BrowserPool(lambda: drivers.pop(0), size=1, max_memory_mb=10**6)
+    pool.fetch('https://example.com/1')
+
+    # Браузер умер, пока лежал в пуле: проверка здоровья должна это заметить, а не упасть
+    session = pool.idle.queue[0]
+    session.driver = DeadDriver()
+    assert not session.healthy()
+    drivers.append(LiveDriver())
+    assert fetch_with_timeout(pool, 'https://example.com/2') == LiveDriver.page_source
+    assert pool.created == 1
+
+
+def test_healthy_is_false_on_any_error():
+    assert not BrowserSession(DeadDriver()).healthy()
+    assert BrowserSession(LiveDriver()).healthy()
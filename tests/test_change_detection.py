@@ -0,0 +1,44 @@
+import change_detection
+from change_detection import EVENT_CHANGED, EVENT_NEW, EVENT_REMOVED, commit_changes, detect_changes, load_events
+
+
+def run(df, path, run_at, commit=True):
+    events = detect_changes(df, path=path, run_at=run_at)
+    if commit:
+        commit_changes(df, events, path=path, run_at=run_at)
+    return events
+
+
+def test_events_survive_until_commit(tmp_path, make_listings):
+    path = str(tmp_path / 'history.sqlite')
+    df = make_listings(40, listings=40, seed=1).drop_duplicates('id')
+
+    # Сбой до commit_changes: повтор должен увидеть те же новые объявления
+    first = run(df, path, '2025-01-01 10:00:00', commit=False)
+    assert (first['event'] == EVENT_NEW).sum() == len(df)
+    assert load_events(path=path).empty
+
+    retry = run(df, path, '2025-01-01 10:00:00')
+    assert (retry['event'] == EVENT_NEW).sum() == len(df)
+    assert len(load_events(path=path)) == len(df)
+    assert run(df, path, '2025-01-01 11:00:00').empty
+
+
+def test_price_change_and_delisting(tmp_path, monkeypatch, make_listings):
+    monkeypatch.setattr(change_detection, 'DELIST_AFTER_RUNS', 2)
+    path = str(tmp_path / 'history.sqlite')
+    df = make_listings(40, listings=40, seed=2).drop_duplicates('id').reset_index(drop=True)
+    run(df, path, '2025-01-01 10:00:00')
+
+    changed = df.copy()
+    changed.loc[0, 'price'] += 1000
+    events = run(changed.iloc[:-3], path, '2025-01-01 11:00:00')
+    assert events['event'].tolist() == [EVENT_CHANGED]
+    assert events['old_price'].iloc[0] == df.loc[0, 'price']
+
+    # Пропавшие объявления снимаются только после DELIST_AFTER_RUNS пропусков подряд
+    events = run(changed.iloc[:-3], path, '2025-01-01 12:00:00')
+    assert sorted(events.loc[events['event'] == EVENT_REMOVED, 'id']) == sorted(df['id'].iloc[-3:])
+
+    events = run(changed, path, '2025-01-01 13:00:00')
+    assert sorted(events.loc[events['event'] == EVENT_NEW, 'id']) == sorted(df['id'].iloc[-3:])
@@ -0,0 +1,259 @@
+import asyncio
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import aiohttp
+import pytest
+
+import crawler
+from crawler import HostRateLimiter, SearchQuery, TokenBucket, crawl, fetch_page
+from fetching import needs_js
+from parsing import ListingParser
+
+
+def listing_page(page):
+    return ''.join(
+        f'<div class="OffersSerpItem"><span class="OffersSerpItemTitle__text">Квартира {page}-{i}</span>'
+        f'<span class="OffersSerpItemPrice__price">{50000 + i} ₽/мес.</span>'
+        f'<a class="OffersSerpItem__link" href="/offer/{page}{i:02d}/">открыть</a></div>'
+        for i in range(3)
+    )
+
+
+CAPTCHA_PAGE = '<html><form action="/checkcaptcha"></form></html>'
+
+
+class StubSite(BaseHTTPRequestHandler):
+    # Путь - сценарий ответа (как комнатность в адресе запроса), номер страницы - из ?page=
+    pages = 2
+    busy = {}
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        scenario = parts.path.strip('/').split('/')[0]
+        page = int(parse_qs(parts.query).get('page', ['0'])[0])
+        self.server.requests.append((scenario, page))
+
+        if scenario == 'captcha':
+            return self.reply(200, CAPTCHA_PAGE)
+        if scenario == 'forbidden':
+            return self.reply(403, 'forbidden')
+        if scenario == 'busy':
+            left = self.busy.get(page, 0)
+            if left:
+                self.busy[page] = left - 1
+                return self.reply(503, 'busy', {'Retry-After': '0'})
+        if scenario == 'throttled':
+            return self.reply(429, 'slow down')
+        if page >= self.pages:
+            return self.reply(404, 'not found')
+        return self.reply(200, listing_page(page))
+
+    def reply(self, status, body, headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def site():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubSite)
+    server.requests = []
+    StubSite.busy = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(crawler, 'RETRY_BACKOFF', 0)
+    monkeypatch.setattr(crawler, 'HTTP_RETRIES', 2)
+
+
+def base_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def closed_port_url():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+class Browser:
+    def __init__(self):
+        self.urls = []
+
+    def __call__(self, url):
+        self.urls.append(url)
+        return listing_page(0)
+
+
+def no_limit():
+    return HostRateLimiter(rate=1000, capacity=1000)
+
+
+@pytest.mark.parametrize('page_source,expected', [
+    (listing_page(0), False),
+    ('<div class="OffersSerpNotFound">Ничего не найдено</div>', False),
+    ('<div class="OffersSerp__list"></div>', False),
+    (CAPTCHA_PAGE, True),
+    ('<html><noscript>Включите JavaScript</noscript></html>', True),
+    ('<html><body></body></html>', True),
+    ('   ', True),
+    (None, True),
+])
+def test_needs_js(page_source, expected):
+    assert needs_js(page_source) is expected
+
+
+def run_crawl(server_url, rooms, browser, **kwargs):
+    query = SearchQuery(station='test', rooms=rooms)
+    batches = crawl([query], ListingParser('html.parser').parse, fallback=browser,
+                    rate_limiter=no_limit(), base_url=server_url, workers=2, **kwargs)
+    return [link for batch in batches for link in batch.dedupe_keys()]
+
+
+def test_crawl_stops_at_404_without_browser(site):
+    browser = Browser()
+    links = run_crawl(base_url(site), 'ok', browser)
+    assert len(links) == 6
+    assert site.requests == [('ok', 0), ('ok', 1), ('ok', 2)]
+    assert browser.urls == []
+
+
+def test_crawl_retries_busy_site_without_browser(site):
+    StubSite.busy = {0: 2}
+    browser = Browser()
+    links = run_crawl(base_url(site), 'busy', browser)
+    assert len(links) == 6
+    assert site.requests[:3] == [('busy', 0)] * 3
+    assert browser.urls == []
+
+
+@pytest.mark.parametrize('rooms,attempts', [('throttled', 3), ('forbidden', 1)])
+def test_crawl_gives_up_on_http_errors_without_browser(site, rooms, attempts):
+    browser = Browser()
+    assert run_crawl(base_url(site), rooms, browser) == []
+    assert site.requests == [(rooms, 0)] * attempts
+    assert browser.urls == []
+
+
+def test_crawl_opens_browser_for_captcha(site):
+    browser = Browser()
+    links = run_crawl(base_url(site), 'captcha', browser, max_pages=1)
+    assert len(links) == 3
+    assert browser.urls == [f"{base_url(site)}/captcha/metro-test/"]
+
+
+def test_crawl_opens_browser_after_network_error():
+    browser = Browser()
+    links = run_crawl(closed_port_url(), 'ok', browser, max_pages=1)
+    assert len(links) == 3
+    assert len(browser.urls) == 1
+
+
+@pytest.mark.parametrize('rooms,expected,browser_calls', [
+    ('ok', listing_page(0), 0),
+    ('captcha', listing_page(0), 1),
+    ('throttled', None, 0),
+    ('forbidden', None, 0),
+])
+def test_fetch_page(site, rooms, expected, browser_calls):
+    browser = Browser()
+    url = SearchQuery(station='test', rooms=rooms).url(base_url=base_url(site))
+    assert fetch_page(url, fallback=browser, rate_limiter=no_limit()) == expected
+    assert len(browser.urls) == browser_calls
+
+
+def test_fetch_page_past_last_page_is_empty(site):
+    browser = Browser()
+    url = SearchQuery(station='test', rooms='ok').url(page=5, base_url=base_url(site))
+    assert fetch_page(url, fallback=browser, rate_limiter=no_limit()) == ''
+    assert browser.urls == []
+
+
+def test_fetch_page_retries_busy_site(site):
+    StubSite.busy = {0: 1}
+    url = SearchQuery(station='test', rooms='busy').url(base_url=base_url(site))
+    assert fetch_page(url, fallback=Browser(), rate_limiter=no_limit()) == listing_page(0)
+    assert site.requests == [('busy', 0), ('busy', 0)]
+
+
+def test_fetch_page_opens_browser_after_network_error():
+    browser = Browser()
+    url = SearchQuery(station='test', rooms='ok').url(base_url=closed_port_url())
+    assert fetch_page(url, fallback=browser, rate_limiter=no_limit()) == listing_page(0)
+    assert browser.urls == [url]
+
+
+@pytest.mark.parametrize('headers,attempt,expected', [
+    ({'Retry-After': '7'}, 0, 7.0),
+    ({'Retry-After': 'Wed, 21 Oct 2026 07:28:00 GMT'}, 1, 4.0),
+    (None, 2, 8.0),
+])
+def test_retry_delay(monkeypatch, headers, attempt, expected):
+    monkeypatch.setattr(crawler, 'RETRY_BACKOFF', 2)
+    error = aiohttp.ClientResponseError(None, (), status=503, headers=headers)
+    assert crawler.retry_delay(error, attempt) == expected
+
+
+def test_token_bucket_spends_burst_then_spaces_requests():
+    bucket = TokenBucket(rate=10, capacity=2)
+    delays = [bucket.reserve() for _ in range(5)]
+    assert delays[:2] == [0, 0]
+    assert delays[2:] == pytest.approx([0.1, 0.2, 0.3], abs=0.01)
+
+
+def test_token_bucket_refills_while_idle():
+    bucket = TokenBucket(rate=50, capacity=1)
+    assert bucket.reserve() == 0
+    time.sleep(0.05)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.02, abs=0.005)
+
+
+def test_token_bucket_limits_threads_and_tasks_together():
+    # Одно ведро на сайт для задач в пуле потоков и для Crawler в asyncio: вместе они не превышают частоту
+    bucket = TokenBucket(rate=50, capacity=1)
+    started = time.monotonic()
+    threads = [threading.Thread(target=bucket.wait) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+
+    async def tasks():
+        await asyncio.gather(*(bucket.acquire() for _ in range(3)))
+
+    asyncio.run(tasks())
+    for thread in threads:
+        thread.join()
+    # Первый запрос сразу, остальные пять - через 1/50 секунды друг за другом
+    assert time.monotonic() - started >= 5 / 50 - 0.005
+
+
+def test_host_rate_limiter_keeps_a_bucket_per_host():
+    limiter = HostRateLimiter(rate=1, capacity=1)
+    query = SearchQuery(station='test', rooms='studiya')
+    assert limiter.bucket(query.url(0)) is limiter.bucket(query.url(3))
+    assert limiter.bucket(query.url(0)) is not limiter.bucket(query.url(0, base_url='https://example.com'))
+
+    limiter.wait(query.url(0))
+    started = time.monotonic()
+    limiter.wait(query.url(0, base_url='https://example.com'))
+    assert time.monotonic() - started < 0.05
+    assert limiter.bucket(query.url(1)).reserve() > 0.9
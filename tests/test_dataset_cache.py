@@ -0,0 +1,60 @@
+import pytest
+
+from dataset_cache import DatasetCache, load_compact
+
+
+@pytest.fixture
+def snapshots(tmp_path, make_listings):
+    def write(count, rows=400):
+        paths = []
+        for i in range(count):
+            path = str(tmp_path / f'real_estate_kommunarka_2025010{i + 1}_100000.csv')
+            make_listings(rows, seed=i).to_csv(path, index=False)
+            paths.append(path)
+        return paths
+    return write
+
+
+def test_side_entries_leave_with_the_file(snapshots):
+    first, second = snapshots(2)
+    cache = DatasetCache()
+    cache.max_bytes = cache.get(first).memory_usage(deep=True).sum() + 1
+    cache.metadata(first)
+    cache.derived(first, 'price_counts', lambda: {'n': 1})
+    cache.indexed(first)
+
+    cache.get(second)
+
+    assert list(cache.entries) == [second]
+    assert first not in cache.metadata_entries
+    assert first not in cache.derived_entries
+    assert first not in cache.indexed_entries
+
+
+def test_side_entries_of_unloaded_files_are_bounded(snapshots):
+    paths = snapshots(5, rows=10)
+    cache = DatasetCache(max_files=3)
+    for i, path in enumerate(paths):
+        cache.derived(path, ('timeseries', 'day'), lambda: [i])
+
+    assert list(cache.derived_entries) == paths[-3:]
+    assert list(cache.side_paths) == paths[-3:]
+    assert cache.derived(paths[0], ('timeseries', 'day'), lambda: ['again']) == ['again']
+
+
+def test_index_memory_counts_towards_the_limit(snapshots):
+    first, second = snapshots(2)
+    size = int(load_compact(first).memory_usage(deep=True).sum())
+    cache = DatasetCache(max_bytes=2 * size + size // 2)
+    cache.get(second)
+    dataset = cache.indexed(first)
+    assert cache.stats()['bytes'] == cache.entries[second][2] + size
+
+    dataset.query(sort_by='title', limit=5)
+    dataset.query(sort_by='link', limit=5)
+
+    assert dataset.nbytes > 0
+    assert cache.entries[first][2] == size + dataset.nbytes
+    # Индексы вытеснили давно не запрошенный файл, хотя без них оба помещались в лимит
+    assert list(cache.entries) == [first]
+    assert cache.stats()['bytes'] == size + dataset.nbytes
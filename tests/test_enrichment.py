@@ -0,0 +1,87 @@
+import pytest
+
+import enrichment
+from crawler import HostRateLimiter
+from enrichment import detail_fields, enrich_listings, load_details, with_details
+from http_cache import HttpCache
+
+DETAIL_PAGE = """
+<html><head><script>var area = "99 м";</script></head><body>
+<h1>Сдается 1-комнатная квартира, 42,5&nbsp;м²</h1>
+<ul><li>Общая площадь <b>42,5 м²</b></li><li>Жилая 20 м²</li><li>Площадь кухни 10,2 м²</li>
+<li>5 этаж из 17</li><li>Год постройки: 2015</li></ul>
+</body></html>
+"""
+
+
+def test_detail_fields():
+    assert detail_fields(DETAIL_PAGE) == {
+        'room_type': '1-комнатная', 'area': 42.5, 'living_area': 20.0, 'kitchen_area': 10.2,
+        'floor': 5, 'floors_total': 17, 'built_year': 2015,
+    }
+
+
+def test_detail_fields_fall_back_to_any_area():
+    fields = detail_fields('<p>Квартира-студия, 24 м², этаж 3 из 9</p>')
+    assert fields['room_type'] == 'студия'
+    assert (fields['area'], fields['floor'], fields['floors_total']) == (24.0, 3, 9)
+    assert fields['built_year'] is None
+
+
+class FakeFetcher:
+    # Вместо HttpFetcher: страницы объявлений с сайта, часть адресов отвечает ошибкой
+    requests = []
+    failing = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+    async def fetch_response(self, url, headers=None):
+        FakeFetcher.requests.append(url)
+        if url in FakeFetcher.failing:
+            raise ConnectionError(url)
+        return 200, DETAIL_PAGE, {}
+
+
+@pytest.fixture
+def site(monkeypatch):
+    FakeFetcher.requests, FakeFetcher.failing = [], set()
+    monkeypatch.setattr(enrichment, 'HttpFetcher', FakeFetcher)
+    monkeypatch.setattr(enrichment, 'HOST_LIMITER', HostRateLimiter(rate=1000, capacity=1000))
+    return FakeFetcher
+
+
+def test_enrich_fetches_each_listing_once(tmp_path, make_listings, site):
+    db_path = str(tmp_path / 'history.sqlite')
+    cache = HttpCache(str(tmp_path / 'cache'))
+    df = make_listings(60, listings=4)
+    links = list(dict.fromkeys(df['link']))
+    site.failing = {links[0]}
+
+    assert enrich_listings(df, db_path, cache=cache) == 3
+    assert sorted(site.requests) == sorted(links)
+
+    # Упавшая страница догружается при следующем запуске, остальные уже в listing_details
+    site.failing = set()
+    assert enrich_listings(df, db_path, cache=cache) == 1
+    assert site.requests[len(links):] == [links[0]]
+    assert enrich_listings(df, db_path, cache=cache) == 0
+    assert len(site.requests) == len(links) + 1
+
+    details = load_details(df['id'].unique(), db_path)
+    assert len(details) == 4
+    assert (details['built_year'] == 2015).all()
+
+
+def test_with_details_prefers_detail_page(tmp_path, make_listings, site):
+    db_path = str(tmp_path / 'history.sqlite')
+    df = make_listings(20, listings=2)
+    enrich_listings(df, db_path, cache=HttpCache(str(tmp_path / 'cache')))
+
+    enriched = with_details(df, db_path)
+    assert (enriched['area'] == 42.5).all()
+    assert (enriched['floor'] == 5).all()
+    assert (enriched['price_per_m2'] == (df['price'] / 42.5).round(2)).all()
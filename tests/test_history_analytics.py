@@ -0,0 +1,35 @@
+from change_detection import EVENT_REMOVED, commit_changes, detect_changes
+from history_analytics import load_listing_lifetimes, update_analytics
+from storage import connect, insert_history
+
+
+def save_run(df, path, run_at):
+    # Шаги save_data: в историю только новые и изменившиеся объявления, затем индекс и аналитика
+    df = df.assign(scraped_at=run_at)
+    events = detect_changes(df, path=path, run_at=run_at)
+    changed_ids = events.loc[events['event'] != EVENT_REMOVED, 'id']
+    conn = connect(path)
+    insert_history(conn, df[df['id'].isin(changed_ids)])
+    conn.close()
+    commit_changes(df, events, path=path, run_at=run_at)
+    update_analytics(path)
+
+
+def test_last_seen_follows_runs_with_unchanged_prices(tmp_path, make_listings):
+    path = str(tmp_path / 'history.sqlite')
+    df = make_listings(10, listings=10, seed=4).drop_duplicates('id').reset_index(drop=True)
+
+    save_run(df, path, '2025-01-01 10:00:00')
+    changed = df.copy()
+    changed.loc[0, 'price'] += 1000
+    save_run(changed, path, '2025-01-10 10:00:00')
+    save_run(changed.iloc[1:], path, '2025-02-20 10:00:00')
+
+    lifetimes = load_listing_lifetimes(path).set_index('id')
+    assert (lifetimes['first_seen'] == '2025-01-01 10:00:00').all()
+    assert lifetimes.loc[df['id'].iloc[0], 'last_seen'] == '2025-01-10 10:00:00'
+    assert (lifetimes.loc[df['id'].iloc[1:], 'last_seen'] == '2025-02-20 10:00:00').all()
+
+    first = lifetimes.loc[df['id'].iloc[0]]
+    assert (first['last_price'], first['price_changes']) == (changed.loc[0, 'price'], 1)
+    assert (lifetimes.loc[df['id'].iloc[1:], 'price_changes'] == 0).all()
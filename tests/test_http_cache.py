@@ -0,0 +1,94 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from http_cache import CachingFetcher, HttpCache
+
+URL = 'https://realty.yandex.ru/offer/123456789012345678/'
+
+
+class FakeSite:
+    # Отвечает как HttpFetcher.fetch_response и запоминает заголовки каждого запроса
+    def __init__(self, body='<html>v1</html>', etag='"v1"'):
+        self.body = body
+        self.etag = etag
+        self.requests = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+    async def fetch_response(self, url, headers=None):
+        self.requests.append(headers or {})
+        if headers and headers.get('If-None-Match') == self.etag:
+            return 304, None, {}
+        return 200, self.body, {'ETag': self.etag, 'Last-Modified': 'Wed, 01 Jan 2025 10:00:00 GMT'}
+
+
+def fetch(site, cache, url=URL):
+    async def run():
+        async with CachingFetcher(site, cache) as fetcher:
+            return await fetcher.fetch(url)
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return HttpCache(str(tmp_path / 'cache'), ttl=3600, max_age=7200)
+
+
+def test_fresh_entry_is_served_from_disk(cache):
+    site = FakeSite()
+    assert fetch(site, cache) == '<html>v1</html>'
+    assert fetch(site, cache) == '<html>v1</html>'
+    assert site.requests == [{}]
+
+
+def test_stale_entry_is_revalidated(cache):
+    site = FakeSite()
+    fetch(site, cache)
+    cache.ttl = 0
+
+    assert fetch(site, cache) == '<html>v1</html>'
+    assert site.requests[1] == {'If-None-Match': '"v1"', 'If-Modified-Since': 'Wed, 01 Jan 2025 10:00:00 GMT'}
+    # 304 продлил свежесть: со сроком жизни снова в час запрос не нужен
+    cache.ttl = 3600
+    fetch(site, cache)
+    assert len(site.requests) == 2
+
+
+def test_changed_page_replaces_entry(cache):
+    site = FakeSite()
+    fetch(site, cache)
+    cache.ttl = 0
+    site.body, site.etag = '<html>v2</html>', '"v2"'
+
+    assert fetch(site, cache) == '<html>v2</html>'
+    assert cache.body(URL) == '<html>v2</html>'
+    assert cache.lookup(URL)['etag'] == '"v2"'
+
+
+def test_entry_of_another_url_is_ignored(cache):
+    fetch(FakeSite(), cache)
+    meta_path = cache._path(URL, '.json')
+    other = 'https://realty.yandex.ru/offer/1/'
+    os.replace(meta_path, cache._path(other, '.json'))
+    assert cache.lookup(other) is None
+
+
+def test_evict_removes_entries_not_checked_for_max_age(cache):
+    site = FakeSite()
+    old_url = URL.replace('123', '999')
+    fetch(site, cache)
+    fetch(site, cache, old_url)
+    long_ago = time.time() - 10000
+    os.utime(cache._path(old_url, '.json'), (long_ago, long_ago))
+
+    assert cache.evict() == 1
+    assert cache.lookup(old_url) is None
+    assert not os.path.exists(cache._path(old_url, '.html.gz'))
+    assert cache.body(URL) == '<html>v1</html>'
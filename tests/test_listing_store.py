@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from listing_store import (NO_OFFER_ID, ListingBatch, compact_frame, drop_duplicate_listings, expand_frame,
+                           listing_key, listings_frame)
+from parsing import ListingParser, available_backends
+
+NO_HREF_PAGE = """
+<ol class="OffersSerp__list">
+  <li class="OffersSerpItem">
+    <a class="OffersSerpItem__link"><span class="OffersSerpItemTitle__text">30 м² · квартира-студия · 3 этаж из 9</span></a>
+    <div class="OffersSerpItemPrice__price">40 000 ₽/мес.</div>
+  </li>
+  <li class="OffersSerpItem">
+    <a class="OffersSerpItem__link"><span class="OffersSerpItemTitle__text">45 м² · 1-комнатная квартира · 7 этаж из 9</span></a>
+    <div class="OffersSerpItemPrice__price">52 000 ₽/мес.</div>
+  </li>
+  <li class="OffersSerpItem">
+    <a class="OffersSerpItem__link" href="/offer/123/"><span class="OffersSerpItemTitle__text">50 м² · 2-комнатная квартира · 2 этаж из 9</span></a>
+    <div class="OffersSerpItemPrice__price">60 000 ₽/мес.</div>
+  </li>
+</ol>
+"""
+
+
+@pytest.mark.parametrize('backend', available_backends())
+def test_cards_without_href_keep_empty_distinct_links(backend):
+    batch = ListingParser(backend).parse(NO_HREF_PAGE)
+    assert batch.link_list() == ['', '', 'https://realty.yandex.ru/offer/123/']
+    assert len(set(batch.dedupe_keys())) == 3
+
+    df = drop_duplicate_listings(listings_frame([batch]))
+    assert len(df) == 3
+    assert df['link'].tolist()[:2] == ['', '']
+
+
+def test_batch_round_trip():
+    links = [
+        'https://realty.yandex.ru/offer/8968623028306171466/',
+        'https://realty.yandex.ru/offer/0123/',
+        'https://example.com/offer/5/',
+        '',
+        'https://realty.yandex.ru/offer/99999999999999999999/',
+    ]
+    batch = ListingBatch(scraped_at=1735725600)
+    for i, link in enumerate(links):
+        batch.append(f'title {i % 2}', None if i == 3 else 1000 * i, link)
+
+    assert batch.link_list() == links
+    assert list(batch.offer_ids)[3] == NO_OFFER_ID
+    assert batch.take([4, 0]).link_list() == [links[4], links[0]]
+
+    df = listings_frame([batch])
+    assert df['link'].tolist() == links
+    assert df['id'].tolist() == [listing_key(link) for link in links]
+    assert np.isnan(df['price'].iloc[3])
+
+
+def test_compact_frame_round_trip(make_listings):
+    df = make_listings(200, listings=30)
+    compact = compact_frame(df)
+    assert 'link' not in compact.columns and 'id' not in compact.columns
+    pd.testing.assert_frame_equal(expand_frame(compact).astype(object), df.astype(object))
+
+
+def test_compact_frame_keeps_links_it_cannot_rebuild(make_listings):
+    df = make_listings(20, listings=5)
+    df.loc[3, 'link'] = ''
+    compact = compact_frame(df)
+    assert 'link' in compact.columns
+    pd.testing.assert_frame_equal(expand_frame(compact).astype(object), df.astype(object))
@@ -0,0 +1,90 @@
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from prefect import flow
+from prefect.task_runners import ThreadPoolTaskRunner
+from prefect.testing.utilities import prefect_test_harness
+
+import main
+
+CARD = ('<li class="OffersSerpItem"><a class="OffersSerpItem__link" href="/offer/{number}/">'
+        '<span class="OffersSerpItemTitle__text">Квартира {number}</span></a>'
+        '<div class="OffersSerpItemPrice__price">{price} ₽/мес.</div></li>')
+
+
+class FakeQuery:
+    # У каждого теста свои адреса, чтобы не подхватить страницы из кэша задач Prefect
+    def __init__(self, label, pages, delay=0.0):
+        self.label = label
+        self.pages = pages
+        self.delay = delay
+        self.base = f"https://example.test/{uuid.uuid4().hex}/{label}/"
+
+    def url(self, page=0, base_url=None):
+        return f"{self.base}?page={page}"
+
+
+def serp(query, page):
+    # На последней странице выдача повторяется, как у сайта за концом пагинации
+    page = min(page, query.pages - 1)
+    cards = ''.join(CARD.format(number=hash((query.label, page, i)) % 10**12 + 1, price=40000 + i * 1000)
+                    for i in range(3))
+    return f'<ol class="OffersSerp__list">{cards}</ol>'
+
+
+@pytest.fixture(scope='module', autouse=True)
+def prefect_server():
+    with prefect_test_harness():
+        yield
+
+
+@pytest.fixture
+def fake_site(monkeypatch):
+    queries = {}
+    finished = []
+    lock = threading.Lock()
+
+    def fetch_page(url, fallback=None, use_http=True, logger=None):
+        query = queries[url.split('?')[0]]
+        page = int(parse_qs(urlparse(url).query)['page'][0])
+        time.sleep(query.delay)
+        with lock:
+            finished.append((query.label, page))
+        return serp(query, page)
+
+    monkeypatch.setattr(main, 'fetch_page', fetch_page)
+
+    def add(query):
+        queries[query.base] = query
+        return query
+
+    return add, finished
+
+
+def test_queries_advance_independently(fake_site):
+    add, finished = fake_site
+    slow = add(FakeQuery('slow', pages=1, delay=2.0))
+    fast = add(FakeQuery('fast', pages=4))
+
+    @flow(task_runner=ThreadPoolTaskRunner(max_workers=4))
+    def scrape(queries):
+        return main.scrape_mapped(queries, 'http')
+
+    df = scrape([slow, fast])
+
+    # Быстрый запрос прошел все страницы, пока медленный ждал первую
+    assert finished.index(('slow', 0)) > finished.index(('fast', 4))
+    assert len(df) == 3 + 4 * 3
+    assert df['link'].is_unique
+
+
+def test_page_cache_key_includes_fetch_mode(monkeypatch):
+    monkeypatch.setattr(main, 'FETCH_MODE', 'http')
+    url = 'https://example.test/offer-list/'
+    assert main.page_cache_key(None, {'url': url, 'fetch_mode': None}) == \
+        main.page_cache_key(None, {'url': url, 'fetch_mode': 'http'})
+    assert main.page_cache_key(None, {'url': url, 'fetch_mode': 'http'}) != \
+        main.page_cache_key(None, {'url': url, 'fetch_mode': 'browser'})
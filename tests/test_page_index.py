@@ -0,0 +1,65 @@
+import os
+import time
+
+import pandas as pd
+
+from page_index import PageIndexCache
+from storage import connect, insert_history
+
+
+def write_history(path, df):
+    conn = connect(path)
+    insert_history(conn, df)
+    conn.close()
+
+
+def test_builds_in_background_then_serves_pages(tmp_path, make_listings):
+    source = str(tmp_path / 'snapshot.csv')
+    make_listings(500).to_csv(source, index=False)
+    cache = PageIndexCache(str(tmp_path / 'index'), chunk_size=64)
+
+    index = cache.get(source)
+    while index is None:
+        time.sleep(0.05)
+        index = cache.get(source)
+
+    total, rows, cursor = index.query(sort_by='price', limit=5)
+    assert total == 500 and len(rows) == 5 and cursor is not None
+    assert rows['price'].is_monotonic_increasing
+
+
+def test_index_is_reused_across_processes_and_rebuilt_on_change(tmp_path, make_listings):
+    source = str(tmp_path / 'snapshot.csv')
+    make_listings(200, seed=1).to_csv(source, index=False)
+    directory = str(tmp_path / 'index')
+    built = PageIndexCache(directory).get(source, wait=True)
+    built_at = os.stat(built.path).st_mtime_ns
+
+    # Новый процесс API открывает готовый индекс, а не строит его заново
+    reopened = PageIndexCache(directory).get(source)
+    assert reopened is not None and os.stat(reopened.path).st_mtime_ns == built_at
+
+    make_listings(300, seed=2).to_csv(source, index=False)
+    cache = PageIndexCache(directory)
+    assert cache.get(source) is None
+    assert cache.get(source, wait=True).rows == 300
+
+
+def test_history_index_picks_up_appended_rows(tmp_path, make_listings):
+    source = str(tmp_path / 'history.sqlite')
+    write_history(source, make_listings(300, seed=1, start='2025-01-01'))
+    cache = PageIndexCache(str(tmp_path / 'index'), chunk_size=64)
+    first = cache.get(source, wait=True)
+    before = first.rows
+
+    write_history(source, make_listings(100, seed=2, start='2025-03-01'))
+    index = cache.get(source)
+    conn = connect(source)
+    expected = pd.read_sql_query('SELECT price FROM history ORDER BY scraped_at DESC, rowid DESC LIMIT 3', conn)
+    size = conn.execute('SELECT COUNT(*) FROM history').fetchone()[0]
+    conn.close()
+
+    assert index is first and index.rows == size > before
+    total, rows, _ = index.query(sort_by='scraped_at', sort_order='desc', limit=3)
+    assert total == size
+    assert rows['price'].tolist() == expected['price'].tolist()
@@ -0,0 +1,24 @@
+import pytest
+
+from parsing import ListingParser, available_backends
+
+CARDS = 200
+
+
+def cards(batch):
+    titles = batch.title_list()
+    return [(titles[code], price, link) for code, price, link in zip(batch.title_codes, batch.prices, batch.link_list())]
+
+
+@pytest.mark.parametrize('backend', available_backends())
+def test_parse_speed(benchmark, make_serp_page, backend):
+    page_source = make_serp_page(CARDS)
+    parser = ListingParser(backend)
+    benchmark.group = f"parse {CARDS} cards"
+    benchmark.extra_info['cards'] = CARDS
+
+    batch = benchmark(parser.parse, page_source)
+
+    # Эталон - встроенный html.parser: остальные парсеры должны находить те же карточки
+    assert len(batch) == CARDS
+    assert cards(batch) == cards(ListingParser('html.parser').parse(page_source))
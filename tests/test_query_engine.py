@@ -0,0 +1,128 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from listing_store import compact_frame, expand_frame
+from page_index import PageIndex
+from query_engine import IndexedDataset, InvalidCursor
+from storage import connect, insert_history
+
+PRICE_FILTERS = [(None, None), (40000, None), (None, 60000), (50000, 50000), (10**9, None)]
+
+
+@pytest.fixture
+def listings(make_listings):
+    # Мало объявлений и грубое время - много равных цен и дат; часть цен пустые, как у карточек без цены
+    def build(datetimes=False):
+        df = make_listings(300, listings=25, days=1, seed=3)
+        df['scraped_at'] = df['scraped_at'].str.slice(0, 13) + ':00:00'
+        df['price'] = df['price'].astype('float64')
+        df.loc[df.index % 11 == 0, 'price'] = np.nan
+        if datetimes:
+            df['scraped_at'] = pd.to_datetime(df['scraped_at'])
+        return df
+    return build
+
+
+def reference(df, min_price=None, max_price=None, sort_by=None, sort_order='asc'):
+    # Ожидаемая выдача: фильтр по цене включительно, устойчивая сортировка по возрастанию
+    # (для desc - она же в обратном порядке), пустые значения в конце в порядке строк
+    rows = df
+    if min_price is not None:
+        rows = rows[rows['price'] >= min_price]
+    if max_price is not None:
+        rows = rows[rows['price'] <= max_price]
+    if not sort_by:
+        return rows
+    valid = rows[sort_by].notna()
+    ordered = rows[valid].sort_values(sort_by, kind='stable')
+    if sort_order == 'desc':
+        ordered = ordered.iloc[::-1]
+    return pd.concat([ordered, rows[~valid]])
+
+
+def plain(df):
+    # Пропуск из SQLite приходит как None, из pandas - как NaN; в ответе API оба становятся null
+    df = df.astype(object).reset_index(drop=True)
+    return df.where(df.notna(), None)
+
+
+def assert_rows(actual, expected):
+    pd.testing.assert_frame_equal(plain(expand_frame(actual)), plain(expected))
+
+
+def page_index(df, tmp_path, source):
+    # Индекс страниц больших файлов строится по частям, поэтому часть меньше числа строк
+    if source == 'csv':
+        source_path = str(tmp_path / 'snapshot.csv')
+        df.to_csv(source_path, index=False)
+        df = pd.read_csv(source_path)
+    else:
+        source_path = str(tmp_path / 'history.sqlite')
+        conn = connect(source_path)
+        insert_history(conn, df)
+        df = pd.read_sql_query('SELECT id, title, price, link, scraped_at FROM history ORDER BY rowid', conn)
+        conn.close()
+    return df, PageIndex.build(source_path, str(tmp_path / 'index.sqlite'), chunk_size=37)
+
+
+@pytest.fixture(params=['raw', 'compact', 'datetime', 'page_index_csv', 'page_index_history'])
+def frame(request, listings, tmp_path):
+    df = listings(datetimes=request.param == 'datetime')
+    if request.param.startswith('page_index'):
+        return page_index(df, tmp_path, request.param.rsplit('_', 1)[1])
+    return df, IndexedDataset(df if request.param == 'raw' else compact_frame(df))
+
+
+@pytest.mark.parametrize('sort_by', [None, 'price', 'scraped_at', 'title', 'link'])
+@pytest.mark.parametrize('sort_order', ['asc', 'desc'])
+@pytest.mark.parametrize('min_price,max_price', PRICE_FILTERS)
+def test_offset_pages_match_pandas(frame, sort_by, sort_order, min_price, max_price):
+    df, dataset = frame
+    expected = reference(df, min_price, max_price, sort_by, sort_order)
+    for offset in list(range(0, len(expected) + 1, 37)) + [len(expected) + 5]:
+        total, rows, _ = dataset.query(min_price, max_price, sort_by, sort_order, offset=offset, limit=10)
+        assert total == len(expected)
+        assert_rows(rows, expected.iloc[offset:offset + 10])
+
+
+@pytest.mark.parametrize('sort_by', [None, 'price', 'scraped_at', 'title'])
+@pytest.mark.parametrize('sort_order', ['asc', 'desc'])
+@pytest.mark.parametrize('min_price,max_price', PRICE_FILTERS)
+@pytest.mark.parametrize('limit', [4, 100])
+def test_cursor_pages_cover_result_once(frame, sort_by, sort_order, min_price, max_price, limit):
+    df, dataset = frame
+    expected = reference(df, min_price, max_price, sort_by, sort_order)
+    pages, cursor = [], None
+    while True:
+        total, rows, cursor = dataset.query(min_price, max_price, sort_by, sort_order, limit=limit, cursor=cursor)
+        assert total == len(expected)
+        pages.append(rows)
+        if cursor is None:
+            break
+    assert_rows(pd.concat(pages), expected)
+
+
+def test_cursor_with_offset_skips_after_cursor(listings):
+    df = listings()
+    dataset = IndexedDataset(compact_frame(df))
+    expected = reference(df, sort_by='price', sort_order='desc')
+    _, _, cursor = dataset.query(sort_by='price', sort_order='desc', limit=20)
+    _, rows, _ = dataset.query(sort_by='price', sort_order='desc', limit=10, offset=5, cursor=cursor)
+    assert_rows(rows, expected.iloc[25:35])
+
+
+def test_fields_keep_requested_columns(listings):
+    df = listings()
+    dataset = IndexedDataset(compact_frame(df))
+    _, rows, _ = dataset.query(sort_by='price', limit=5, fields=['link', 'price'])
+    assert list(rows.columns) == ['link', 'price']
+    assert_rows(rows, reference(df, sort_by='price')[['link', 'price']].iloc[:5])
+
+
+def test_invalid_cursor(listings):
+    dataset = IndexedDataset(compact_frame(listings()))
+    with pytest.raises(InvalidCursor):
+        dataset.query(sort_by='price', cursor='not-a-cursor')
@@ -0,0 +1,65 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import storage
+from storage import load_history, migrate_csv_history, needs_migration
+
+
+@pytest.fixture
+def history_csv(tmp_path, make_listings):
+    path = str(tmp_path / 'history.csv')
+    make_listings(500, listings=40, seed=7).to_csv(path, index=False)
+    return path
+
+
+def expected_history(csv_path):
+    # В истории одна строка на пару (объявление, цена) - первая встреченная
+    df = pd.read_csv(csv_path).drop_duplicates(['id', 'price'])
+    return df.reset_index(drop=True)
+
+
+def interrupt_after(monkeypatch, chunks):
+    calls = []
+    insert = storage.insert_history
+
+    def failing(conn, df):
+        if len(calls) == chunks:
+            raise KeyboardInterrupt
+        calls.append(len(df))
+        return insert(conn, df)
+
+    monkeypatch.setattr(storage, 'insert_history', failing)
+
+
+def test_retry_after_interrupted_migration(tmp_path, history_csv, monkeypatch):
+    db_path = str(tmp_path / 'history.sqlite')
+    interrupt_after(monkeypatch, 2)
+    with pytest.raises(KeyboardInterrupt):
+        migrate_csv_history(history_csv, db_path, chunksize=100)
+
+    # Недоделанная база не появилась под своим именем, CSV остался на месте
+    assert not os.path.exists(db_path)
+    assert os.path.exists(db_path + '.migrating')
+    assert needs_migration(history_csv, db_path)
+
+    monkeypatch.undo()
+    migrate_csv_history(history_csv, db_path, chunksize=100)
+
+    assert not needs_migration(history_csv, db_path)
+    assert not os.path.exists(db_path + '.migrating')
+    pd.testing.assert_frame_equal(load_history(db_path), expected_history(history_csv + '.migrated'))
+
+
+def test_retry_after_interruption_before_csv_rename(tmp_path, history_csv):
+    # База уже на месте, а CSV не переименован: повтор дописывает в нее строки без дублей
+    db_path = str(tmp_path / 'history.sqlite')
+    migrate_csv_history(history_csv, db_path, chunksize=100)
+    shutil.copy(history_csv + '.migrated', history_csv)
+    assert needs_migration(history_csv, db_path)
+
+    assert migrate_csv_history(history_csv, db_path, chunksize=100) == 0
+    assert not needs_migration(history_csv, db_path)
+    pd.testing.assert_frame_equal(load_history(db_path), expected_history(history_csv + '.migrated'))
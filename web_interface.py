@@ -1,21 +1,87 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 import requests
 import pandas as pd
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
+# Ответы API кэшируются в интерфейсе на это время, чтобы перерисовка страницы не ходила в API заново
+UI_CACHE_SECONDS = int(os.getenv("UI_CACHE_SECONDS", "60"))
+API_TIMEOUT = float(os.getenv("UI_API_TIMEOUT", "10"))
+
+
+@st.cache_resource
+def api_session():
+    # Одна сессия с пулом соединений на весь процесс Streamlit
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_data(ttl=UI_CACHE_SECONDS, show_spinner=False)
+def fetch_json(path, params=None):
+    # Возвращаем (код ответа, json), чтобы ошибки API тоже кэшировались и не повторялись на каждой перерисовке
+    params = {key: value for key, value in (params or {}).items() if value is not None}
+    response = api_session().get(f"{API_BASE_URL}/{path}", params=params, timeout=API_TIMEOUT)
+    if response.status_code != 200:
+        return response.status_code, None
+    return response.status_code, response.json()
+
+
+def fetch_all(requests_by_name):
+    # Независимые запросы к API выполняются одновременно
+    with ThreadPoolExecutor(max_workers=len(requests_by_name)) as executor:
+        futures = {
+            name: executor.submit(fetch_json, path, params)
+            for name, (path, params) in requests_by_name.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
+def show_stats(stats):
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Всего записей", stats["total_records"])
+    with col2:
+        st.metric("Мин. цена", f"{stats['price_stats']['min'] or 0:,.0f} ₽")
+    with col3:
+        st.metric("Макс. цена", f"{stats['price_stats']['max'] or 0:,.0f} ₽")
+    with col4:
+        st.metric("Средняя цена", f"{stats['price_stats']['mean'] or 0:,.0f} ₽")
+
+
+def show_histogram(histogram):
+    if not histogram["bins"]:
+        st.info("Нет цен для гистограммы")
+        return
+    bins = pd.DataFrame(histogram["bins"])
+    bins.index = [f"{start:,.0f}–{end:,.0f}" for start, end in zip(bins["start"], bins["end"])]
+    st.bar_chart(bins["count"])
+
+
+def show_timeseries(timeseries):
+    if not timeseries["points"]:
+        st.info("В истории пока нет данных за выбранный период")
+        return
+    points = pd.DataFrame(timeseries["points"]).set_index("period_start")
+    columns = [column for column in ["p10_price", "p25_price", "median_price", "p75_price", "p90_price"]
+               if column in points.columns]
+    st.line_chart(points[columns])
 
-API_BASE_URL = "http://localhost:8000/api"
 
 def main():
     st.title("Real Estate Data Explorer")
     st.write("Интерфейс для просмотра данных о недвижимости")
 
     try:
-        response = requests.get(f"{API_BASE_URL}/files")
-        if response.status_code == 200:
-            files = response.json()
-            
+        status, files = fetch_json("files")
+        if status == 200:
             st.sidebar.title("Фильтры")
-            
+
             selected_file = st.sidebar.selectbox(
                 "Выберите файл",
                 [f["filename"] for f in files],
@@ -42,48 +108,68 @@ def main():
             limit = st.sidebar.slider("Количество записей", 1, 100, 10)
             offset = st.sidebar.number_input("Смещение", 0, 1000, 0)
 
+            st.sidebar.subheader("Графики")
+            bins = st.sidebar.slider("Интервалов гистограммы", 5, 100, 20)
+            period = st.sidebar.selectbox("Период динамики", ["day", "week", "month"], index=0)
+
+            price_filter = {
+                "min_price": min_price if min_price > 0 else None,
+                "max_price": max_price if max_price < 1000000 else None,
+            }
             params = {
                 "filename": selected_file,
                 "limit": limit,
                 "offset": offset,
-                "min_price": min_price if min_price > 0 else None,
-                "max_price": max_price if max_price < 1000000 else None,
                 "sort_by": sort_by,
-                "sort_order": sort_order
+                "sort_order": sort_order,
+                **price_filter
             }
 
-            response = requests.get(f"{API_BASE_URL}/data", params=params)
-            if response.status_code == 200:
-                data = response.json()
-                
+            # Графики строятся на стороне API по агрегатам, сюда приходят только интервалы и точки ряда
+            results = fetch_all({
+                "data": ("data", params),
+                "stats": ("stats", {"filename": selected_file}),
+                "histogram": ("histogram", {"filename": selected_file, "bins": bins, **price_filter}),
+                "timeseries": ("timeseries", {"period": period}),
+            })
+
+            status, data = results["data"]
+            if status == 200:
                 st.subheader("Статистика")
-                stats_response = requests.get(f"{API_BASE_URL}/stats", params={"filename": selected_file})
-                if stats_response.status_code == 200:
-                    stats = stats_response.json()
-                    col1, col2, col3, col4 = st.columns(4)
-                    with col1:
-                        st.metric("Всего записей", stats["total_records"])
-                    with col2:
-                        st.metric("Мин. цена", f"{stats['price_stats']['min']:,.0f} ₽")
-                    with col3:
-                        st.metric("Макс. цена", f"{stats['price_stats']['max']:,.0f} ₽")
-                    with col4:
-                        st.metric("Средняя цена", f"{stats['price_stats']['mean']:,.0f} ₽")
-                
+                stats_status, stats = results["stats"]
+                if stats_status == 200:
+                    show_stats(stats)
+
+                st.subheader("Распределение цен")
+                histogram_status, histogram = results["histogram"]
+                if histogram_status == 200:
+                    show_histogram(histogram)
+                else:
+                    st.warning(f"Не удалось получить гистограмму: {histogram_status}")
+
+                st.subheader("Динамика цен по истории")
+                timeseries_status, timeseries = results["timeseries"]
+                if timeseries_status == 200:
+                    show_timeseries(timeseries)
+                elif timeseries_status == 404:
+                    st.info("История цен еще не накоплена")
+                else:
+                    st.warning(f"Не удалось получить динамику цен: {timeseries_status}")
+
                 st.subheader("Данные")
                 if data["data"]:
                     df = pd.DataFrame(data["data"])
                     st.dataframe(df)
-                    
+
                     st.write(f"Показано {len(df)} из {data['total']} записей")
                 else:
                     st.warning("Нет данных, соответствующих выбранным фильтрам")
             else:
-                st.error(f"Ошибка при получении данных: {response.status_code}")
+                st.error(f"Ошибка при получении данных: {status}")
         else:
             st.error("Не удалось получить список файлов")
     except Exception as e:
         st.error(f"Произошла ошибка: {str(e)}")
 
 if __name__ == "__main__":
-    main() 
+    main()